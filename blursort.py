@@ -0,0 +1,297 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: Headless version of the Blur Sort tab. Scores a folder of images and sorts them into Keep and Discard folders
+# without a display, and writes per-file results as JSON or CSV so it can run on an ingest server.
+#
+# Example:
+#   python blursort.py /mnt/cards/shoot --threshold 120 --transfer hardlink --workers 8 --report results.csv
+
+import os
+import sys
+import csv
+import json
+import argparse
+import contextlib
+
+from modules.blurfuncs import FAST_SCALE, METRICS, BlurScorer, fit_gain, sort_decision
+from modules.scanfuncs import scan_images
+from modules.scorecache import ScoreCache
+from modules.transferfuncs import (
+    DEFAULT_CONCURRENCY,
+    STRATEGIES,
+    TransferEngine,
+    TransferManifest,
+)
+
+# Columns of the CSV report, also the keys of each JSON result
+REPORT_FIELDS = (
+    "path",
+    "blur_val",
+    "decision",
+    "cached",
+    "score_seconds",
+    "dest",
+    "method",
+    "transfer_seconds",
+    "error",
+)
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line
+
+    :param argv: arguments, defaults to sys.argv
+    :type argv: list | None
+    """
+    parser = argparse.ArgumentParser(
+        description="Sort a folder of photos into Keep and Discard by blurriness."
+    )
+    parser.add_argument("folder", help="folder of images to sort")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=100,
+        help="images scoring below this are discarded (default: 100)",
+    )
+    parser.add_argument(
+        "--metric", choices=METRICS, default="global", help="score to threshold"
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help=f"score at 1/{FAST_SCALE} resolution",
+    )
+    parser.add_argument(
+        "--recursive", action="store_true", help="also sort images in subfolders"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="scoring workers (default: cores)"
+    )
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="score on threads instead of processes",
+    )
+    parser.add_argument(
+        "--transfer", choices=STRATEGIES, default="copy", help="how files are sorted"
+    )
+    parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"files transferred at once (default: {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="folder the Keep and Discard folders are created in (default: the sorted folder)",
+    )
+    parser.add_argument("--keep-folder", default="Keep", help="name of the Keep folder")
+    parser.add_argument(
+        "--discard-folder", default="Discard", help="name of the Discard folder"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="score and report without moving files"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="do not read or write the score cache"
+    )
+    parser.add_argument(
+        "--format", choices=("json", "csv"), default=None, help="report format"
+    )
+    parser.add_argument(
+        "--report",
+        default="-",
+        help="report file, '-' for standard output (format follows the extension)",
+    )
+    return parser.parse_args(argv)
+
+
+def score_folder(args):
+    """
+    Scores every image in the folder
+
+    :param args: parsed command line
+    :type args: argparse.Namespace
+
+    :return: one result dictionary per image, in scan order
+    :rtype: list
+    """
+    scorer = BlurScorer(
+        workers=args.workers,
+        use_processes=not args.threads,
+        scale=FAST_SCALE if args.fast else 1,
+        metric=args.metric,
+    )
+    cache = None
+    if not args.no_cache:
+        try:
+            cache = ScoreCache.for_folder(args.folder)
+        except Exception as e:
+            # A read-only card or share is still sorted, just without the cache
+            print(f"Score cache unavailable: {e}")
+
+    # Custom Keep and Discard folders from an earlier run are not scored again
+    output = args.output or args.folder
+    sort_folders = tuple(
+        os.path.join(output, name, "")
+        for name in (args.keep_folder, args.discard_folder)
+    )
+
+    results = []
+
+    def found_images():
+        for image_path in scan_images(args.folder, args.recursive):
+            if image_path.startswith(sort_folders):
+                continue
+            results.append({field: None for field in REPORT_FIELDS})
+            results[-1]["path"] = image_path
+            yield image_path
+
+    try:
+        for index, blurVal in scorer.score(found_images(), cache):
+            results[index]["blur_val"] = blurVal
+
+        # Reduced resolution values only match the threshold once fitted to this folder
+        if args.fast:
+            gain = fit_gain(
+                [result["path"] for result in results],
+                [result["blur_val"] for result in results],
+                FAST_SCALE,
+                args.metric,
+                args.workers,
+                not args.threads,
+                cache,
+            )
+            print(f"Fast scoring gain for this folder: {gain:.4g}")
+            for result in results:
+                if result["blur_val"] is not None:
+                    result["blur_val"] *= gain
+    finally:
+        if cache:
+            cache.close()
+
+    for index, result in enumerate(results):
+        result["cached"] = index not in scorer.timings
+        result["score_seconds"] = scorer.timings.get(index)
+        result["decision"] = sort_decision(result["blur_val"], args.threshold)
+        if result["blur_val"] is None:
+            result["error"] = "Could not read image"
+    return results
+
+
+def sort_results(args, results):
+    """
+    Transfers the scored images into the Keep and Discard folders and records the outcome in results
+
+    :param args: parsed command line
+    :type args: argparse.Namespace
+    :param results: results from score_folder
+    :type results: list
+
+    :return: transfer statistics
+    :rtype: dict
+    """
+    output = args.output or args.folder
+    folders = {"Keep": args.keep_folder, "Discard": args.discard_folder}
+    for folder_name in folders.values():
+        os.makedirs(os.path.join(output, folder_name), exist_ok=True)
+
+    by_path = {result["path"]: result for result in results}
+    jobs = [
+        (result["path"], os.path.join(output, folders[result["decision"]]))
+        for result in results
+        if result["decision"]
+    ]
+
+    # The manifest lives with the Keep and Discard folders, so a read-only source can be sorted. Without
+    # --output that is the sorted folder, where the GUI can undo this run too
+    engine = TransferEngine(
+        TransferManifest(output, args.transfer, root=args.folder),
+        concurrency=args.io_threads,
+    )
+    engine.start(jobs)
+    while True:
+        message = engine.progress.get()
+        if message[0] == "file":
+            _, src, dest_folder, dest, method, seconds = message
+            by_path[src]["dest"] = dest
+            by_path[src]["method"] = method
+            by_path[src]["transfer_seconds"] = seconds
+        elif message[0] == "error":
+            _, src, dest_folder, error = message
+            by_path[src]["error"] = error
+        elif message[0] == "done":
+            return message[1]
+
+
+def write_report(args, results, summary):
+    """
+    Writes the per-file results as JSON or CSV
+
+    :param args: parsed command line
+    :type args: argparse.Namespace
+    :param results: per-file results
+    :type results: list
+    :param summary: totals for the run
+    :type summary: dict
+    """
+    report_format = args.format
+    if not report_format:
+        report_format = "csv" if args.report.lower().endswith(".csv") else "json"
+
+    if args.report == "-":
+        file = sys.stdout
+    else:
+        file = open(args.report, "w", newline="", encoding="utf-8")
+    try:
+        if report_format == "csv":
+            writer = csv.DictWriter(file, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump({"summary": summary, "files": results}, file, indent=2)
+            file.write("\n")
+    finally:
+        if file is not sys.stdout:
+            file.close()
+
+
+def main(argv=None):
+    """
+    Runs a headless blur sort
+
+    :param argv: arguments, defaults to sys.argv
+    :type argv: list | None
+
+    :return: exit code, 1 if any image could not be read or transferred
+    :rtype: int
+    """
+    args = parse_args(argv)
+    if not os.path.isdir(args.folder):
+        print(f"Error: {args.folder} is not a folder", file=sys.stderr)
+        return 2
+
+    # Keep progress messages out of a report written to standard output
+    with contextlib.redirect_stdout(sys.stderr):
+        results = score_folder(args)
+    summary = {
+        "folder": args.folder,
+        "threshold": args.threshold,
+        "metric": args.metric,
+        "images": len(results),
+        "keep": sum(result["decision"] == "Keep" for result in results),
+        "discard": sum(result["decision"] == "Discard" for result in results),
+        "score_seconds": sum(result["score_seconds"] or 0 for result in results),
+    }
+    if not args.dry_run:
+        with contextlib.redirect_stdout(sys.stderr):
+            summary["transfer"] = sort_results(args, results)
+
+    write_report(args, results, summary)
+    return 1 if any(result["error"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
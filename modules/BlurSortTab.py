@@ -4,23 +4,91 @@
 # The Discard and Keep folders are created inside the folder being sorted.
 
 import tkinter as tk
-from tkinter import filedialog, ttk
-import cv2
+from tkinter import filedialog, messagebox, ttk
+from PIL import Image, ImageTk
 import os
+import math
+import queue
 import threading
-from shutil import copy2  # copy2 preserves more metadata
+import numpy as np
+
+from modules.blurfuncs import (
+    FAST_SCALE,
+    BlurScorer,
+    ScoreIndex,
+    calibrate_fast_scoring,
+    compute_blurVal,
+    fit_gain,
+    format_calibration_report,
+    sort_decision,
+)
+from modules.hashfuncs import HashIndexer, find_groups, sharpest_in_groups
+from modules.previewfuncs import preview_stats
+from modules.qualityfuncs import (
+    QualityAnalyzer,
+    failed_rules,
+    parse_rules,
+    quality_decision,
+    rule_metrics,
+)
+from modules.scanfuncs import scan_images
+from modules.scorecache import ScoreCache
+from modules.thumbcache import shared_cache
+from modules.transferfuncs import (
+    DEFAULT_CONCURRENCY,
+    STRATEGY_LABELS,
+    TransferEngine,
+    TransferManifest,
+    format_stats,
+    latest_manifest,
+    revert_manifest,
+)
+
+# Number of images compared by the fast scoring report
+CALIBRATION_SAMPLE = 50
+
+# Scores the threshold slider can be applied to
+SCORE_OPTIONS = {
+    "Whole Image": "global",
+    "Sharpest Tile": "max_tile",
+    "Sharpest 10% of Tiles": "top_k",
+    "Center Weighted": "center",
+}
+
+# How often the GUI checks the transfer engine for progress
+TRANSFER_POLL_MS = 50
+
+# Threshold preview: histogram size, borderline thumbnails per side, and how long the slider
+# has to rest before those thumbnails are decoded
+HIST_WIDTH = 300
+HIST_HEIGHT = 80
+BORDERLINE_COUNT = 3
+BORDERLINE_SIZE = 80
+PREVIEW_DELAY_MS = 200
 
 
 class BlurSortApp:
-    def __init__(self, notebook):
+    def __init__(self, notebook, workers=None, use_processes=True):
         self.root = tk.Frame(notebook)
 
+        # Blur scoring engine (process pool, falls back to threads)
+        self.scorer = BlurScorer(workers=workers, use_processes=use_processes)
+
         # Initialize Variables
         self.folder_path = None
         self.sort_progress_bar = None
         self.picturesList = []
         self.blurValues = []  # blur vals
+        self.qualityValues = []  # quality metrics per image, only when rules are set
+        self.rules = []
+        self.passing_above = None  # images passing the rules, counted from each sorted position up
+        self.groups = []  # bursts of near-duplicate images, lists of indexes
+        self.group_decisions = {}  # image index -> "Keep" or "Discard" for grouped images
         self.num_blurry = 0
+        self.transfer_engine = None
+        self.score_index = None  # sorted blur values for the threshold preview
+        self.preview_frame = None
+        self.borderline_job = None
 
         # select folder
         self.select_button = tk.Button(
@@ -31,6 +99,16 @@ class BlurSortApp:
         )
         self.select_button.pack()
 
+        # Include subfolders (such as per-card DCIM folders)
+        self.recursive_value = tk.BooleanVar()
+        self.recursive_checkbox = tk.Checkbutton(
+            self.root,
+            text="Include Subfolders",
+            variable=self.recursive_value,
+            font=("Helvetica", 12),
+        )
+        self.recursive_checkbox.pack()
+
         # Threshold Options
         self.init_threshold_options()
 
@@ -52,6 +130,8 @@ class BlurSortApp:
             from_=0,
             to=100,
             orient="horizontal",
+            length=HIST_WIDTH,
+            command=self.update_preview,
             # variable=current_value
         )
         self.slider.set(100)
@@ -75,6 +155,114 @@ class BlurSortApp:
 
         self.threshold_frame2.pack()
 
+        # Fast scoring decodes at reduced resolution
+        self.threshold_frame3 = tk.Frame(self.root)
+
+        self.fast_label = tk.Label(
+            self.threshold_frame3, text="Fast Scoring:", font=("Helvetica", 12)
+        )
+        self.fast_label.pack(side="left")
+
+        self.fast_value = tk.BooleanVar()
+        self.fast_checkbox = tk.Checkbutton(
+            self.threshold_frame3, variable=self.fast_value
+        )
+        self.fast_checkbox.pack(side="right")
+
+        self.threshold_frame3.pack()
+
+        # Which sharpness score the threshold applies to. Tile scores keep shallow depth of field portraits
+        self.threshold_frame4 = tk.Frame(self.root)
+
+        self.score_label = tk.Label(
+            self.threshold_frame4, text="Score:", font=("Helvetica", 12)
+        )
+        self.score_label.pack(side="left")
+
+        self.score_var = tk.StringVar(value=list(SCORE_OPTIONS)[0])
+        self.score_dropdown = ttk.Combobox(
+            self.threshold_frame4,
+            textvariable=self.score_var,
+            values=list(SCORE_OPTIONS),
+            state="readonly",
+        )
+        self.score_dropdown.pack(side="right")
+
+        self.threshold_frame4.pack()
+
+        # How sorted files get into Keep and Discard
+        self.threshold_frame5 = tk.Frame(self.root)
+
+        self.transfer_label = tk.Label(
+            self.threshold_frame5, text="Transfer:", font=("Helvetica", 12)
+        )
+        self.transfer_label.pack(side="left")
+
+        self.transfer_var = tk.StringVar(value=list(STRATEGY_LABELS)[0])
+        self.transfer_dropdown = ttk.Combobox(
+            self.threshold_frame5,
+            textvariable=self.transfer_var,
+            values=list(STRATEGY_LABELS),
+            state="readonly",
+        )
+        self.transfer_dropdown.pack(side="right")
+
+        self.threshold_frame5.pack()
+
+        # Files transferred at once
+        self.threshold_frame6 = tk.Frame(self.root)
+
+        self.concurrency_label = tk.Label(
+            self.threshold_frame6, text="Transfer Threads:", font=("Helvetica", 12)
+        )
+        self.concurrency_label.pack(side="left")
+
+        self.concurrency_var = tk.IntVar(value=DEFAULT_CONCURRENCY)
+        self.concurrency_spinbox = tk.Spinbox(
+            self.threshold_frame6,
+            from_=1,
+            to=32,
+            width=5,
+            textvariable=self.concurrency_var,
+        )
+        self.concurrency_spinbox.pack(side="right")
+
+        self.threshold_frame6.pack()
+
+        # Extra quality rules, such as "highlights <= 0.02; noise <= 4". Images must pass them and the threshold to be kept
+        self.threshold_frame7 = tk.Frame(self.root)
+
+        self.rules_label = tk.Label(
+            self.threshold_frame7, text="Quality Rules:", font=("Helvetica", 12)
+        )
+        self.rules_label.pack(side="left")
+
+        self.rules_var = tk.StringVar()
+        self.rules_entry = tk.Entry(
+            self.threshold_frame7, textvariable=self.rules_var, width=30
+        )
+        self.rules_entry.pack(side="right")
+
+        self.threshold_frame7.pack()
+
+        # Burst culling, keeps only the sharpest of each group of near-duplicate frames
+        self.threshold_frame8 = tk.Frame(self.root)
+
+        self.bursts_label = tk.Label(
+            self.threshold_frame8,
+            text="Keep Sharpest of Bursts:",
+            font=("Helvetica", 12),
+        )
+        self.bursts_label.pack(side="left")
+
+        self.bursts_value = tk.BooleanVar()
+        self.bursts_checkbox = tk.Checkbutton(
+            self.threshold_frame8, variable=self.bursts_value
+        )
+        self.bursts_checkbox.pack(side="right")
+
+        self.threshold_frame8.pack()
+
         # Sort Button
         self.sort_button = tk.Button(
             self.root, text="Sort", command=self.sort, font=("Helvetica", 12)
@@ -82,6 +270,36 @@ class BlurSortApp:
         self.sort_button.pack(pady=10)
         self.sort_button.config(state=tk.DISABLED)  # Set disabled as default
 
+        # Cancel Button, stops a running sort
+        self.cancel_button = tk.Button(
+            self.root,
+            text="Cancel Sort",
+            command=self.cancel_sort,
+            font=("Helvetica", 12),
+        )
+        self.cancel_button.pack()
+        self.cancel_button.config(state=tk.DISABLED)
+
+        # Compares fast scoring decisions against full resolution
+        self.report_button = tk.Button(
+            self.root,
+            text="Fast Scoring Report",
+            command=self.show_calibration_report,
+            font=("Helvetica", 12),
+        )
+        self.report_button.pack()
+        self.report_button.config(state=tk.DISABLED)
+
+        # Undo Button, reverts the last sort using its manifest
+        self.undo_button = tk.Button(
+            self.root,
+            text="Undo Last Sort",
+            command=self.undo_sort,
+            font=("Helvetica", 12),
+        )
+        self.undo_button.pack(pady=10)
+        self.undo_button.config(state=tk.DISABLED)
+
     def set_default_threshold(self):
         if self.checkbox_value.get():  # self.checkbox.get() == True:
             self.slider.set(100)
@@ -93,17 +311,29 @@ class BlurSortApp:
         """
         Handles folder selections
         """
+        try:
+            self.rules = parse_rules(self.rules_var.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+
         # If a different folder is loaded already
         if self.folder_path:
             # Reset initialized variables or any packed widgets
             self.picturesList.clear()
             self.blurValues.clear()
+            self.qualityValues = []
             self.sort_progress_bar.pack_forget()
             self.sort_progress_label.pack_forget()
             self.completion_label.pack_forget()
             self.result_label.pack_forget()
             self.sort_button.config(state=tk.DISABLED)
+            self.report_button.config(state=tk.DISABLED)
+            self.undo_button.config(state=tk.DISABLED)
             self.num_blurry = 0
+            self.score_index = None
+            if self.preview_frame:
+                self.preview_frame.pack_forget()
 
             self.folder_path = filedialog.askdirectory()
             self.init_vars()  # which will display an image for the first time
@@ -116,13 +346,14 @@ class BlurSortApp:
         """
         Starts the process of the computing blur values
         """
-        for filename in os.listdir(self.folder_path):
-            if filename.lower().endswith(("png", "jpg", "jpeg", "bmp")):
-                image_path = os.path.join(self.folder_path, filename)
-                self.picturesList.append(image_path)
-
-        # Compute blur values for each image
+        # Compute blur values for each image while the folder is scanned
         # self.blurValues = list(map(self.compute_blurVal, self.picturesList))
+        self.scorer.scale = FAST_SCALE if self.fast_value.get() else 1
+        self.scorer.metric = SCORE_OPTIONS[self.score_var.get()]
+        self.recursive = self.recursive_value.get()
+        self.bursts = self.bursts_value.get()
+        self.groups = []
+        self.group_decisions = {}
         threading.Thread(target=self.process_images, daemon=True).start()
 
         self.select_button.config(state=tk.DISABLED)
@@ -137,7 +368,7 @@ class BlurSortApp:
 
     def process_images(self):
         """
-        Applies laplacian to compute a blur value to a list of images using map and a thread
+        Applies laplacian to compute a blur value to a list of images using a worker pool and a thread
         """
         # Progress bar for computing blur values per image
         self.blur_progress_label = tk.Label(
@@ -145,18 +376,102 @@ class BlurSortApp:
         )
         self.blur_progress_label.pack()
         self.blur_progress_bar = ttk.Progressbar(
-            self.root, orient=tk.HORIZONTAL, length=300, maximum=len(self.picturesList)
+            self.root, orient=tk.HORIZONTAL, length=300, maximum=1
         )
         self.blur_progress_bar.pack(pady=10)
 
-        # Compute the blur values for each image
-        for pic in self.picturesList:
-            self.blurValues.append(self.compute_blurVal(pic))
-            self.blur_progress_bar["value"] += 1
+        def found_images():
+            # Record each image as the scan finds it, the scorer starts on it right away
+            for image_path in scan_images(self.folder_path, self.recursive):
+                self.picturesList.append(image_path)
+                self.blurValues.append(None)
+                self.qualityValues.append(None)
+                self.blur_progress_bar["maximum"] = len(self.picturesList)
+                yield image_path
+
+        # Compute the blur values for each image, results arrive in completion order.
+        # Values cached from an earlier visit to this folder come back first
+        self.blurValues = []
+        self.qualityValues = []
+        try:
+            cache = ScoreCache.for_folder(self.folder_path)
+        except Exception as e:
+            print(f"Score cache unavailable: {e}")
+            cache = None
+        try:
+            if self.rules:
+                self.analyze_images(found_images())
+            else:
+                for index, blurVal in self.scorer.score(found_images(), cache):
+                    self.blurValues[index] = blurVal
+                    self.blur_progress_bar["value"] += 1
+
+            # Reduced resolution values only match the slider once fitted to this folder
+            if self.scorer.scale > 1:
+                self.apply_fast_gain(cache)
+
+            # Near-duplicate frames, only the sharpest of each burst is kept
+            if self.bursts:
+                hashes = HashIndexer(
+                    self.scorer.workers, self.scorer.use_processes
+                ).hash_all(self.picturesList, cache)
+                self.groups = find_groups(hashes)
+                self.group_decisions = sharpest_in_groups(self.groups, self.blurValues)
+        except OSError as e:
+            print(f"Error scanning folder: {e}")
+        finally:
+            if cache:
+                cache.close()
 
         # End thread and update the gui
         self.root.after(0, self.update_gui)
 
+    def analyze_images(self, image_paths):
+        """
+        Computes the quality metrics the rules need, decoding each image once. The laplacian value drives the slider as usual
+
+        :param image_paths: Paths of the images to analyze
+        :type image_paths: Iterable
+        """
+        analyzer = QualityAnalyzer(
+            rule_metrics(self.rules),
+            workers=self.scorer.workers,
+            use_processes=self.scorer.use_processes,
+            scale=self.scorer.scale,
+            blur_metric=self.scorer.metric,
+        )
+        try:
+            for index, values in analyzer.analyze(image_paths):
+                self.qualityValues[index] = values
+                self.blurValues[index] = values["laplacian"] if values else None
+                self.blur_progress_bar["value"] += 1
+        except OSError as e:
+            print(f"Error scanning folder: {e}")
+        print(analyzer.cost_report())
+
+    def apply_fast_gain(self, cache):
+        """
+        Brings Fast Scoring values onto the full resolution scale, scoring a small sample of the folder at full resolution
+
+        :param cache: Score cache for the sample, None if unavailable
+        :type cache: ScoreCache | None
+        """
+        gain = fit_gain(
+            self.picturesList,
+            self.blurValues,
+            self.scorer.scale,
+            self.scorer.metric,
+            self.scorer.workers,
+            self.scorer.use_processes,
+            cache,
+        )
+        print(f"Fast scoring gain for this folder: {gain:.4g}")
+        for index, blurVal in enumerate(self.blurValues):
+            if blurVal is not None:
+                self.blurValues[index] = blurVal * gain
+            if self.qualityValues[index]:
+                self.qualityValues[index]["laplacian"] = self.blurValues[index]
+
     def compute_blurVal(self, image_path):
         """
         Computes the laplacian blur value of one image
@@ -164,26 +479,34 @@ class BlurSortApp:
         :param image_path: path to the image file
         :type image_path: str
         """
-        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        print(cv2.Laplacian(image, cv2.CV_64F).var())
-        return cv2.Laplacian(image, cv2.CV_64F).var()
+        return compute_blurVal(image_path)
 
     def update_gui(self):
         """
         Updates gui after blur values of images are computed
         """
         print("Image processing complete!")
+        print(preview_stats.report(self.folder_path))
 
         # Notify user of finished blur analysis
-        self.result_label.config(text="Blur Analysis complete!")
+        if self.bursts:
+            self.result_label.config(
+                text=f"Blur Analysis complete! {len(self.groups)} bursts found"
+            )
+        else:
+            self.result_label.config(text="Blur Analysis complete!")
         self.result_label.pack()
 
         self.sort_button.config(state=tk.NORMAL)  # Set sort button normal
+        self.report_button.config(state=tk.NORMAL)
 
         # Remove blur progress bar
         self.blur_progress_label.pack_forget()
         self.blur_progress_bar.pack_forget()
 
+        # Threshold preview
+        self.init_preview()
+
         # Progress bar
         self.sort_progress_label = tk.Label(
             self.root, text="Progress:", font=("Helvetica", 12)
@@ -198,6 +521,160 @@ class BlurSortApp:
         self.completion_label = tk.Label(self.root, text="", font=("Helvetica", 12))
         self.completion_label.pack()
 
+    def init_preview(self):
+        """
+        Builds the threshold preview (counts, score histogram and borderline thumbnails)
+        and fits the slider range to the computed blur values
+        """
+        self.score_index = ScoreIndex(self.blurValues)
+        if self.rules or self.group_decisions:
+            # Keep count for a threshold = images above the cut that also pass the rules
+            # and are not a blurrier frame of a burst
+            passes = np.array(
+                [
+                    self.group_decisions.get(index) != "Discard"
+                    and not failed_rules(self.qualityValues[index], self.rules)
+                    for index in self.score_index.order
+                ],
+                dtype=int,
+            )
+            self.passing_above = np.append(np.cumsum(passes[::-1])[::-1], 0)
+        else:
+            self.passing_above = None
+
+        # Slider range follows the real scores instead of a fixed 0-100
+        upper = self.score_index.upper
+        self.slider.config(
+            to=math.ceil(upper), resolution=1 if upper >= 50 else 0.1
+        )
+
+        if self.preview_frame:
+            self.preview_frame.destroy()
+        self.preview_frame = tk.Frame(self.root)
+
+        self.counts_label = tk.Label(self.preview_frame, font=("Helvetica", 12))
+        self.counts_label.pack()
+
+        # Histogram bars are drawn once, only the cutoff line moves with the slider
+        self.hist_canvas = tk.Canvas(
+            self.preview_frame, width=HIST_WIDTH, height=HIST_HEIGHT, bg="white"
+        )
+        self.hist_canvas.pack(pady=5)
+        hist = self.score_index.hist
+        bar_width = HIST_WIDTH / len(hist)
+        tallest = max(hist.max(), 1) if len(hist) else 1
+        for i, count in enumerate(hist):
+            bar_height = (HIST_HEIGHT - 5) * count / tallest
+            self.hist_canvas.create_rectangle(
+                i * bar_width,
+                HIST_HEIGHT - bar_height,
+                (i + 1) * bar_width,
+                HIST_HEIGHT,
+                fill="gray",
+                outline="",
+            )
+        self.cutoff_line = self.hist_canvas.create_line(
+            0, 0, 0, HIST_HEIGHT, fill="red", width=2
+        )
+
+        # Borderline frames, blurriest kept and sharpest discarded
+        self.borderline_frame = tk.Frame(self.preview_frame)
+        self.borderline_frame.pack()
+
+        self.preview_frame.pack(pady=5)
+        self.update_preview()
+
+    def update_preview(self, value=None):
+        """
+        Updates counts and the histogram cutoff for the current slider value. Each update is a binary search
+
+        :param value: slider value passed by the Scale widget
+        :type value: str | None
+        """
+        if not self.score_index:
+            return
+
+        threshold = float(self.slider.get())
+        keep, discard = self.score_index.counts(threshold)
+        if self.passing_above is None:
+            self.counts_label.config(text=f"Keep: {keep}    Discard: {discard}")
+        else:
+            passing = int(self.passing_above[discard])
+            self.counts_label.config(
+                text=f"Keep: {passing}    Discard: {discard + keep - passing}    "
+                f"({keep - passing} fail quality rules or repeat a burst)"
+            )
+
+        x = HIST_WIDTH * min(threshold / self.score_index.upper, 1)
+        self.hist_canvas.coords(self.cutoff_line, x, 0, x, HIST_HEIGHT)
+
+        # Decode thumbnails only once the slider rests
+        if self.borderline_job:
+            self.root.after_cancel(self.borderline_job)
+        self.borderline_job = self.root.after(
+            PREVIEW_DELAY_MS, self.show_borderline
+        )
+
+    def show_borderline(self):
+        """
+        Shows thumbnails of the images on either side of the threshold
+        """
+        self.borderline_job = None
+        for widget in self.borderline_frame.winfo_children():
+            widget.destroy()
+
+        threshold = float(self.slider.get())
+        below, above = self.score_index.borderline(threshold, BORDERLINE_COUNT)
+        for index, color in [(i, "red") for i in below] + [(i, "green") for i in above]:
+            try:
+                image = shared_cache().load(
+                    self.picturesList[index], (BORDERLINE_SIZE, BORDERLINE_SIZE)
+                )
+                photo = ImageTk.PhotoImage(image)
+            except Exception as e:
+                print(f"Could not load thumbnail: {e}")
+                continue
+
+            cell = tk.Frame(self.borderline_frame, bg=color, padx=2, pady=2)
+            thumb_label = tk.Label(cell, image=photo)
+            thumb_label.image = photo  # Prevent garbage collection
+            thumb_label.pack()
+            tk.Label(cell, text=f"{self.blurValues[index]:.1f}").pack(fill=tk.X)
+            cell.pack(side="left", padx=2)
+
+    def show_calibration_report(self):
+        """
+        Compares fast scoring against full resolution scoring on a sample of the folder
+        """
+        self.report_button.config(state=tk.DISABLED)
+        sample = self.picturesList[:CALIBRATION_SAMPLE]
+        threshold = self.slider.get()
+
+        def run_report():
+            try:
+                report = calibrate_fast_scoring(
+                    sample,
+                    threshold,
+                    workers=self.scorer.workers,
+                    use_processes=self.scorer.use_processes,
+                )
+                text = format_calibration_report(report)
+                print(text)
+                self.root.after(
+                    0, lambda: messagebox.showinfo("Fast Scoring Report", text)
+                )
+            except Exception as e:
+                self.root.after(
+                    0,
+                    lambda error=e: messagebox.showerror(
+                        "Error", f"Could not build report: {error}"
+                    ),
+                )
+            finally:
+                self.root.after(0, lambda: self.report_button.config(state=tk.NORMAL))
+
+        threading.Thread(target=run_report, daemon=True).start()
+
     # execute keep, dicard, maybe
     def sort(self):
         if self.folder_path:
@@ -207,29 +684,114 @@ class BlurSortApp:
             if not os.path.exists(self.folder_path + "/Discard"):
                 os.mkdir(self.folder_path + "/Discard")
 
-            # execute
-            # self.num_blurry = 0
+            # Decide where every image goes, images that could not be read stay where they are
+            jobs = []
             for i in range(len(self.picturesList)):
                 # print(self.slider.get())
-                if self.blurValues[i] < self.slider.get():
-                    copy2(self.picturesList[i], self.folder_path + "/Discard")
-                    self.num_blurry += 1
+                if self.rules:
+                    decision = quality_decision(
+                        self.qualityValues[i], self.slider.get(), self.rules
+                    )
                 else:
-                    copy2(self.picturesList[i], self.folder_path + "/Keep")
+                    decision = sort_decision(self.blurValues[i], self.slider.get())
+                # Only the sharpest frame of a burst can be kept
+                if decision and self.group_decisions.get(i) == "Discard":
+                    decision = "Discard"
+                if decision:
+                    jobs.append((self.picturesList[i], self.folder_path + "/" + decision))
+
+            try:
+                concurrency = max(self.concurrency_var.get(), 1)
+            except tk.TclError:
+                # The box was left empty or holds something other than a number
+                concurrency = DEFAULT_CONCURRENCY
+
+            # execute in the background, recording each transfer so the sort can be undone
+            self.num_blurry = 0
+            self.sort_progress_bar.config(maximum=max(len(jobs), 1), value=0)
+            manifest = TransferManifest(
+                self.folder_path, STRATEGY_LABELS[self.transfer_var.get()]
+            )
+            self.transfer_engine = TransferEngine(manifest, concurrency=concurrency)
+            self.transfer_engine.start(jobs)
+
+            self.sort_button.config(state=tk.DISABLED)
+            self.cancel_button.config(state=tk.NORMAL)
+            self.completion_label.config(text="Sorting in progress...")
+            self.root.after(TRANSFER_POLL_MS, self.poll_transfer)
 
-                # Update the progress bar
+    def poll_transfer(self):
+        """
+        Reads the transfer engine's progress queue on the Tk thread and updates the GUI
+        """
+        while True:
+            try:
+                message = self.transfer_engine.progress.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == "file":
+                _, src, dest_folder, dest, method, seconds = message
+                if dest_folder == self.folder_path + "/Discard":
+                    self.num_blurry += 1
                 self.sort_progress_bar["value"] += 1
-                self.root.update_idletasks()
+            elif message[0] == "error":
+                _, src, dest_folder, error = message
+                print(f"Could not transfer {src}: {error}")
+                self.sort_progress_bar["value"] += 1
+            elif message[0] == "done":
+                self.finish_sort(message[1])
+                return
 
-            self.completion_label.config(
-                text=f"Sorting Complete! There were {self.num_blurry} blurry images"
-            )
+        self.root.after(TRANSFER_POLL_MS, self.poll_transfer)
 
-            self.select_button.config(state=tk.NORMAL)
-            self.sort_button.config(state=tk.DISABLED)
+    def finish_sort(self, stats):
+        """
+        Updates the GUI once the transfer engine has stopped
+
+        :param stats: transfer statistics of the run
+        :type stats: dict
+        """
+        print(f"Sort transfer: {format_stats(stats)}")
+        if stats["cancelled"]:
+            status = "Sorting Cancelled!"
+        else:
+            status = "Sorting Complete!"
+        self.completion_label.config(
+            text=f"{status} There were {self.num_blurry} blurry images\n"
+            f"{format_stats(stats)}"
+        )
 
-            # self.blurry_label.config(text=str(self.num_blurry)+" pictures are too blurry and have been removed.")
-            # self.blurry_label.pack()
+        self.select_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.undo_button.config(state=tk.NORMAL)
+
+        # self.blurry_label.config(text=str(self.num_blurry)+" pictures are too blurry and have been removed.")
+        # self.blurry_label.pack()
+
+    def cancel_sort(self):
+        """
+        Stops the running sort once the files in flight are done
+        """
+        if self.transfer_engine:
+            self.transfer_engine.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+
+    def undo_sort(self):
+        """
+        Reverts the most recent sort of the folder. Moved files go back, copies and links are removed
+        """
+        manifest_path = latest_manifest(self.folder_path)
+        if not manifest_path:
+            messagebox.showerror("Error", "There is no sort to undo in this folder.")
+            return
+
+        try:
+            reverted = revert_manifest(manifest_path)
+            messagebox.showinfo("Undo Complete", f"{reverted} files were restored.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not undo sort: {e}")
+        self.undo_button.config(state=tk.DISABLED)
 
 
 # -------------
@@ -8,6 +8,8 @@ from tkinter import filedialog, messagebox, ttk
 import threading
 from PIL import Image, ImageTk
 
+from modules.thumbcache import shared_cache
+
 
 class GenerateCritiqueTab:
     def __init__(self, notebook, gemini, dbfuncs):
@@ -153,8 +155,8 @@ class GenerateCritiqueTab:
         """
         try:
             # save image into a variable
-            image = Image.open(file_path)
-            image.thumbnail((400, 300))  # Resize to fit in the window
+            # Resize to fit in the window, from the thumbnail cache or an embedded preview
+            image = shared_cache().load(file_path, (400, 300))
             photo = ImageTk.PhotoImage(image)  # Make image tKinter-compatible
 
             self.image_label.config(image=photo)
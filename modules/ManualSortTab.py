@@ -14,9 +14,36 @@ import tkinter as tk
 
 # from tkinter import *
 from PIL import ImageTk, Image
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 import os
-from shutil import copy2  # copy2 preserves more metadata
+import queue
+import threading
+
+from modules.blurfuncs import BlurScorer
+from modules.exiffuncs import (
+    MetadataIndexer,
+    describe,
+    group_by_camera,
+    order_by_capture,
+)
+from modules.hashfuncs import HashIndexer, find_groups, sharpest_in_groups
+from modules.journalfuncs import FSYNC_SECONDS, SortJournal
+from modules.prefetchfuncs import Prefetcher
+from modules.pyramidfuncs import ImagePyramid
+from modules.scanfuncs import scan_images
+from modules.scorecache import ScoreCache
+from modules.thumbcache import path_key, shared_cache
+from modules.ThumbnailGrid import ThumbnailGrid
+from modules.ZoomView import open_zoom_window
+from modules.transferfuncs import (
+    DEFAULT_CONCURRENCY,
+    STRATEGY_LABELS,
+    TransferEngine,
+    TransferManifest,
+    format_stats,
+    latest_manifest,
+    revert_manifest,
+)
 
 # image not appearing - problem solved - need: self.imgLabel.image = img
 # Branden did the same thing - "to avoid garbage collection"
@@ -25,6 +52,15 @@ from shutil import copy2  # copy2 preserves more metadata
 WIDTH = 600
 HEIGHT = 400
 
+# How often the GUI checks the transfer engine for progress
+TRANSFER_POLL_MS = 50
+
+# How often the grid view picks up images found by a scan that is still running
+SCAN_REFRESH_MS = 500
+
+# Orders the images can be shown in. "Capture Time" and "Camera" read each file's EXIF block
+ORDER_OPTIONS = ("Folder", "File Name", "Capture Time", "Camera")
+
 
 class ManualSortTab:
     # def __init__(self, root):
@@ -41,6 +77,20 @@ class ManualSortTab:
         self.sortDict = {}
         self.currImageIndex = 0
         self.imageCount = 0
+        self.transfer_engine = None
+        self.scanning = False  # True while the folder is still being scanned
+        self.groups = []  # bursts of near-duplicate images, lists of indexes
+        self.group_of = {}  # image index -> position in self.groups
+        self.group_blurValues = {}  # image index -> blur value, for grouped images only
+        self.metadata = {}  # image path -> capture metadata, once the folder is indexed
+        self.scan_order = []  # images in the order the scan found them
+        # Decodes the images around the current one ahead of time
+        self.prefetcher = Prefetcher(self.load_display_image)
+        self.thumbnail_grid = None  # grid view of the folder, created when first shown
+        self.grid_shown = False
+        # records decisions as they are made, so a session can be resumed
+        self.journal = None
+        self.resume_path = None  # image the last session of this folder ended on
 
         # image display, initialized in init_vars
         # self.imgLabel = tk.Label(self.root)
@@ -65,6 +115,16 @@ class ManualSortTab:
         )
         self.select_button.grid(row=1, column=1)
 
+        # Include subfolders (such as per-card DCIM folders)
+        self.recursive_value = tk.BooleanVar()
+        self.recursive_checkbox = tk.Checkbutton(
+            self.frame,
+            text="Include Subfolders",
+            variable=self.recursive_value,
+            font=("Helvetica", 12),
+        )
+        self.recursive_checkbox.grid(row=4, column=1)
+
     def select_folder(self):
         """
         By Branden. Helper function for select button for the user to select a folder
@@ -75,11 +135,25 @@ class ManualSortTab:
 
         # If a different folder is loaded already
         if self.folder_path:
-            # Reset initialized variables
-            self.picturesList.clear()
+            # Reset initialized variables (a new list, a scan may still be filling the old one)
+            self.picturesList = []
             self.sortDict.clear()
             self.currImageIndex = 0
             self.imageCount = 0
+            self.groups = []
+            self.group_of = {}
+            self.group_blurValues = {}
+            self.metadata = {}
+            self.prefetcher.clear()
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+            self.resume_path = None
+            if self.thumbnail_grid:
+                self.thumbnail_grid.close()
+                self.thumbnail_grid.frame.grid_forget()
+                self.thumbnail_grid = None
+                self.grid_shown = False
 
             self.folder_path = filedialog.askdirectory()
             self.select_button.grid_forget()
@@ -99,10 +173,17 @@ class ManualSortTab:
         Initialize some new member variables for the images. Loads images as well.
         """
         try:
-            for filename in os.listdir(self.folder_path):
-                if filename.lower().endswith(("png", "jpg", "jpeg", "bmp")):
-                    image_path = os.path.join(self.folder_path, filename)
-                    self.picturesList.append(image_path)
+            # Display the first image as soon as it is found, the rest of the folder is scanned in the background
+            scan = scan_images(self.folder_path, self.recursive_value.get())
+            first_image = next(scan, None)
+            if first_image:
+                self.picturesList.append(first_image)
+                self.scanning = True
+                threading.Thread(
+                    target=self.finish_scan,
+                    args=(scan, self.picturesList),
+                    daemon=True,
+                ).start()
 
             if len(self.picturesList) == 0:
                 self.no_picture_label = tk.Label(
@@ -124,15 +205,14 @@ class ManualSortTab:
                 # Record last index
                 self.lastIndex = len(self.picturesList) - 1
 
+                self.resume_session_decisions()
+
                 # Create a scrollable canvas
                 self.canvas = tk.Canvas(self.frame, width=WIDTH, height=HEIGHT)
                 self.canvas.grid(row=1, column=1, pady=10)
 
-                # Load Image (one for analyze dimensions, one for loading to GUI)
-                fullImg = Image.open(self.picturesList[self.currImageIndex])
-                resizedImg = self.resize_image(
-                    fullImg, WIDTH, HEIGHT + 200
-                )  # Resize image
+                # Load Image, resized for the GUI
+                resizedImg = self.prefetcher.get(self.picturesList[self.currImageIndex])
                 tkImg = ImageTk.PhotoImage(resizedImg)
 
                 # Add the image to the canvas
@@ -151,7 +231,7 @@ class ManualSortTab:
                 # Shortcuts instructions
                 self.instruction_key = tk.Label(
                     self.frame,
-                    text="1: Keep, 2: Maybe, 3: Delete, ->: Right, <-: Left",
+                    text="1: Keep, 2: Maybe, 3: Delete, ->: Right, <-: Left, Z: Zoom",
                     font=("Helvetica", 12),
                 )
                 self.instruction_key.grid(row=2, column=1)
@@ -159,11 +239,113 @@ class ManualSortTab:
                 self.init_navigation()
                 self.init_sort_buttons()
                 self.init_finish_button()
+                self.prefetcher.prefetch(self.picturesList, self.currImageIndex)
         except FileNotFoundError as e:
             messagebox.showerror(
                 "Error", "Server Error. System cannot find the path specified"
             )
 
+    def finish_scan(self, scan, picturesList):
+        """
+        Adds the rest of the folder's images to the list while the user is already sorting
+
+        :param scan: scan_images generator that already yielded the first image
+        :type scan: Generator
+        :param picturesList: image list of the folder being scanned
+        :type picturesList: list
+        """
+        try:
+            for image_path in scan:
+                # Stop if another folder was selected in the meantime
+                if picturesList is not self.picturesList:
+                    return
+                picturesList.append(image_path)
+                self.lastIndex = len(picturesList) - 1
+        except OSError as e:
+            print(f"Error scanning folder: {e}")
+        finally:
+            if picturesList is self.picturesList:
+                self.scan_order = list(picturesList)  # for the "Folder" order
+                self.scanning = False
+                self.frame.after(0, self.drop_unscanned_decisions, picturesList)
+                if self.resume_path:
+                    self.frame.after(0, self.resume_session_position)
+
+    def resume_session_decisions(self):
+        """
+        Restores the decisions journaled by an earlier session of this folder, for images that are still there
+        """
+        self.journal = SortJournal(self.folder_path)
+        try:
+            decisions, self.resume_path = self.journal.replay()
+        except OSError as e:
+            # Read-only folders can still be sorted, just not resumed
+            print(f"Sort journal unavailable: {e}")
+            return
+        decisions = {
+            path: decision
+            for path, decision in decisions.items()
+            if os.path.exists(path)
+        }
+        self.sortDict.update(decisions)
+        if decisions:
+            print(f"Resumed {len(decisions)} decisions from the last session")
+        self.frame.after(int(FSYNC_SECONDS * 1000), self.sync_journal, self.journal)
+
+    def drop_unscanned_decisions(self, picturesList):
+        """
+        Forgets resumed decisions for images the scan did not find, such as the subfolders of a recursive
+        session resumed without them, so they are neither counted nor culled
+
+        :param picturesList: image list of the folder that was scanned
+        :type picturesList: list
+        """
+        if picturesList is not self.picturesList:
+            return
+        scanned = set(picturesList)
+        for path in [path for path in self.sortDict if path not in scanned]:
+            del self.sortDict[path]
+
+    def sync_journal(self, journal):
+        """
+        Forces the journal to disk every FSYNC_SECONDS, so the last decisions before a pause are not left
+        waiting for the next one. Stops once another folder is opened
+
+        :param journal: journal of the folder the timer was started for
+        :type journal: SortJournal
+        """
+        if journal is not self.journal:
+            return
+        try:
+            journal.sync()
+        except OSError as e:
+            print(f"Could not sync sort journal: {e}")
+        self.frame.after(int(FSYNC_SECONDS * 1000), self.sync_journal, journal)
+
+    def resume_session_position(self):
+        """
+        Shows the image the last session ended on, once the scan has found it, unless the user has already moved on
+        """
+        resume_path, self.resume_path = self.resume_path, None
+        if self.grid_shown or self.currImageIndex != 0:
+            return
+        if resume_path in self.picturesList:
+            self.currImageIndex = self.picturesList.index(resume_path)
+            self.updatePic(self.currImageIndex)
+
+    def set_decision(self, image_path, decision):
+        """
+        Sorts an image and journals the decision
+
+        :param image_path: path to the image
+        :type image_path: str
+        :param decision: "Keep", "Discard" or "Maybe"
+        :type decision: str
+        """
+        self.sortDict[image_path] = decision
+        if self.journal:
+            self.journal.record(image_path, decision)
+
     def updatePic(self, index):
         """
         Updates the picture whenever user presses left, right or keep, maybe, delete
@@ -172,43 +354,37 @@ class ManualSortTab:
         :type index: int
         """
         # print(picturesList)
-        # Load Image (one for analyze dimensions, one for loading to GUI)
-        fullImg = Image.open(self.picturesList[index])
-        resizedImg = self.resize_image(fullImg, WIDTH, HEIGHT + 200)  # Resize image
+        # Load Image, usually already decoded and resized in the background
+        resizedImg = self.prefetcher.get(self.picturesList[index])
         tkImg = ImageTk.PhotoImage(resizedImg)
 
         # self.imgLabel.config(image=current_img)
         # self.imgLabel.image = current_img
         self.canvas.create_image(0, 0, anchor=tk.NW, image=tkImg)
         self.canvas.image = tkImg  # Prevent garbage collection
+        self.update_burst_label()
+        self.metadata_label.config(
+            text=describe(self.metadata.get(self.picturesList[index]))
+        )
+        self.cache_label.config(text=self.prefetcher.cache.report())
+        if self.journal:
+            self.journal.record_position(self.picturesList[index])
 
-    def resize_image(self, image, screen_height, screen_width):
-        """
-        Resizes the image to a formattable and readable way for the GUI
-
-        :param image: image file
-        :type image: ImageFile
-        :param screen_height: preferred height of image
-        :type screen_height: int
-        :type screen_width: preferred width of image
-        :type screen_width: int
+        # Start on the images the user is likely to view next
+        self.prefetcher.prefetch(self.picturesList, index)
 
-        :return: Resized ImageFile
-        :rtype: ImageFile
+    def load_display_image(self, image_path):
         """
-        image_width, image_height = image.size
+        Loads an image resized for the GUI, through the thumbnail cache so a folder viewed before
+        does not decode its originals again. Runs on the prefetcher's threads
 
-        # Adjust image dimensions to fit the screen size
-        if (image_width / image_height) > (screen_width / screen_height):
-            new_width = screen_width
-            new_height = int(screen_width / (image_width / image_height))
-        else:
-            new_height = screen_height
-            new_width = int(screen_height * (image_width / image_height))
+        :param image_path: path to the image file
+        :type image_path: str
 
-        # Resize the image
-        resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        return resized_image
+        :return: Resized image
+        :rtype: Image
+        """
+        return shared_cache().load(image_path, (HEIGHT + 200, WIDTH), upscale=True)
 
     # display next pic
     def moveForward(self, event=None):
@@ -261,17 +437,17 @@ class ManualSortTab:
     # keep, discard, maybe - functions
 
     def keepPic(self, event=None):
-        self.sortDict[self.picturesList[self.currImageIndex]] = "Keep"
+        self.set_decision(self.picturesList[self.currImageIndex], "Keep")
         self.moveForward()
         self.check_sorting_complete()
 
     def discardPic(self, event=None):
-        self.sortDict[self.picturesList[self.currImageIndex]] = "Discard"
+        self.set_decision(self.picturesList[self.currImageIndex], "Discard")
         self.moveForward()
         self.check_sorting_complete()
 
     def maybePic(self, event=None):
-        self.sortDict[self.picturesList[self.currImageIndex]] = "Maybe"
+        self.set_decision(self.picturesList[self.currImageIndex], "Maybe")
         self.moveForward()
         self.check_sorting_complete()
 
@@ -328,15 +504,450 @@ class ManualSortTab:
 
     def init_finish_button(self):
         """
-        Initializes a button to finish culling
+        Initializes a button to finish culling, the transfer options and the undo button
         """
-        finish_button = tk.Button(
-            self.frame,
+        f0 = tk.Frame(self.frame)
+        self.finish_button = tk.Button(
+            f0,
             text="Finish Sorting",
             command=self.cull,
             font=("Helvetica", 14),
         )
-        finish_button.grid(row=0, column=0, pady=20)
+        self.finish_button.pack(side="left")
+
+        # Cancel Button, stops a running cull once the files in flight are done
+        self.cancel_button = tk.Button(
+            f0,
+            text="Cancel",
+            command=self.cancel_cull,
+            font=("Helvetica", 12),
+            state=tk.DISABLED,
+        )
+        self.cancel_button.pack(side="left", padx=5)
+        f0.grid(row=0, column=0, pady=20)
+
+        # How sorted files get into their folders
+        f2 = tk.Frame(self.frame)
+        transfer_label = tk.Label(f2, text="Transfer:", font=("Helvetica", 12))
+        transfer_label.pack(side="left")
+
+        self.transfer_var = tk.StringVar(value=list(STRATEGY_LABELS)[0])
+        transfer_dropdown = ttk.Combobox(
+            f2,
+            textvariable=self.transfer_var,
+            values=list(STRATEGY_LABELS),
+            state="readonly",
+            width=22,
+        )
+        transfer_dropdown.pack(side="left")
+
+        # Files transferred at once
+        concurrency_label = tk.Label(f2, text="Threads:", font=("Helvetica", 12))
+        concurrency_label.pack(side="left")
+
+        self.concurrency_var = tk.IntVar(value=DEFAULT_CONCURRENCY)
+        concurrency_spinbox = tk.Spinbox(
+            f2, from_=1, to=32, width=3, textvariable=self.concurrency_var
+        )
+        concurrency_spinbox.pack(side="left")
+        f2.grid(row=2, column=0)
+
+        # Undo Button, reverts the last cull using its manifest
+        undo_button = tk.Button(
+            self.frame,
+            text="Undo Last Cull",
+            command=self.undo_cull,
+            font=("Helvetica", 12),
+        )
+        undo_button.grid(row=3, column=0)
+
+        # Burst grouping, finds near-duplicate frames and keeps the sharpest of each burst
+        f3 = tk.Frame(self.frame)
+        self.find_bursts_button = tk.Button(
+            f3, text="Find Bursts", command=self.find_bursts, font=("Helvetica", 12)
+        )
+        self.find_bursts_button.pack()
+        self.keep_sharpest_button = tk.Button(
+            f3,
+            text="Keep Sharpest of Burst",
+            command=self.keep_sharpest_of_burst,
+            font=("Helvetica", 12),
+            state=tk.DISABLED,
+        )
+        self.keep_sharpest_button.pack()
+        self.keep_sharpest_all_button = tk.Button(
+            f3,
+            text="Keep Sharpest of All Bursts",
+            command=self.keep_sharpest_of_all_bursts,
+            font=("Helvetica", 12),
+            state=tk.DISABLED,
+        )
+        self.keep_sharpest_all_button.pack()
+        f3.grid(row=4, column=0, pady=10)
+
+        self.burst_label = tk.Label(self.frame, text="", font=("Helvetica", 12))
+        self.burst_label.grid(row=5, column=1)
+
+        # Display order, capture time and camera orders index the folder's metadata first
+        f4 = tk.Frame(self.frame)
+        order_label = tk.Label(f4, text="Order:", font=("Helvetica", 12))
+        order_label.pack(side="left")
+
+        self.order_var = tk.StringVar(value=ORDER_OPTIONS[0])
+        self.order_dropdown = ttk.Combobox(
+            f4,
+            textvariable=self.order_var,
+            values=list(ORDER_OPTIONS),
+            state="readonly",
+            width=14,
+        )
+        self.order_dropdown.bind("<<ComboboxSelected>>", self.change_order)
+        self.order_dropdown.pack(side="left")
+        f4.grid(row=5, column=0)
+
+        # Camera, lens and exposure of the current image
+        self.metadata_label = tk.Label(self.frame, text="", font=("Helvetica", 10))
+        self.metadata_label.grid(row=6, column=1)
+
+        # Switches between one image at a time and a grid of the whole folder
+        self.view_button = tk.Button(
+            self.frame,
+            text="Grid View",
+            command=self.toggle_grid,
+            font=("Helvetica", 12),
+        )
+        self.view_button.grid(row=4, column=2)
+
+        # Opens the current image at up to 100% and beyond to check focus
+        self.zoom_button = tk.Button(
+            self.frame,
+            text="Zoom",
+            command=self.open_zoom,
+            font=("Helvetica", 12),
+        )
+        self.zoom_button.grid(row=3, column=2)
+        self.canvas.bind("z", self.open_zoom)
+
+        # Hit rate of the prefetched images
+        self.cache_label = tk.Label(self.frame, text="", font=("Helvetica", 10))
+        self.cache_label.grid(row=7, column=1)
+
+    def open_zoom(self, event=None):
+        """
+        Opens the current image in a zoom window. Its tiles are kept in the thumbnail cache, so zooming into
+        the same image again starts at once
+        """
+        if not self.picturesList:
+            return
+        image_path = self.picturesList[self.currImageIndex]
+        try:
+            pyramid = ImagePyramid(image_path, path_key(image_path), shared_cache())
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not open {image_path}: {e}")
+            return
+        open_zoom_window(self.frame, pyramid, title=os.path.basename(image_path))
+
+    # ------------
+    # grid view
+
+    def toggle_grid(self):
+        """
+        Switches between the single image view and the grid view, staying on the current image
+        """
+        if self.grid_shown:
+            self.open_from_grid(self.thumbnail_grid.focus)
+            return
+
+        if self.thumbnail_grid is None:
+            self.thumbnail_grid = ThumbnailGrid(
+                self.frame,
+                on_sort=self.sort_from_grid,
+                on_open=self.open_from_grid,
+                decision_of=self.decision_at,
+                width=WIDTH,
+                height=HEIGHT + 200,
+            )
+        self.canvas.grid_forget()
+        self.thumbnail_grid.frame.grid(row=1, column=1, pady=10)
+        self.grid_shown = True
+        self.view_button.config(text="Single View")
+        self.thumbnail_grid.frame.update_idletasks()  # size the canvas before laying out the cells
+        self.thumbnail_grid.set_images(self.picturesList, self.currImageIndex)
+        self.thumbnail_grid.canvas.focus_set()
+        self.watch_scan()
+
+    def open_from_grid(self, index):
+        """
+        Shows one image from the grid in the single image view
+
+        :param index: index of the image
+        :type index: int
+        """
+        self.thumbnail_grid.frame.grid_forget()
+        self.grid_shown = False
+        self.view_button.config(text="Grid View")
+        self.canvas.grid(row=1, column=1, pady=10)
+        self.currImageIndex = index
+        self.updatePic(index)
+        self.canvas.focus_set()
+
+    def watch_scan(self):
+        """
+        Adds images found by a scan that is still running to the grid
+        """
+        if self.grid_shown and self.scanning:
+            self.thumbnail_grid.refresh()
+            self.frame.after(SCAN_REFRESH_MS, self.watch_scan)
+        elif self.grid_shown:
+            self.thumbnail_grid.refresh()
+
+    def decision_at(self, index):
+        """
+        Decision of the image at index, None if it is not sorted yet
+        """
+        return self.sortDict.get(self.picturesList[index])
+
+    def sort_from_grid(self, indexes, decision):
+        """
+        Sorts the images selected in the grid
+
+        :param indexes: indexes of the selected images
+        :type indexes: list
+        :param decision: "Keep", "Discard" or "Maybe"
+        :type decision: str
+        """
+        for index in indexes:
+            self.set_decision(self.picturesList[index], decision)
+        self.currImageIndex = indexes[-1]
+        self.check_sorting_complete()
+
+    # ------------
+    # display order
+
+    def change_order(self, event=None):
+        """
+        Reorders the images as chosen in the Order dropdown. Metadata is read in the background
+        """
+        if self.scanning:
+            messagebox.showinfo(
+                "Order", "The folder is still being scanned. Try again shortly."
+            )
+            self.order_var.set(ORDER_OPTIONS[0])
+            return
+        self.order_dropdown.config(state=tk.DISABLED)
+        threading.Thread(
+            target=self.index_metadata,
+            args=(self.picturesList, self.order_var.get()),
+            daemon=True,
+        ).start()
+
+    def index_metadata(self, picturesList, order):
+        """
+        Thread target for change_order. Reads the EXIF block of every image, using the folder's
+        cache for images read on an earlier visit
+
+        :param picturesList: image list of the folder
+        :type picturesList: list
+        :param order: one of ORDER_OPTIONS
+        :type order: str
+        """
+        paths = list(picturesList)
+        metadata = [self.metadata.get(path) for path in paths]
+        if order in ("Capture Time", "Camera") and not self.metadata:
+            try:
+                cache = ScoreCache.for_folder(self.folder_path)
+            except Exception as e:
+                print(f"Score cache unavailable: {e}")
+                cache = None
+            try:
+                metadata = MetadataIndexer().index_all(paths, cache)
+            except Exception as e:
+                print(f"Could not read metadata: {e}")
+            finally:
+                if cache:
+                    cache.close()
+
+        if order == "Capture Time":
+            ordered = order_by_capture(paths, metadata)
+        elif order == "Camera":
+            ordered = [
+                path
+                for camera_paths in group_by_camera(paths, metadata).values()
+                for path in camera_paths
+            ]
+        elif order == "File Name":
+            ordered = sorted(paths)
+        else:
+            ordered = self.scan_order
+
+        by_path = {
+            path: meta for path, meta in zip(paths, metadata) if meta is not None
+        }
+        if picturesList is self.picturesList:
+            self.frame.after(0, lambda: self.apply_order(ordered, by_path))
+
+    def apply_order(self, ordered, metadata):
+        """
+        Shows the images in a new order, staying on the current image
+
+        :param ordered: image paths in their new order
+        :type ordered: list
+        :param metadata: image path -> capture metadata
+        :type metadata: dict
+        """
+        current = self.picturesList[self.currImageIndex]
+        # Same list object, so a later scan or grouping still recognizes it
+        self.picturesList[:] = ordered
+        self.metadata = metadata
+        self.currImageIndex = self.picturesList.index(current)
+
+        # Burst groups hold indexes into the old order
+        if self.groups:
+            self.groups = []
+            self.group_of = {}
+            self.group_blurValues = {}
+            self.keep_sharpest_button.config(state=tk.DISABLED)
+            self.keep_sharpest_all_button.config(state=tk.DISABLED)
+            self.burst_label.config(text="")
+
+        self.order_dropdown.config(state="readonly")
+        if self.grid_shown:
+            self.thumbnail_grid.focus = self.currImageIndex
+            self.thumbnail_grid.selected = {self.currImageIndex}
+            self.thumbnail_grid.refresh(reload=True)
+            self.thumbnail_grid.see(self.currImageIndex)
+        else:
+            self.updatePic(self.currImageIndex)
+
+    # ------------
+    # burst grouping
+
+    def find_bursts(self):
+        """
+        Hashes the folder's images in the background and groups near-duplicates. Hashes and blur values
+        are kept in the folder's score cache, so a second visit only reads them back
+        """
+        if self.scanning:
+            messagebox.showinfo(
+                "Find Bursts", "The folder is still being scanned. Try again shortly."
+            )
+            return
+        self.find_bursts_button.config(state=tk.DISABLED, text="Finding Bursts...")
+        threading.Thread(
+            target=self.group_bursts, args=(self.picturesList,), daemon=True
+        ).start()
+
+    def group_bursts(self, picturesList):
+        """
+        Thread target for find_bursts
+
+        :param picturesList: image list of the folder being grouped
+        :type picturesList: list
+        """
+        groups = []
+        blurValues = {}
+        try:
+            cache = ScoreCache.for_folder(self.folder_path)
+        except Exception as e:
+            print(f"Score cache unavailable: {e}")
+            cache = None
+        try:
+            hashes = HashIndexer().hash_all(picturesList, cache)
+            groups = find_groups(hashes)
+            # Only the grouped images need a blur value to pick the sharpest
+            grouped = [index for members in groups for index in members]
+            values = BlurScorer().score_all(
+                [picturesList[index] for index in grouped], cache
+            )
+            blurValues = dict(zip(grouped, values))
+        except Exception as e:
+            print(f"Could not group bursts: {e}")
+        finally:
+            if cache:
+                cache.close()
+
+        if picturesList is self.picturesList:
+            self.frame.after(0, lambda: self.show_bursts(groups, blurValues))
+
+    def show_bursts(self, groups, blurValues):
+        """
+        Shows the burst groups once they are found
+
+        :param groups: groups from find_groups
+        :type groups: list
+        :param blurValues: blur value of each grouped image
+        :type blurValues: dict
+        """
+        self.groups = groups
+        self.group_blurValues = blurValues
+        self.group_of = {
+            index: number for number, members in enumerate(groups) for index in members
+        }
+        state = tk.NORMAL if groups else tk.DISABLED
+        self.keep_sharpest_button.config(state=state)
+        self.keep_sharpest_all_button.config(state=state)
+        self.find_bursts_button.config(state=tk.NORMAL, text="Find Bursts")
+
+        grouped = sum(len(members) for members in groups)
+        print(f"{len(groups)} bursts found, {grouped} images")
+        self.update_burst_label()
+        if not groups:
+            self.burst_label.config(text="No bursts found")
+
+    def update_burst_label(self):
+        """
+        Tells the user when the current image is part of a burst
+        """
+        if not self.groups:
+            return
+        number = self.group_of.get(self.currImageIndex)
+        if number is None:
+            self.burst_label.config(text=f"{len(self.groups)} bursts in this folder")
+            return
+        members = self.groups[number]
+        frame = members.index(self.currImageIndex) + 1
+        self.burst_label.config(
+            text=f"Burst {number + 1} of {len(self.groups)}: frame {frame} of {len(members)}"
+        )
+
+    def mark_burst(self, members):
+        """
+        Keeps the sharpest frame of a burst and discards the others
+
+        :param members: indexes of the burst's images
+        :type members: list
+        """
+        decisions = sharpest_in_groups([members], self.group_blurValues)
+        for index, decision in decisions.items():
+            self.set_decision(self.picturesList[index], decision)
+
+    def keep_sharpest_of_burst(self):
+        """
+        Culls the burst of the current image and moves on to the first image after it
+        """
+        number = self.group_of.get(self.currImageIndex)
+        if number is None:
+            messagebox.showinfo("Find Bursts", "This image is not part of a burst.")
+            return
+        members = self.groups[number]
+        self.mark_burst(members)
+        self.currImageIndex = members[-1]
+        self.moveForward()
+        self.check_sorting_complete()
+
+    def keep_sharpest_of_all_bursts(self):
+        """
+        Culls every burst in the folder, leaving the other images to sort by hand
+        """
+        for members in self.groups:
+            self.mark_burst(members)
+        if self.grid_shown:
+            self.thumbnail_grid.redraw()
+        messagebox.showinfo(
+            "Find Bursts",
+            f"Kept the sharpest frame of {len(self.groups)} bursts.",
+        )
+        self.check_sorting_complete()
 
     # execute keep, dicard, maybe
     def cull(self, output_folders=None):
@@ -346,6 +957,10 @@ class ManualSortTab:
         :param output_folders: Dictionary containing custom folder names for each category
         :type output_folders: Dict | None
         """
+        # One cull at a time
+        if self.transfer_engine:
+            return
+
         # Default folder names
         if output_folders is None:
             output_folders = {"Keep": "Keep", "Discard": "Discard", "Maybe": "Maybe"}
@@ -356,36 +971,125 @@ class ManualSortTab:
             if not os.path.exists(folder_path):
                 os.mkdir(folder_path)
 
-        # execute
+        # execute in the background, recording each transfer so the cull can be undone
+        jobs = []
         for pic in self.sortDict:
             if self.sortDict[pic] == "Keep":
-                self.copy_photo(pic, self.folder_path + "/Keep")
+                jobs.append((pic, self.folder_path + "/Keep"))
             elif self.sortDict[pic] == "Discard":
-                self.copy_photo(pic, self.folder_path + "/Discard")
+                jobs.append((pic, self.folder_path + "/Discard"))
                 # os.remove()
             elif self.sortDict[pic] == "Maybe":
-                self.copy_photo(pic, self.folder_path + "/Maybe")
+                jobs.append((pic, self.folder_path + "/Maybe"))
 
-        messagebox.showinfo(
-            "Sorting Complete", "All images have been sorted successfully!"
+        try:
+            concurrency = max(self.concurrency_var.get(), 1)
+        except tk.TclError:
+            # The box was left empty or holds something other than a number
+            concurrency = DEFAULT_CONCURRENCY
+
+        manifest = TransferManifest(
+            self.folder_path, STRATEGY_LABELS[self.transfer_var.get()], kind="cull"
         )
+        self.transfer_engine = TransferEngine(manifest, concurrency=concurrency)
+        self.transfer_engine.start(jobs)
+
+        self.finish_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.frame.after(TRANSFER_POLL_MS, self.poll_transfer)
+
+    def poll_transfer(self):
+        """
+        Reads the transfer engine's progress queue on the Tk thread. Handles any issues with the files
+        (permission errors, empty folders) and tells the user once the cull is done
+        """
+        while True:
+            try:
+                message = self.transfer_engine.progress.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == "error":
+                _, pic, dest_folder, error = message
+                print(f"Unable to transfer {pic}: {error}")
+            elif message[0] == "done":
+                self.finish_cull(message[1])
+                return
 
-    def copy_photo(self, pic, dest_folder):
+        self.frame.after(TRANSFER_POLL_MS, self.poll_transfer)
+
+    def finish_cull(self, stats):
         """
-        Handles any issues with the files (permission errors, empty folders)
+        Tells the user how the cull went once the transfer engine has stopped
+
+        :param stats: transfer statistics of the run
+        :type stats: dict
         """
+        print(f"Cull transfer: {format_stats(stats)}")
+        self.transfer_engine = None
+        self.finish_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+        if stats["cancelled"]:
+            messagebox.showwarning(
+                "Sorting Cancelled",
+                f"The cull was cancelled, {stats['files']} of {stats['total']} images were sorted. "
+                f"Use Undo Last Cull to revert them.\n{format_stats(stats)}",
+            )
+        elif stats["errors"]:
+            # The journal is kept so the session can be finished once the problem is fixed
+            messagebox.showerror(
+                "Sorting Incomplete",
+                f"{stats['errors']} of {stats['total']} images could not be sorted, see the console for details."
+                f"\n{format_stats(stats)}",
+            )
+        else:
+            # The decisions are carried out, a new session of this folder starts fresh
+            if self.journal:
+                self.journal.clear()
+            messagebox.showinfo(
+                "Sorting Complete",
+                f"All images have been sorted successfully!\n{format_stats(stats)}",
+            )
+
+    def cancel_cull(self):
+        """
+        Stops the running cull once the files in flight are done
+        """
+        if self.transfer_engine:
+            self.transfer_engine.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+
+    def undo_cull(self):
+        """
+        Reverts the most recent cull of the folder. Moved files go back, copies and links are removed
+        """
+        if not self.folder_path:
+            messagebox.showerror("Error", "Select a folder first.")
+            return
+        if self.transfer_engine:
+            messagebox.showerror("Error", "Wait for the cull to finish or cancel it.")
+            return
+
+        manifest_path = latest_manifest(self.folder_path, kind="cull")
+        if not manifest_path:
+            messagebox.showerror("Error", "There is no cull to undo in this folder.")
+            return
+
         try:
-            copy2(pic, dest_folder)
-        except PermissionError:
-            print(f"Permission denied: Unable to copy {pic}")
-        except FileNotFoundError:
-            print(f"File not found: {pic}")
+            reverted = revert_manifest(manifest_path)
+            messagebox.showinfo("Undo Complete", f"{reverted} files were restored.")
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not undo cull: {e}")
 
     def check_sorting_complete(self):
         """
         Check if all images have been sorted. If so, alert the user and prompt for culling.
         """
-        if len(self.sortDict) == len(self.picturesList):  # All images are sorted
+        # All images are sorted, and no more are still being found. Only images of this scan are counted,
+        # decisions resumed from the journal can be for images it did not find
+        num_sorted = sum(path in self.sortDict for path in self.picturesList)
+        if not self.scanning and num_sorted == len(self.picturesList):
             response = messagebox.askyesno(
                 "Sorting Complete",
                 "All images are sorted. Would you like to proceed with culling?",
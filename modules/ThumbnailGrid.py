@@ -0,0 +1,460 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module is a part of the frontend, a scrollable grid of thumbnails used by the Manual Sort tab to cull
+# many images at once. Only the cells on screen exist as canvas items. They are reused as the grid scrolls, thumbnails
+# load in the background, and the number of widgets and images stays the same however large the folder is.
+
+import math
+import tkinter as tk
+from PIL import Image, ImageTk
+
+from modules.prefetchfuncs import Prefetcher
+from modules.thumbcache import shared_cache
+
+# Size of a thumbnail, and the space around it and below it for its label
+GRID_CELL = 150
+GRID_PADDING = 6
+GRID_LABEL = 18
+
+# Memory the loaded thumbnails may hold, about 1000 thumbnails
+GRID_CACHE_BUDGET = 64 * 1024 * 1024
+
+# How often the grid checks for thumbnails that finished loading
+GRID_POLL_MS = 50
+
+# Border colors of sorted images, and of the selection
+DECISION_COLORS = {"Keep": "green", "Discard": "red", "Maybe": "orange"}
+SELECTED_COLOR = "#1e90ff"
+PLACEHOLDER_COLOR = (200, 200, 200)
+
+
+class GridLayout:
+    def __init__(self, cell=GRID_CELL, padding=GRID_PADDING, label=GRID_LABEL):
+        """
+        Initialize the GridLayout class. Works out where each cell of the grid goes, without any widgets
+
+        :param cell: size of a thumbnail
+        :type cell: int
+        :param padding: space around a thumbnail
+        :type padding: int
+        :param label: height of the label below a thumbnail
+        :type label: int
+        """
+        self.cell = cell
+        self.padding = padding
+        self.pitch_x = cell + 2 * padding
+        self.pitch_y = cell + 2 * padding + label
+
+    def columns(self, width):
+        """
+        Number of columns that fit in a width, at least one
+        """
+        return max(1, int(width) // self.pitch_x)
+
+    def height(self, count, columns):
+        """
+        Height of the whole grid
+        """
+        return math.ceil(count / columns) * self.pitch_y
+
+    def origin(self, index, columns):
+        """
+        Top left corner of a cell's thumbnail
+
+        :return: x, y
+        :rtype: tuple
+        """
+        row, column = divmod(index, columns)
+        return column * self.pitch_x + self.padding, row * self.pitch_y + self.padding
+
+    def visible_range(self, top, height, columns, count):
+        """
+        Indexes of the cells at least partly inside a view of the grid
+
+        :param top: grid coordinate at the top of the view
+        :type top: float
+        :param height: height of the view
+        :type height: int
+        :param columns: number of columns
+        :type columns: int
+        :param count: number of images
+        :type count: int
+
+        :return: first index and one past the last index
+        :rtype: tuple
+        """
+        first_row = max(0, int(top // self.pitch_y))
+        last_row = int((top + height) // self.pitch_y) + 1
+        return min(count, first_row * columns), min(count, last_row * columns)
+
+    def capacity(self, height, columns):
+        """
+        Most cells that can be visible at once in a view of this height
+        """
+        return (math.ceil(height / self.pitch_y) + 1) * columns
+
+    def index_at(self, x, y, columns, count):
+        """
+        Index of the cell at a grid coordinate
+
+        :return: the index, or None outside the cells
+        :rtype: int | None
+        """
+        column = int(x // self.pitch_x)
+        if x < 0 or y < 0 or column >= columns:
+            return None
+        index = int(y // self.pitch_y) * columns + column
+        return index if index < count else None
+
+
+def select_range(anchor, index):
+    """
+    Indexes from anchor to index, inclusive, in either direction
+
+    :rtype: set
+    """
+    low, high = sorted((anchor, index))
+    return set(range(low, high + 1))
+
+
+class GridCell:
+    def __init__(self, canvas, placeholder):
+        """
+        Initialize the GridCell class. One pooled cell of the grid: its thumbnail, border and label items, and
+        the PhotoImage the thumbnail is pasted into, all reused for whichever image the cell shows
+
+        :param canvas: canvas of the grid
+        :type canvas: tk.Canvas
+        :param placeholder: image shown until the thumbnail is loaded
+        :type placeholder: PIL.Image.Image
+        """
+        self.index = None
+        self.loaded = False
+        self.photo = ImageTk.PhotoImage(placeholder)
+        self.border = canvas.create_rectangle(0, 0, 0, 0, width=3, outline="")
+        self.image = canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+        self.label = canvas.create_text(0, 0, anchor=tk.N, font=("Helvetica", 9))
+
+
+class ThumbnailGrid:
+    def __init__(self, parent, on_sort, on_open, decision_of, width=600, height=600):
+        """
+        Initialize the ThumbnailGrid class.
+
+        :param parent: widget the grid is placed in
+        :type parent: tk.Widget
+        :param on_sort: called with (indexes, decision) when images are sorted from the grid
+        :type on_sort: Callable
+        :param on_open: called with an index when an image is opened by double-click or Enter
+        :type on_open: Callable
+        :param decision_of: returns the decision of an index, or None if it is not sorted yet
+        :type decision_of: Callable
+        :param width: initial width of the grid
+        :type width: int
+        :param height: initial height of the grid
+        :type height: int
+        """
+        self.on_sort = on_sort
+        self.on_open = on_open
+        self.decision_of = decision_of
+        self.picturesList = []
+        self.layout = GridLayout()
+        self.cells = []
+        self.selected = set()
+        self.anchor = 0  # where shift-click ranges start
+        self.focus = 0  # image the arrow keys move from
+        self.poll_job = None
+        self.placeholder = Image.new("RGB", (GRID_CELL, GRID_CELL), PLACEHOLDER_COLOR)
+        self.prefetcher = Prefetcher(self.load_thumbnail, budget=GRID_CACHE_BUDGET)
+
+        self.frame = tk.Frame(parent)
+        self.canvas = tk.Canvas(
+            self.frame, width=width, height=height, highlightthickness=0
+        )
+        self.scrollbar = tk.Scrollbar(
+            self.frame, orient=tk.VERTICAL, command=self.yview
+        )
+        self.canvas.config(
+            yscrollcommand=self.scrollbar.set,
+            yscrollincrement=self.layout.pitch_y // 3,
+        )
+        self.canvas.pack(side="left", fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side="right", fill=tk.Y)
+
+        self.canvas.bind("<Configure>", lambda event: self.refresh())
+        self.canvas.bind("<Button-1>", self.click)
+        self.canvas.bind("<Control-Button-1>", self.control_click)
+        self.canvas.bind("<Shift-Button-1>", self.shift_click)
+        self.canvas.bind("<Double-Button-1>", self.double_click)
+        self.canvas.bind("<MouseWheel>", self.mouse_wheel)
+        self.canvas.bind("<Button-4>", lambda event: self.scroll(-1))
+        self.canvas.bind("<Button-5>", lambda event: self.scroll(1))
+        for key, step in (("<Left>", -1), ("<Right>", 1)):
+            self.canvas.bind(key, lambda event, step=step: self.move_focus(step))
+        self.canvas.bind("<Up>", lambda event: self.move_focus(-self.columns()))
+        self.canvas.bind("<Down>", lambda event: self.move_focus(self.columns()))
+        self.canvas.bind("<Control-a>", self.select_all)
+        self.canvas.bind("<Return>", lambda event: self.on_open(self.focus))
+        # Same keys as the single image view
+        self.canvas.bind("1", lambda event: self.sort_selected("Keep"))
+        self.canvas.bind("2", lambda event: self.sort_selected("Discard"))
+        self.canvas.bind("3", lambda event: self.sort_selected("Maybe"))
+
+    def load_thumbnail(self, image_path):
+        """
+        Loads a thumbnail centered on a cell-sized image, so it can be pasted into a pooled PhotoImage.
+        Runs on the prefetcher's threads
+
+        :param image_path: path to the image file
+        :type image_path: str
+
+        :return: cell-sized image
+        :rtype: PIL.Image.Image
+        """
+        thumbnail = shared_cache().load(image_path, (GRID_CELL, GRID_CELL))
+        cell = self.placeholder.copy()
+        cell.paste(
+            thumbnail.convert("RGB"),
+            (
+                (GRID_CELL - thumbnail.width) // 2,
+                (GRID_CELL - thumbnail.height) // 2,
+            ),
+        )
+        return cell
+
+    def set_images(self, picturesList, focus=0):
+        """
+        Shows a new list of images, such as another folder. The list may still grow while it is scanned
+
+        :param picturesList: image paths in display order
+        :type picturesList: list
+        :param focus: index to select and scroll to
+        :type focus: int
+        """
+        self.picturesList = picturesList
+        self.prefetcher.clear()
+        for cell in self.cells:
+            cell.index = None
+        self.selected = {focus} if picturesList else set()
+        self.anchor = self.focus = focus
+        self.refresh()
+        self.see(focus)
+
+    def columns(self):
+        return self.layout.columns(self.canvas.winfo_width())
+
+    def yview(self, *args):
+        """
+        Scrollbar command, scrolls and then shows the cells that came into view
+        """
+        self.canvas.yview(*args)
+        self.refresh()
+
+    def scroll(self, units):
+        self.canvas.yview_scroll(units, "units")
+        self.refresh()
+
+    def mouse_wheel(self, event):
+        # Windows reports multiples of 120, macOS small steps
+        self.scroll(-1 if event.delta > 0 else 1)
+
+    def refresh(self, reload=False):
+        """
+        Places the pooled cells on the images in view. Cells keep their image while it stays in view,
+        so scrolling only updates the cells that came into view
+
+        :param reload: reload the thumbnails of every visible cell, such as after the images were reordered
+        :type reload: bool
+        """
+        count = len(self.picturesList)
+        columns = self.columns()
+        width = self.canvas.winfo_width()
+        view_height = max(self.canvas.winfo_height(), 1)
+        self.canvas.config(
+            scrollregion=(
+                0,
+                0,
+                width,
+                max(self.layout.height(count, columns), view_height),
+            )
+        )
+
+        # Grow the pool to the most cells that can be on screen, never with the size of the folder
+        capacity = self.layout.capacity(view_height, columns)
+        if len(self.cells) < capacity:
+            while len(self.cells) < capacity:
+                self.cells.append(GridCell(self.canvas, self.placeholder))
+            for cell in self.cells:
+                cell.index = None
+
+        first, last = self.layout.visible_range(
+            self.canvas.canvasy(0), view_height, columns, count
+        )
+        shown = set()
+        for index in range(first, last):
+            # Consecutive indexes map to different cells, so a cell keeps its image until it scrolls out
+            cell = self.cells[index % len(self.cells)]
+            shown.add(id(cell))
+            if cell.index != index or reload:
+                self.place(cell, index, columns)
+            self.decorate(cell)
+        for cell in self.cells:
+            if id(cell) not in shown:
+                cell.index = None
+                self.canvas.itemconfig(cell.image, state=tk.HIDDEN)
+                self.canvas.itemconfig(cell.border, state=tk.HIDDEN)
+                self.canvas.itemconfig(cell.label, state=tk.HIDDEN)
+
+        # Load what is on screen first, then the next screenful
+        wanted = self.picturesList[first : min(count, last + (last - first))]
+        self.prefetcher.request(wanted)
+        if self.poll_job is None:
+            self.poll()
+
+    def place(self, cell, index, columns):
+        """
+        Moves a pooled cell onto an image and shows its thumbnail if it is already loaded
+        """
+        x, y = self.layout.origin(index, columns)
+        cell.index = index
+        self.canvas.coords(cell.image, x, y)
+        self.canvas.coords(
+            cell.border, x - 3, y - 3, x + GRID_CELL + 2, y + GRID_CELL + 2
+        )
+        self.canvas.coords(cell.label, x + GRID_CELL // 2, y + GRID_CELL + 2)
+        for item in (cell.image, cell.border, cell.label):
+            self.canvas.itemconfig(item, state=tk.NORMAL)
+
+        thumbnail = self.prefetcher.cache.get(self.picturesList[index])
+        cell.loaded = thumbnail is not None
+        cell.photo.paste(thumbnail if cell.loaded else self.placeholder)
+
+    def decorate(self, cell):
+        """
+        Shows a cell's decision and whether it is selected
+        """
+        decision = self.decision_of(cell.index)
+        if cell.index in self.selected:
+            color = SELECTED_COLOR
+        else:
+            color = DECISION_COLORS.get(decision, "")
+        self.canvas.itemconfig(cell.border, outline=color)
+        self.canvas.itemconfig(cell.label, text=decision or "")
+
+    def poll(self):
+        """
+        Pastes thumbnails that finished loading into their cells, checking again while any are missing
+        """
+        self.poll_job = None
+        waiting = False
+        for cell in self.cells:
+            if cell.index is None or cell.loaded:
+                continue
+            path = self.picturesList[cell.index]
+            thumbnail = self.prefetcher.cache.get(path, count=False)
+            if thumbnail is not None:
+                cell.photo.paste(thumbnail)
+                cell.loaded = True
+            elif path not in self.prefetcher.failed:
+                waiting = True
+        if waiting:
+            self.poll_job = self.frame.after(GRID_POLL_MS, self.poll)
+
+    def redraw(self):
+        """
+        Updates the decisions and selection of the visible cells
+        """
+        for cell in self.cells:
+            if cell.index is not None:
+                self.decorate(cell)
+
+    def see(self, index):
+        """
+        Scrolls so the cell at index is in view
+        """
+        if not self.picturesList:
+            return
+        total = self.layout.height(len(self.picturesList), self.columns())
+        _, y = self.layout.origin(index, self.columns())
+        top = self.canvas.canvasy(0)
+        view_height = self.canvas.winfo_height()
+        if y < top or y + self.layout.pitch_y > top + view_height:
+            self.canvas.yview_moveto(max(0, y - self.layout.padding) / max(total, 1))
+            self.refresh()
+
+    # ------------
+    # selection
+
+    def index_at_event(self, event):
+        return self.layout.index_at(
+            self.canvas.canvasx(event.x),
+            self.canvas.canvasy(event.y),
+            self.columns(),
+            len(self.picturesList),
+        )
+
+    def click(self, event):
+        self.canvas.focus_set()
+        index = self.index_at_event(event)
+        if index is not None:
+            self.selected = {index}
+            self.anchor = self.focus = index
+            self.redraw()
+
+    def control_click(self, event):
+        index = self.index_at_event(event)
+        if index is not None:
+            self.selected ^= {index}
+            self.anchor = self.focus = index
+            self.redraw()
+
+    def shift_click(self, event):
+        index = self.index_at_event(event)
+        if index is not None:
+            self.selected = select_range(self.anchor, index)
+            self.focus = index
+            self.redraw()
+
+    def double_click(self, event):
+        index = self.index_at_event(event)
+        if index is not None:
+            self.on_open(index)
+
+    def select_all(self, event=None):
+        self.selected = set(range(len(self.picturesList)))
+        self.redraw()
+        return "break"
+
+    def move_focus(self, step):
+        """
+        Moves the selection to a neighbouring image with the arrow keys
+        """
+        if not self.picturesList:
+            return
+        self.focus = min(max(self.focus + step, 0), len(self.picturesList) - 1)
+        self.selected = {self.focus}
+        self.anchor = self.focus
+        self.redraw()
+        self.see(self.focus)
+
+    def sort_selected(self, decision):
+        """
+        Sorts every selected image, then moves on to the image after the selection
+        """
+        if not self.selected:
+            return
+        indexes = sorted(self.selected)
+        self.on_sort(indexes, decision)
+        self.focus = min(indexes[-1] + 1, len(self.picturesList) - 1)
+        self.selected = {self.focus}
+        self.anchor = self.focus
+        self.redraw()
+        self.see(self.focus)
+
+    def close(self):
+        """
+        Stops loading thumbnails
+        """
+        if self.poll_job:
+            self.frame.after_cancel(self.poll_job)
+        self.prefetcher.close()
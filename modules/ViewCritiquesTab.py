@@ -6,13 +6,21 @@
 import tkinter as tk
 from tkinter import Scrollbar, messagebox, ttk
 from PIL import Image, ImageTk
-from io import BytesIO
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.pyramidfuncs import ImagePyramid
+from modules.thumbcache import content_key, shared_cache
+from modules.ZoomView import ZoomView
+
+# How often the fullscreen view checks whether the original finished downloading
+DOWNLOAD_POLL_MS = 100
 
 
 class ViewCritiquesTab:
     def __init__(self, notebook, dbfuncs):
         self.dbfuncs = dbfuncs
+        self.downloader = ThreadPoolExecutor(max_workers=1)
 
         # Create frame with parent notebook
         self.frame = tk.Frame(notebook)
@@ -77,21 +85,25 @@ class ViewCritiquesTab:
         self.view_critique_text.insert(tk.END, "Critique will appear here...")
         self.view_critique_text.config(state=tk.DISABLED)
 
+        # Images listed so far, in listbox order, their IDs, and the latest upload among them
+        self.all_images = {}
+        self.listed = []
+        self.listed_ids = set()
+        self.last_upload = None
         self.load_images_into_listbox()
 
     def load_images_into_listbox(self):
         """
-        Loads image to the listbox in the GUI
+        Loads image to the listbox in the GUI. Only images uploaded since the last load are fetched, in batches,
+        and images deleted since then are taken off the list
         """
         try:
-            # Fetch images from db
-            images = self.dbfuncs.getAllImages()
-
-            # Clear listbox
-            self.image_listbox.delete(0, tk.END)
+            self.remove_deleted_images()
 
             # Populate Listbox
-            for image in images:
+            for image in self.dbfuncs.iterImagesSince(self.last_upload):
+                if image["_id"] in self.listed_ids:
+                    continue  # listed by an earlier load, fetched again by the overlap
                 filename = image["filename"]
                 uploadDate = image["uploadDate"]
 
@@ -104,13 +116,35 @@ class ViewCritiquesTab:
                 list_item = f"{filename} - \t \t \t \t \t \t Uploaded: {uploadDate}"
                 self.image_listbox.insert(tk.END, list_item)
 
-            self.all_images = {image["filename"]: image for image in images}
+                self.all_images[filename] = image
+                self.listed.append(image)
+                self.listed_ids.add(image["_id"])
+                if self.last_upload is None or image["uploadDate"] > self.last_upload:
+                    self.last_upload = image["uploadDate"]
 
             print("Successfully loaded images into box")
 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load images: {e}")
 
+    def remove_deleted_images(self):
+        """
+        Takes the images that are no longer in the database off the listbox
+        """
+        if not self.listed:
+            return
+        stored_ids = self.dbfuncs.image_ids()
+        # From the bottom up, so the rows still to check keep their positions
+        for row in reversed(range(len(self.listed))):
+            image = self.listed[row]
+            if image["_id"] in stored_ids:
+                continue
+            self.image_listbox.delete(row)
+            del self.listed[row]
+            self.listed_ids.discard(image["_id"])
+            if self.all_images.get(image["filename"]) is image:
+                del self.all_images[image["filename"]]
+
     def load_selected_image(self):
         """
         Loads selected image from the database. Includes the critiue data
@@ -125,12 +159,12 @@ class ViewCritiquesTab:
             selection_title = self.image_listbox.get(selection[0])
             filename = selection_title.split("-")[0].strip()
 
-            # Retrieve image data
-            image_data = self.dbfuncs.getImageByFilename(filename)
+            # Retrieve image data by the ID listed with it
+            image_data = self.dbfuncs.getImageById(self.all_images[filename]["_id"])
             critique = image_data["metadata"]["critique"]
 
             # Display image
-            self.display_image_view_tab(image_data["_id"])
+            self.display_image_view_tab(image_data["_id"], image_data.get("sha256"))
 
             # Display Critique
             self.view_critique_text.config(state=tk.NORMAL)
@@ -150,27 +184,33 @@ class ViewCritiquesTab:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load image and critique: {e}")
 
-    def display_image_view_tab(self, file_id):
+    def display_image_view_tab(self, file_id, sha256=None):
         """
-        Helper function for load_selected_image(). Used to load actual image
+        Helper function for load_selected_image(). Used to load actual image. Only the small rendition is
+        transferred, the original is downloaded when the fullscreen view asks for it
         """
         try:
+            # Kept for the fullscreen view
+            self.view_image_label.fileId = file_id
+            self.view_image_label.imageData = None
+            self.view_image_label.imageKey = sha256
+
             # Retrieve the image binary data from the database
-            stored_file = self.dbfuncs.getImageByFileID(file_id)
-            # Convert binary data to BytesIO object
-            image_data = BytesIO(stored_file.read())
+            stored_file = self.dbfuncs.getRendition(file_id, "small")
+            if stored_file is None:
+                # Stored before renditions were made
+                stored_file = self.dbfuncs.getImageByFileID(file_id)
+                self.view_image_label.imageData = stored_file.getvalue()
+            image_data = stored_file.read()
 
             # https://www.w3resource.com/python-exercises/tkinter/python-tkinter-basic-exercise-12.php#google_vignette
-            image = Image.open(image_data)
-            image.thumbnail((400, 300))  # Resize to fit the label
+            # Resize to fit the label, from the thumbnail cache if this image was viewed before
+            image = shared_cache().load_data(image_data, (400, 300))
             photo = ImageTk.PhotoImage(image)
 
             self.view_image_label.config(image=photo)
             self.view_image_label.image = photo
 
-            image_data.seek(0)
-            self.view_image_label.fullImage = Image.open(image_data)
-
             print("Successfully displayed image")
 
         except Exception as e:
@@ -182,10 +222,7 @@ class ViewCritiquesTab:
         """
         try:
             # Check if an image is loaded in the view tab
-            if (
-                not hasattr(self.view_image_label, "image")
-                or self.view_image_label.fullImage is None
-            ):
+            if not hasattr(self.view_image_label, "fileId"):
                 raise ValueError("No image is loaded for fullscreen view.")
 
             # Create a new Toplevel window for fullscreen
@@ -196,31 +233,28 @@ class ViewCritiquesTab:
             screen_width = fullscreen_window.winfo_screenwidth()
             screen_height = fullscreen_window.winfo_screenheight()
 
-            # Get stored image dimensions
-            image = self.view_image_label.fullImage
-            image_width, image_height = image.size
-
-            # Adjust image dimensions to fit the screen size
-            if (image_width / image_height) > (screen_width / screen_height):
-                new_width = screen_width
-                new_height = int(screen_width / (image_width / image_height))
+            # Display the image in a zoomable view, drawn from tiles kept in the thumbnail cache. Until the
+            # original is downloaded, the screen-sized rendition is shown
+            label = self.view_image_label
+            original = (label.fileId, label.imageData, label.imageKey)
+            rendition = None
+            if label.imageData is None:
+                rendition = self.dbfuncs.getRendition(label.fileId, "screen")
+            if rendition is None:
+                pyramid = self.keep_original(
+                    label.fileId, self.original_pyramid(*original)
+                )
+                download = None
             else:
-                new_height = screen_height
-                new_width = int(screen_height * (image_width / image_height))
-
-            # Resize the image
-            resized_image = image.resize(
-                (new_width, new_height), Image.Resampling.LANCZOS
+                data = rendition.getvalue()
+                pyramid = ImagePyramid(data, content_key(data), shared_cache())
+                download = self.downloader.submit(self.original_pyramid, *original)
+            zoom_view = ZoomView(
+                fullscreen_window, pyramid, screen_width, screen_height - 80
             )
-
-            # Convert photo to tkinter PhotoImage
-            photo = ImageTk.PhotoImage(resized_image)
-
-            # Display the image in fullscreen
-            fullscreen_label = tk.Label(fullscreen_window)
-            fullscreen_label.config(image=photo)
-            fullscreen_label.image = photo
-            fullscreen_label.pack(expand=True, fill=tk.BOTH)
+            zoom_view.frame.pack(expand=True, fill=tk.BOTH)
+            if download is not None:
+                self.poll_download(zoom_view, label.fileId, download)
 
             # Exit fullscreen with 'Escape' key or close button
             def exit_fullscreen(event=None):
@@ -237,3 +271,66 @@ class ViewCritiquesTab:
         except Exception as e:
             print(e)
             messagebox.showerror("Error", f"Could not open fullscreen view: {e}")
+
+    def original_pyramid(self, file_id, image_data=None, image_key=None):
+        """
+        Builds the pyramid of an original with its coarsest level ready, downloading the original unless it was
+        downloaded before. Runs on the downloader thread while a rendition is shown
+
+        :param file_id: ID of the image
+        :type file_id: ObjectId
+        :param image_data: the original, if downloaded already
+        :type image_data: bytes | None
+        :param image_key: SHA-256 of the original, computed when None
+        :type image_key: str | None
+
+        :rtype: ImagePyramid
+        """
+        if image_data is None:
+            image_data = self.dbfuncs.getImageByFileID(file_id).getvalue()
+        pyramid = ImagePyramid(
+            image_data, image_key or content_key(image_data), shared_cache()
+        )
+        pyramid.build_level(pyramid.levels - 1)
+        return pyramid
+
+    def keep_original(self, file_id, pyramid):
+        """
+        Keeps a downloaded original for the next fullscreen view, if its image is still the one selected
+
+        :param file_id: ID of the image
+        :type file_id: ObjectId
+        :param pyramid: pyramid of the original
+        :type pyramid: ImagePyramid
+
+        :return: the pyramid
+        :rtype: ImagePyramid
+        """
+        if getattr(self.view_image_label, "fileId", None) == file_id:
+            self.view_image_label.imageData = pyramid.source
+            self.view_image_label.imageKey = pyramid.key
+        return pyramid
+
+    def poll_download(self, zoom_view, file_id, download):
+        """
+        Swaps the original into the fullscreen view once it has downloaded
+
+        :param zoom_view: the fullscreen view
+        :type zoom_view: ZoomView
+        :param file_id: ID of the image
+        :type file_id: ObjectId
+        :param download: download of the original
+        :type download: Future
+        """
+        if not zoom_view.canvas.winfo_exists():
+            return  # closed before the download finished
+        if not download.done():
+            self.frame.after(
+                DOWNLOAD_POLL_MS,
+                lambda: self.poll_download(zoom_view, file_id, download),
+            )
+            return
+        try:
+            zoom_view.set_pyramid(self.keep_original(file_id, download.result()))
+        except Exception as e:
+            print(f"Could not download the original: {e}")
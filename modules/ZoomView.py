@@ -0,0 +1,245 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module is a part of the frontend, a zoomable and pannable view of one photo used to check focus at
+# pixel level. It draws only the pyramid tiles in view, at the level closest to the zoom, so zooming and panning stay
+# responsive on very large files.
+
+import tkinter as tk
+from PIL import Image, ImageTk
+
+# Largest zoom, in displayed pixels per image pixel
+MAX_ZOOM = 4.0
+
+# Zoom change per mouse wheel step or +/- key
+ZOOM_STEP = 1.25
+
+# How often the view checks for tiles that finished building
+ZOOM_POLL_MS = 50
+
+
+class ZoomView:
+    def __init__(self, parent, pyramid, width, height):
+        """
+        Initialize the ZoomView class. Starts with the whole photo fitted in the view
+
+        Mouse wheel or +/-: zoom at the pointer, drag: pan, 1: 100%, 0: fit
+
+        :param parent: widget the view is placed in
+        :type parent: tk.Widget
+        :param pyramid: tiles of the photo
+        :type pyramid: ImagePyramid
+        :param width: width of the view
+        :type width: int
+        :param height: height of the view
+        :type height: int
+        """
+        self.pyramid = pyramid
+        # (level, column, row) -> canvas item, PhotoImage and whether it is the real tile
+        self.items = {}
+        self.poll_job = None
+
+        self.frame = tk.Frame(parent)
+        self.canvas = tk.Canvas(
+            self.frame, width=width, height=height, bg="black", highlightthickness=0
+        )
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.zoom_label = tk.Label(self.frame, text="", font=("Helvetica", 10))
+        self.zoom_label.pack()
+
+        image_width, image_height = pyramid.size
+        self.fit_zoom = min(width / image_width, height / image_height, 1.0)
+        self.zoom = self.fit_zoom
+
+        self.canvas.bind("<Configure>", lambda event: self.render())
+        self.canvas.bind("<ButtonPress-1>", self.start_pan)
+        self.canvas.bind("<B1-Motion>", self.pan)
+        self.canvas.bind("<MouseWheel>", self.mouse_wheel)
+        self.canvas.bind(
+            "<Button-4>",
+            lambda event: self.zoom_at(self.zoom * ZOOM_STEP, event.x, event.y),
+        )
+        self.canvas.bind(
+            "<Button-5>",
+            lambda event: self.zoom_at(self.zoom / ZOOM_STEP, event.x, event.y),
+        )
+        for key in ("<plus>", "<equal>", "<KP_Add>"):
+            self.canvas.bind(key, lambda event: self.zoom_center(self.zoom * ZOOM_STEP))
+        for key in ("<minus>", "<KP_Subtract>"):
+            self.canvas.bind(key, lambda event: self.zoom_center(self.zoom / ZOOM_STEP))
+        self.canvas.bind("1", lambda event: self.zoom_center(1.0))
+        self.canvas.bind("0", lambda event: self.zoom_center(self.fit_zoom))
+        self.canvas.focus_set()
+
+        # The single tile of the coarsest level is the stand-in for everything else
+        pyramid.request(pyramid.levels - 1)
+
+    def _scrollregion(self):
+        """
+        Scroll region of the zoomed photo, padded to the view so a small photo stays centered
+        """
+        width = self.pyramid.size[0] * self.zoom
+        height = self.pyramid.size[1] * self.zoom
+        pad_x = max(0, (self.canvas.winfo_width() - width) / 2)
+        pad_y = max(0, (self.canvas.winfo_height() - height) / 2)
+        return (-pad_x, -pad_y, width + pad_x, height + pad_y)
+
+    def render(self):
+        """
+        Draws the tiles in view at the level for the current zoom, and removes the ones that left the view
+        """
+        self.poll_job = None
+        region = self._scrollregion()
+        self.canvas.config(scrollregion=region)
+
+        level = self.pyramid.level_for(self.zoom)
+        scale = self.zoom * 2**level  # displayed pixels per pixel of the level
+        left = self.canvas.canvasx(0)
+        top = self.canvas.canvasy(0)
+        box = (
+            left / scale,
+            top / scale,
+            (left + self.canvas.winfo_width()) / scale,
+            (top + self.canvas.winfo_height()) / scale,
+        )
+        wanted = {
+            (level, column, row)
+            for column, row in self.pyramid.visible_tiles(level, box)
+        }
+
+        for key in list(self.items):
+            if key not in wanted:
+                self.canvas.delete(self.items.pop(key)[0])
+
+        waiting = False
+        for key in sorted(wanted):
+            if key in self.items and self.items[key][2]:
+                continue
+            tile = self.pyramid.tile(*key)
+            exact = tile is not None
+            if not exact:
+                waiting = True
+                if key in self.items:
+                    continue  # keep the stand-in already shown
+                tile = self.pyramid.fallback(*key)
+                if tile is None:
+                    continue
+
+            # Round the edges rather than the sizes, so neighbouring tiles meet without gaps
+            tile_left, tile_top, tile_right, tile_bottom = self.pyramid.tile_box(*key)
+            x0, y0 = round(tile_left * scale), round(tile_top * scale)
+            x1, y1 = round(tile_right * scale), round(tile_bottom * scale)
+            if (x1 - x0, y1 - y0) != tile.size:
+                tile = tile.resize(
+                    (max(1, x1 - x0), max(1, y1 - y0)),
+                    (
+                        Image.Resampling.NEAREST
+                        if scale >= 2
+                        else Image.Resampling.BILINEAR
+                    ),
+                )
+            photo = ImageTk.PhotoImage(tile)
+            if key in self.items:
+                item = self.items[key][0]
+                self.canvas.itemconfig(item, image=photo)
+            else:
+                item = self.canvas.create_image(x0, y0, anchor=tk.NW, image=photo)
+            self.items[key] = (item, photo, exact)
+
+        self.zoom_label.config(text=f"{self.zoom:.0%}")
+        if waiting:
+            self.poll_job = self.canvas.after(ZOOM_POLL_MS, self.render)
+
+    def set_pyramid(self, pyramid):
+        """
+        Swaps in a pyramid of the same photo at another resolution, such as the original once it has downloaded
+        in place of a smaller copy. The view stays on the same part of the photo at the same displayed size
+
+        :param pyramid: tiles of the photo
+        :type pyramid: ImagePyramid
+        """
+        ratio = self.pyramid.size[0] / pyramid.size[0]
+        self.clear()
+        self.pyramid = pyramid
+        self.zoom *= ratio
+        self.fit_zoom *= ratio
+        pyramid.request(pyramid.levels - 1)
+        self.render()
+
+    def clear(self):
+        for item, _, _ in self.items.values():
+            self.canvas.delete(item)
+        self.items = {}
+        if self.poll_job:
+            self.canvas.after_cancel(self.poll_job)
+            self.poll_job = None
+
+    def start_pan(self, event):
+        self.canvas.focus_set()
+        self.canvas.scan_mark(event.x, event.y)
+
+    def pan(self, event):
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        if self.poll_job is None:
+            self.render()
+
+    def mouse_wheel(self, event):
+        step = ZOOM_STEP if event.delta > 0 else 1 / ZOOM_STEP
+        self.zoom_at(self.zoom * step, event.x, event.y)
+
+    def zoom_center(self, zoom):
+        self.zoom_at(
+            zoom, self.canvas.winfo_width() / 2, self.canvas.winfo_height() / 2
+        )
+
+    def zoom_at(self, zoom, x, y):
+        """
+        Changes the zoom, keeping the image pixel under a point of the view in place
+
+        :param zoom: new zoom
+        :type zoom: float
+        :param x: x of the point, in view coordinates
+        :type x: float
+        :param y: y of the point, in view coordinates
+        :type y: float
+        """
+        zoom = min(max(zoom, self.fit_zoom), MAX_ZOOM)
+        if zoom == self.zoom:
+            return
+        image_x = self.canvas.canvasx(x) / self.zoom
+        image_y = self.canvas.canvasy(y) / self.zoom
+        self.zoom = zoom
+        self.clear()
+
+        region = self._scrollregion()
+        self.canvas.config(scrollregion=region)
+        self.canvas.xview_moveto(
+            (image_x * zoom - x - region[0]) / (region[2] - region[0])
+        )
+        self.canvas.yview_moveto(
+            (image_y * zoom - y - region[1]) / (region[3] - region[1])
+        )
+        self.render()
+
+
+def open_zoom_window(parent, pyramid, title="Zoom"):
+    """
+    Opens a ZoomView in its own window, filling most of the screen. Escape closes it
+
+    :param parent: widget the window belongs to
+    :type parent: tk.Widget
+    :param pyramid: tiles of the photo
+    :type pyramid: ImagePyramid
+    :param title: window title
+    :type title: str
+
+    :return: the view
+    :rtype: ZoomView
+    """
+    window = tk.Toplevel(parent)
+    window.title(title)
+    width = int(window.winfo_screenwidth() * 0.8)
+    height = int(window.winfo_screenheight() * 0.8)
+    view = ZoomView(window, pyramid, width, height)
+    view.frame.pack(fill=tk.BOTH, expand=True)
+    window.bind("<Escape>", lambda event: window.destroy())
+    return view
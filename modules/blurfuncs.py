@@ -0,0 +1,663 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module holds the blur scoring backend used by the Blur Sort tab. It computes the variance of Laplacian
+# of images and spreads the work across a pool of workers so large folders are scored on every core.
+
+import os
+import sys
+import time
+import functools
+import statistics
+import tracemalloc
+import cv2
+import numpy as np
+
+from modules.poolfuncs import CachedPool
+
+# Decode flags for each scale factor. The reduced flags let libjpeg scale in the DCT domain,
+# so a 1/4 decode never builds the full resolution image
+SCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# Scale factor used by the "Fast Scoring" option
+FAST_SCALE = 4
+
+# Laplacian output depths. A 3x3 laplacian of 8-bit pixels stays within +-1020, so 16-bit integers are exact
+# and a quarter of the size of CV_64F
+PRECISIONS = {"16S": cv2.CV_16S, "32F": cv2.CV_32F, "64F": cv2.CV_64F}
+DEFAULT_PRECISION = "16S"
+
+# Images taller than this are filtered in horizontal strips to cap the size of the laplacian buffer
+STRIP_ROWS = 512
+
+# Scores the slider can threshold. "global" is the whole image, the others look at tiles so a sharp subject
+# on a deliberately blurred background is not discarded
+METRICS = ("global", "max_tile", "top_k", "center")
+
+# Images scored at full resolution to fit the Fast Scoring gain of a folder
+GAIN_SAMPLE = 8
+
+# Tile edge in pixels at full resolution, and the share of tiles averaged by "top_k"
+TILE_SIZE = 128
+TOP_FRACTION = 0.1
+
+
+def scale_gain(scale):
+    """
+    Uncalibrated factor applied to a reduced resolution laplacian variance. There is no fixed relation to the
+    full resolution value: shrinking an image raises its second derivatives, but the decode also averages away
+    fine detail, and which wins depends on the photo. On the two photos in imgs/ the raw value at scale 4 was 0.39
+    and 7.8 times the full value. fit_gain corrects the values of a folder from a sample
+
+    :param scale: decode scale factor (1, 2, 4, 8)
+    :type scale: int
+
+    :return: multiplier for the reduced resolution variance
+    :rtype: float
+    """
+    return 1.0 / (scale**2)
+
+
+def _laplacian_strips(image, precision, strip_rows):
+    """
+    Filters an image with the laplacian, yielding it back in horizontal strips
+
+    :param image: 8-bit grayscale image
+    :type image: numpy.ndarray
+    :param precision: laplacian output depth ("16S", "32F" or "64F")
+    :type precision: str
+    :param strip_rows: rows filtered per strip, None filters the whole image at once
+    :type strip_rows: int | None
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unsupported precision: {precision}")
+    ddepth = PRECISIONS[precision]
+
+    rows = image.shape[0]
+    if not strip_rows or rows <= strip_rows:
+        yield cv2.Laplacian(image, ddepth)
+        return
+
+    for top in range(0, rows, strip_rows):
+        bottom = min(top + strip_rows, rows)
+        # One halo row on each side so the 3x3 kernel sees the same neighbours as a full image pass
+        start = max(top - 1, 0)
+        stop = min(bottom + 1, rows)
+        laplacian = cv2.Laplacian(image[start:stop], ddepth)
+        yield laplacian[top - start : bottom - start]
+
+
+def _merge_strip(stats, strip):
+    """
+    Merges the mean and standard deviation of one strip into running totals (Chan's parallel variance)
+
+    :param stats: running (count, mean, sum of squared deviations)
+    :type stats: tuple
+    :param strip: laplacian strip
+    :type strip: numpy.ndarray
+
+    :return: updated running totals
+    :rtype: tuple
+    """
+    count, mean, m2 = stats
+    strip_mean, strip_std = cv2.meanStdDev(strip)
+    strip_mean = float(strip_mean[0, 0])
+    strip_count = strip.size
+
+    total = count + strip_count
+    delta = strip_mean - mean
+    mean += delta * strip_count / total
+    m2 += float(strip_std[0, 0]) ** 2 * strip_count
+    m2 += delta**2 * count * strip_count / total
+    return total, mean, m2
+
+
+def laplacian_variance(image, precision=DEFAULT_PRECISION, strip_rows=STRIP_ROWS):
+    """
+    Computes the variance of the laplacian in one pass, filtering tall images strip by strip.
+    Each strip contributes its mean and standard deviation to a running total,
+    so only one strip sized buffer is alive at a time
+
+    :param image: 8-bit grayscale image
+    :type image: numpy.ndarray
+    :param precision: laplacian output depth ("16S", "32F" or "64F")
+    :type precision: str
+    :param strip_rows: rows filtered per strip, None filters the whole image at once
+    :type strip_rows: int | None
+
+    :return: variance of the laplacian
+    :rtype: float
+    """
+    stats = (0, 0.0, 0.0)
+    for strip in _laplacian_strips(image, precision, strip_rows):
+        stats = _merge_strip(stats, strip)
+    count, _, m2 = stats
+    return m2 / count
+
+
+def sharpness_map(
+    image, tile_size=TILE_SIZE, precision=DEFAULT_PRECISION, strip_rows=STRIP_ROWS
+):
+    """
+    Computes the laplacian variance of the whole image and of each tile_size x tile_size tile from the same
+    laplacian strips. Tiles are reduced with a reshape, so there is no Python loop over tiles.
+    Rows and columns past the last whole tile only count towards the whole image variance
+
+    :param image: 8-bit grayscale image
+    :type image: numpy.ndarray
+    :param tile_size: tile edge in pixels
+    :type tile_size: int
+    :param precision: laplacian output depth ("16S", "32F" or "64F")
+    :type precision: str
+    :param strip_rows: rows filtered per strip, rounded down to whole tiles
+    :type strip_rows: int | None
+
+    :return: variance of the whole image and a 2-D array of tile variances
+    :rtype: tuple
+    """
+    if strip_rows:
+        strip_rows = max(strip_rows // tile_size, 1) * tile_size
+
+    tiles_across = image.shape[1] // tile_size
+    stats = (0, 0.0, 0.0)
+    tile_rows = []
+    for strip in _laplacian_strips(image, precision, strip_rows):
+        stats = _merge_strip(stats, strip)
+
+        tiles_down = strip.shape[0] // tile_size
+        if tiles_down == 0 or tiles_across == 0:
+            continue
+        block = strip[: tiles_down * tile_size, : tiles_across * tile_size].reshape(
+            tiles_down, tile_size, tiles_across, tile_size
+        )
+        # Laplacian values are at most 1020, so their squares are exact in float32
+        sums = block.sum(axis=(1, 3), dtype=np.float64)
+        squares = np.square(block, dtype=np.float32).sum(axis=(1, 3), dtype=np.float64)
+        pixels = tile_size * tile_size
+        tile_rows.append(squares / pixels - (sums / pixels) ** 2)
+
+    count, _, m2 = stats
+    if tile_rows:
+        tiles = np.vstack(tile_rows)
+    else:
+        tiles = np.empty((0, 0))
+    return m2 / count, tiles
+
+
+def aggregate_tiles(tiles, metric, top_fraction=TOP_FRACTION):
+    """
+    Reduces a grid of tile variances to one score
+
+    :param tiles: 2-D array of tile variances from sharpness_map
+    :type tiles: numpy.ndarray
+    :param metric: "max_tile", "top_k" or "center"
+    :type metric: str
+    :param top_fraction: fraction of the sharpest tiles averaged by "top_k"
+    :type top_fraction: float
+
+    :return: aggregated score
+    :rtype: float
+    """
+    if metric == "max_tile":
+        return float(tiles.max())
+    if metric == "top_k":
+        k = max(int(tiles.size * top_fraction), 1)
+        return float(np.partition(tiles.ravel(), tiles.size - k)[-k:].mean())
+    if metric == "center":
+        # Gaussian weights centered on the frame, sigma a quarter of each side
+        ys = (np.arange(tiles.shape[0]) + 0.5) / tiles.shape[0] - 0.5
+        xs = (np.arange(tiles.shape[1]) + 0.5) / tiles.shape[1] - 0.5
+        weights = np.exp(-(ys[:, None] ** 2 + xs[None, :] ** 2) / (2 * 0.25**2))
+        return float((tiles * weights).sum() / weights.sum())
+    raise ValueError(f"Unsupported metric: {metric}")
+
+
+def compute_blurVal(image_path, scale=1, gain=None, metric="global"):
+    """
+    Computes the laplacian blur value of one image
+
+    :param image_path: path to the image file
+    :type image_path: str
+    :param scale: decode the image at 1/scale resolution (1, 2, 4 or 8)
+    :type scale: int
+    :param gain: normalization applied to reduced resolution values (defaults to scale_gain(scale))
+    :type gain: float | None
+    :param metric: score to return, one of METRICS
+    :type metric: str
+
+    :return: variance of the laplacian of the grayscale image
+    :rtype: float
+    """
+    if scale not in SCALE_FLAGS:
+        raise ValueError(f"Unsupported scale factor: {scale}")
+    if metric not in METRICS:
+        raise ValueError(f"Unsupported metric: {metric}")
+
+    image = cv2.imread(image_path, SCALE_FLAGS[scale])
+    if image is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    return blur_value(image, scale, gain, metric)
+
+
+def blur_value(image, scale=1, gain=None, metric="global"):
+    """
+    Computes the blur value of an image that is already decoded
+
+    :param image: grayscale image
+    :type image: numpy.ndarray
+    :param scale: scale factor the image was decoded at
+    :type scale: int
+    :param gain: normalization applied to reduced resolution values (defaults to scale_gain(scale))
+    :type gain: float | None
+    :param metric: score to return, one of METRICS
+    :type metric: str
+
+    :return: blur value on the full resolution scale
+    :rtype: float
+    """
+    if metric == "global":
+        blurVal = laplacian_variance(image)
+    else:
+        # Tiles cover the same area of the photo whatever the decode scale
+        blurVal, tiles = sharpness_map(image, max(TILE_SIZE // scale, 8))
+        if tiles.size:
+            blurVal = aggregate_tiles(tiles, metric)
+
+    if scale == 1:
+        return blurVal
+    return blurVal * (scale_gain(scale) if gain is None else gain)
+
+
+def _score_one(index, image_path, scale=1, gain=None, metric="global"):
+    """
+    Worker task. Returns the index with the score so results can arrive in any order,
+    and how long the image took to decode and score
+
+    :param index: position of the image in the caller's list
+    :type index: int
+    :param image_path: path to the image file
+    :type image_path: str
+    :param scale: decode scale factor
+    :type scale: int
+    :param gain: normalization for reduced resolution values
+    :type gain: float | None
+    :param metric: score to compute, one of METRICS
+    :type metric: str
+    """
+    start = time.perf_counter()
+    try:
+        blurVal = compute_blurVal(image_path, scale, gain, metric)
+    except Exception as e:
+        print(f"Error computing blur value for {image_path}: {e}")
+        blurVal = None
+    return index, blurVal, time.perf_counter() - start
+
+
+class BlurScorer:
+    def __init__(
+        self, workers=None, use_processes=True, scale=1, gain=None, metric="global"
+    ):
+        """
+        Initialize the BlurScorer class.
+
+        :param workers: Number of workers in the pool (defaults to the number of cores)
+        :type workers: int | None
+        :param use_processes: Use a process pool, falling back to threads if processes are unavailable
+        :type use_processes: bool
+        :param scale: decode scale factor, 1 is full resolution
+        :type scale: int
+        :param gain: normalization for reduced resolution values (defaults to scale_gain(scale))
+        :type gain: float | None
+        :param metric: score to compute, one of METRICS
+        :type metric: str
+        """
+        self.pool = CachedPool(_score_one, workers, use_processes)
+        self.workers = self.pool.workers
+        self.use_processes = use_processes
+        self.scale = scale
+        self.gain = gain
+        self.metric = metric
+        self.timings = self.pool.timings  # index -> seconds, for the last call to score
+
+    def score(self, image_paths, cache=None):
+        """
+        Scores images, yielding results in completion order. image_paths can be a list or a generator
+        such as scan_images, in which case scoring starts on the first file while the folder is still being read
+
+        :param image_paths: Paths of the images to score
+        :type image_paths: Iterable
+        :param cache: Score cache, only new or modified images are scored when provided
+        :type cache: ScoreCache | None
+
+        :return: Generator of (index, blur value) tuples, index being the position of the path in image_paths.
+        Blur value is None if the image could not be read. Seconds spent on each scored (not cached) image
+        are kept in self.timings
+        :rtype: Generator
+        """
+        # Cached values are stored with the default gain, so a custom gain always rescores
+        lookup = store = None
+        if cache is not None and self.gain is None:
+            lookup = functools.partial(
+                cache.lookup, scale=self.scale, metric=self.metric
+            )
+            store = functools.partial(cache.store, scale=self.scale, metric=self.metric)
+        return self.pool.run(
+            image_paths, (self.scale, self.gain, self.metric), lookup, store
+        )
+
+    def score_all(self, image_paths, cache=None):
+        """
+        Scores images and returns the values in the same order as the paths
+
+        :param image_paths: Paths of the images to score
+        :type image_paths: Iterable
+        :param cache: Score cache
+        :type cache: ScoreCache | None
+
+        :return: List of blur values
+        :rtype: list
+        """
+        blurValues = {}
+        for index, value in self.score(image_paths, cache):
+            blurValues[index] = value
+        return [blurValues[index] for index in range(len(blurValues))]
+
+
+def sort_decision(blurVal, threshold):
+    """
+    Decides where an image goes. Images below the threshold are too blurry
+
+    :param blurVal: blur value of the image, None if it could not be read
+    :type blurVal: float | None
+    :param threshold: blur threshold
+    :type threshold: float
+
+    :return: "Keep", "Discard", or None to leave the image where it is
+    :rtype: str | None
+    """
+    if blurVal is None:
+        return None
+    if blurVal < threshold:
+        return "Discard"
+    return "Keep"
+
+
+class ScoreIndex:
+    def __init__(self, blurValues, bins=40, upper_percentile=99):
+        """
+        Initialize the ScoreIndex class. Keeps the blur values sorted so keep/discard counts for any
+        threshold are a binary search, and precomputes the histogram shown under the slider
+
+        :param blurValues: blur value per image, None for images that could not be read
+        :type blurValues: list
+        :param bins: number of histogram bars
+        :type bins: int
+        :param upper_percentile: values above this percentile share the last bar, so one outlier does not squash the rest
+        :type upper_percentile: float
+        """
+        values = np.array(
+            [np.nan if value is None else value for value in blurValues], dtype=float
+        )
+        valid = np.flatnonzero(~np.isnan(values))
+
+        # order maps a position in sorted_values back to the image's index
+        self.order = valid[np.argsort(values[valid], kind="stable")]
+        self.sorted_values = values[self.order]
+
+        if len(self.sorted_values):
+            self.upper = float(np.percentile(self.sorted_values, upper_percentile))
+        else:
+            self.upper = 0.0
+        self.upper = max(self.upper, 1.0)
+        self.hist, self.edges = np.histogram(
+            np.clip(self.sorted_values, 0, self.upper), bins=bins, range=(0, self.upper)
+        )
+
+    def __len__(self):
+        return len(self.sorted_values)
+
+    def counts(self, threshold):
+        """
+        Counts the images kept and discarded at a threshold. Images below the threshold are discarded
+
+        :param threshold: blur threshold
+        :type threshold: float
+
+        :return: number kept, number discarded
+        :rtype: tuple
+        """
+        discard = int(np.searchsorted(self.sorted_values, threshold, side="left"))
+        return len(self.sorted_values) - discard, discard
+
+    def borderline(self, threshold, count=3):
+        """
+        Finds the images closest to the threshold on either side
+
+        :param threshold: blur threshold
+        :type threshold: float
+        :param count: images to return on each side
+        :type count: int
+
+        :return: indexes of the sharpest discarded images and of the blurriest kept images
+        :rtype: tuple
+        """
+        cut = int(np.searchsorted(self.sorted_values, threshold, side="left"))
+        below = self.order[max(cut - count, 0) : cut].tolist()
+        above = self.order[cut : cut + count].tolist()
+        return below, above
+
+
+def fit_gain(
+    image_paths,
+    blurValues,
+    scale=FAST_SCALE,
+    metric="global",
+    workers=None,
+    use_processes=True,
+    cache=None,
+    sample_size=GAIN_SAMPLE,
+):
+    """
+    Fits the factor that brings a folder's reduced resolution values onto the full resolution scale, so the
+    slider means the same with Fast Scoring. A sample spread over the folder is scored at full resolution,
+    the full resolution values are cached like any other
+
+    :param image_paths: Paths of the scored images
+    :type image_paths: list
+    :param blurValues: their reduced resolution values, None for images that could not be read
+    :type blurValues: list
+    :param scale: decode scale factor the values were computed at
+    :type scale: int
+    :param metric: score the values hold, one of METRICS
+    :type metric: str
+    :param workers: Number of workers in the pool
+    :type workers: int | None
+    :param use_processes: Use a process pool
+    :type use_processes: bool
+    :param cache: Score cache for the full resolution values
+    :type cache: ScoreCache | None
+    :param sample_size: number of images scored at full resolution
+    :type sample_size: int
+
+    :return: multiplier for blurValues, 1.0 if nothing could be fitted
+    :rtype: float
+    """
+    if scale == 1:
+        return 1.0
+    scored = [(path, value) for path, value in zip(image_paths, blurValues) if value]
+    if not scored:
+        return 1.0
+    step = max(len(scored) // sample_size, 1)
+    sample = scored[::step][:sample_size]
+
+    full = BlurScorer(workers, use_processes, metric=metric).score_all(
+        [path for path, _ in sample], cache
+    )
+    # Median ratio is robust against a few very noisy or very flat images
+    ratios = [f / value for f, (_, value) in zip(full, sample) if f is not None]
+    return statistics.median(ratios) if ratios else 1.0
+
+
+def calibrate_fast_scoring(
+    image_paths, threshold, scale=FAST_SCALE, workers=None, use_processes=True
+):
+    """
+    Compares reduced resolution scoring against the full resolution baseline for a set of images
+
+    :param image_paths: Paths of the images to compare
+    :type image_paths: list
+    :param threshold: blur threshold used for keep/discard decisions
+    :type threshold: float
+    :param scale: decode scale factor to test
+    :type scale: int
+    :param workers: Number of workers in the pool
+    :type workers: int | None
+    :param use_processes: Use a process pool
+    :type use_processes: bool
+
+    :return: Calibration results (timings, fitted gain, decision changes)
+    :rtype: dict
+    """
+    start = time.perf_counter()
+    full = BlurScorer(workers, use_processes).score_all(image_paths)
+    full_time = time.perf_counter() - start
+
+    # Score unnormalized so the gain can be fitted from the raw values
+    start = time.perf_counter()
+    raw = BlurScorer(workers, use_processes, scale, gain=1.0).score_all(image_paths)
+    fast_time = time.perf_counter() - start
+
+    pairs = [
+        (path, f, r)
+        for path, f, r in zip(image_paths, full, raw)
+        if f is not None and r is not None
+    ]
+
+    # Median ratio is robust against a few very noisy or very flat images
+    ratios = [f / r for _, f, r in pairs if r > 0]
+    fitted_gain = statistics.median(ratios) if ratios else scale_gain(scale)
+
+    def decisions(gain):
+        changed = {"keep_to_discard": [], "discard_to_keep": []}
+        for path, f, r in pairs:
+            full_keep = f >= threshold
+            fast_keep = r * gain >= threshold
+            if full_keep and not fast_keep:
+                changed["keep_to_discard"].append(path)
+            elif fast_keep and not full_keep:
+                changed["discard_to_keep"].append(path)
+        num_changed = len(changed["keep_to_discard"]) + len(changed["discard_to_keep"])
+        changed["agreement"] = 1 - num_changed / len(pairs) if pairs else 1.0
+        return changed
+
+    return {
+        "scale": scale,
+        "threshold": threshold,
+        "num_images": len(pairs),
+        "full_time": full_time,
+        "fast_time": fast_time,
+        "default_gain": scale_gain(scale),
+        "fitted_gain": fitted_gain,
+        "default": decisions(scale_gain(scale)),
+        "fitted": decisions(fitted_gain),
+    }
+
+
+def format_calibration_report(report):
+    """
+    Formats the result of calibrate_fast_scoring as readable text
+
+    :param report: result of calibrate_fast_scoring
+    :type report: dict
+
+    :return: Report text
+    :rtype: str
+    """
+    speedup = report["full_time"] / report["fast_time"] if report["fast_time"] else 0
+    lines = [
+        f"Fast scoring at 1/{report['scale']} resolution, threshold {report['threshold']}",
+        f"Images compared: {report['num_images']}",
+        f"Full resolution: {report['full_time']:.2f}s, fast: {report['fast_time']:.2f}s ({speedup:.1f}x)",
+    ]
+    for name in ("default", "fitted"):
+        result = report[name]
+        lines.append(
+            f"{name.capitalize()} gain {report[name + '_gain']:.4g}: "
+            f"{result['agreement'] * 100:.1f}% agreement, "
+            f"{len(result['keep_to_discard'])} keep -> discard, "
+            f"{len(result['discard_to_keep'])} discard -> keep"
+        )
+    for path in report["default"]["keep_to_discard"]:
+        lines.append(f"  keep -> discard: {os.path.basename(path)}")
+    for path in report["default"]["discard_to_keep"]:
+        lines.append(f"  discard -> keep: {os.path.basename(path)}")
+    return "\n".join(lines)
+
+
+def benchmark_laplacian(image_path, repeats=3):
+    """
+    Compares the laplacian engine against the original double CV_64F computation on one image.
+    Peak memory is the largest buffer allocation traced while scoring, the decoded image is not counted
+
+    :param image_path: path to the image file
+    :type image_path: str
+    :param repeats: runs per variant, the fastest is reported
+    :type repeats: int
+
+    :return: Dictionary of variant name to time, peak memory and blur value
+    :rtype: dict
+    """
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"Could not read image: {image_path}")
+
+    def original(img):
+        # What compute_blurVal used to do: one laplacian for the print, one for the return
+        cv2.Laplacian(img, cv2.CV_64F).var()
+        return cv2.Laplacian(img, cv2.CV_64F).var()
+
+    variants = {"original 64F x2": original}
+    for precision in PRECISIONS:
+        variants[f"{precision} full"] = lambda img, p=precision: laplacian_variance(
+            img, p, strip_rows=None
+        )
+        variants[f"{precision} strips"] = lambda img, p=precision: laplacian_variance(
+            img, p
+        )
+
+    results = {}
+    for name, func in variants.items():
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            value = func(image)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        tracemalloc.start()
+        func(image)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {"time": best, "peak_bytes": peak, "blur_val": value}
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python -m modules.blurfuncs image.jpg [image.jpg ...]
+    for path in sys.argv[1:]:
+        results = benchmark_laplacian(path)
+        baseline = results["original 64F x2"]
+        print(path)
+        for name, result in results.items():
+            print(
+                f"  {name:16} {result['time'] * 1000:8.1f} ms "
+                f"{result['peak_bytes'] / 2**20:8.1f} MB "
+                f"({baseline['time'] / result['time']:.1f}x time, "
+                f"{baseline['peak_bytes'] / max(result['peak_bytes'], 1):.1f}x memory) "
+                f"value {result['blur_val']:.2f}"
+            )
@@ -6,8 +6,175 @@ import pymongo
 import gridfs
 import datetime
 import os
+import json
+import time
+import hashlib
+import threading
 from io import BytesIO
-from pymongo import MongoClient
+from bson import Binary, ObjectId
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ASCENDING, MongoClient, ReturnDocument
+
+# Indexes each collection needs, as (keys, options). Creating an index that already exists does nothing, so these
+# are ensured on every start
+INDEXES = {
+    "fs.files": [
+        # Existence check of add_image
+        (
+            [("file_path", ASCENDING)],
+            {
+                "name": "file_path_unique",
+                "unique": True,
+                "partialFilterExpression": {"file_path": {"$type": "string"}},
+            },
+        ),
+        # Same keys and name as the index GridFS creates itself, so both are one index
+        ([("filename", ASCENDING), ("uploadDate", ASCENDING)], {}),
+        ([("uploadDate", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("metadata.theme_id", ASCENDING)], {}),
+        # References to a stored content, counted before it is removed
+        ([("sha256", ASCENDING)], {}),
+    ],
+    # Each distinct content is stored once in the blobs bucket
+    "blobs.files": [
+        ([("sha256", ASCENDING)], {"name": "sha256_unique", "unique": True}),
+    ],
+    "renditions": [
+        (
+            [("sha256", ASCENDING), ("name", ASCENDING)],
+            {"name": "sha256_name_unique", "unique": True},
+        ),
+    ],
+}
+
+# Documents fetched per round trip when listing images or themes
+PAGE_SIZE = 200
+
+# Uploads are stamped by the client before their entry is inserted, so with concurrent uploads an entry can appear
+# after a later stamped one was listed. Refreshes go back this far and callers skip what they already have
+REFRESH_OVERLAP = datetime.timedelta(seconds=60)
+
+# Uploads running at once during a bulk ingest
+INGEST_WORKERS = 4
+
+# Paths checked against the database in one query during a bulk ingest, and uploaded before the next check
+INGEST_BATCH = 256
+
+# Bytes read from an image file at a time while it is hashed and uploaded
+UPLOAD_READ_SIZE = 1024 * 1024
+
+# Smaller copies stored with each content when it is added, by name and longest side. The View tab shows "small"
+# in its list and "screen" in fullscreen while the original downloads
+RENDITIONS = {"small": 400, "screen": 2560}
+
+# JPEG encodes a screen-sized rendition about 30 times faster than WebP, which matters for a bulk ingest
+RENDITION_QUALITY = 85
+
+# Queries run on every click, as (collection, filter, sort), whose plans are checked for collection scans
+HOT_QUERIES = {
+    "add_image": ("fs.files", {"file_path": ""}, None),
+    "getImageByFilename": ("fs.files", {"filename": ""}, None),
+    "getAllImages": ("fs.files", {}, [("uploadDate", ASCENDING), ("_id", ASCENDING)]),
+    "images_by_theme": ("fs.files", {"metadata.theme_id": None}, None),
+    "getAllThemes": ("themes", {}, [("_id", ASCENDING)]),
+    "getRendition": ("renditions", {"sha256": "", "name": "small"}, None),
+}
+
+
+def after_filter(field, after):
+    """
+    Filter matching the documents that come after a page cursor, in (field, _id) order. Unlike skip, the
+    server seeks straight to the cursor on the (field, _id) index however deep the page is
+
+    :param field: field the documents are ordered by, such as "uploadDate", or "_id" alone
+    :type field: str
+    :param after: (field value, _id) of the last document already fetched, or None to start from the first
+    :type after: tuple | None
+
+    :rtype: dict
+    """
+    if after is None:
+        return {}
+    value, last_id = after
+    if field == "_id":
+        return {"_id": {"$gt": last_id}}
+    return {"$or": [{field: {"$gt": value}}, {field: value, "_id": {"$gt": last_id}}]}
+
+
+def plan_stages(plan):
+    """
+    Stages of a query plan, from the root down
+
+    :param plan: winning plan from an explain, or one of its stages
+    :type plan: dict
+
+    :return: stage names, such as "FETCH", "IXSCAN" or "COLLSCAN"
+    :rtype: list
+    """
+    stages = [plan["stage"]] if "stage" in plan else []
+    children = plan.get("inputStages", [])
+    if "inputStage" in plan:
+        children = [plan["inputStage"]] + children
+    # Plans from the slot based engine wrap the classic plan in queryPlan
+    if "queryPlan" in plan:
+        children = [plan["queryPlan"]] + children
+    for child in children:
+        stages += plan_stages(child)
+    return stages
+
+
+class IngestCheckpoint:
+    def __init__(self, checkpoint_path):
+        """
+        Initialize the IngestCheckpoint class. Records each file a bulk ingest stored, one JSON line of
+        [path, file ID] per file, so an interrupted ingest can be run again and skip them
+
+        :param checkpoint_path: checkpoint file, created if missing
+        :type checkpoint_path: str
+        """
+        self.path = checkpoint_path
+        self.done = {}  # image path -> file ID
+        try:
+            with open(checkpoint_path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            data = b""
+
+        lines = data.split(b"\n")
+        if lines[-1]:
+            # The last line was cut short by a crash
+            with open(checkpoint_path, "r+b") as file:
+                file.truncate(len(data) - len(lines[-1]))
+        for line in lines[:-1]:
+            try:
+                image_path, file_id = json.loads(line)
+            except (ValueError, TypeError):
+                continue
+            self.done[image_path] = ObjectId(file_id)
+        self.file = open(checkpoint_path, "a", encoding="utf-8")
+
+    def record(self, image_path, file_id):
+        """
+        Records a stored file
+
+        :param image_path: path to the image file
+        :type image_path: str
+        :param file_id: ID it is stored under
+        :type file_id: ObjectId
+        """
+        self.done[image_path] = file_id
+        self.file.write(json.dumps([image_path, str(file_id)]) + "\n")
+
+    def sync(self):
+        """
+        Forces the recorded files to disk, once per batch
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
 
 
 class MongoDBHandler:
@@ -26,10 +193,63 @@ class MongoDBHandler:
         self.fs = gridfs.GridFS(
             self.database
         )  # Collection to store images (and critiques)
+        # Contents of the images, once per distinct SHA-256, referenced from the image entries in fs.files.
+        # Each blob's refs counts the entries referencing it
+        self.blobs = gridfs.GridFS(self.database, collection="blobs")
         print(
             f"Connected to MongoDB at {uri}, database: {database_name} with a collection: images"
         )
 
+        # In the background, so an unreachable server does not hold up starting the app
+        self.index_thread = threading.Thread(target=self.ensure_indexes, daemon=True)
+        self.index_thread.start()
+
+    def ensure_indexes(self):
+        """
+        Creates the indexes in INDEXES that are missing, then checks that the hot queries use them
+
+        :return: names of the indexes ensured
+        :rtype: list
+        """
+        ensured = []
+        for collection_name, indexes in INDEXES.items():
+            collection = self.database[collection_name]
+            for keys, options in indexes:
+                try:
+                    ensured.append(collection.create_index(keys, **options))
+                except pymongo.errors.DuplicateKeyError as e:
+                    # Images added twice before the index existed
+                    print(f"Could not create unique index on {collection_name}: {e}")
+                except pymongo.errors.PyMongoError as e:
+                    print(f"Could not create indexes on {collection_name}: {e}")
+                    return ensured
+        self.check_query_plans()
+        return ensured
+
+    def check_query_plans(self):
+        """
+        Explains each query in HOT_QUERIES and warns about the ones that scan their whole collection
+
+        :return: query name -> stages of its winning plan
+        :rtype: dict
+        """
+        plans = {}
+        for name, (collection_name, query, sort) in HOT_QUERIES.items():
+            cursor = self.database[collection_name].find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            try:
+                explain = cursor.explain()
+            except pymongo.errors.PyMongoError as e:
+                print(f"Could not check the query plan of {name}: {e}")
+                continue
+            plans[name] = plan_stages(explain["queryPlanner"]["winningPlan"])
+            if "COLLSCAN" in plans[name]:
+                print(
+                    f"Query {name} scans all of {collection_name}, is an index missing?"
+                )
+        return plans
+
     def find_documents(self, collection_name, query=None):
         """
         Find documents in a collection.
@@ -60,31 +280,483 @@ class MongoDBHandler:
         :param image_path: Path to the image file
         :type image_path: str
         """
-        # Find if file exists already in database
-        file = self.fs.find_one({"file_path": image_path})
+        # Find if file exists already in database, answered from the file_path index alone
+        file = self.database["fs.files"].find_one({"file_path": image_path}, {"_id": 1})
 
         if file:
             print(f"File already exists")
-            return file_id
+            return file["_id"]
+
+        file_id, _, _ = self._store_image(image_path)
+        print(file_id)
+        return file_id
+
+    def _store_content(self, file):
+        """
+        Uploads the content of an open file to the blobs bucket, hashing it in the same read pass. When the
+        same content is stored already, the upload is dropped and the stored copy is used. New contents get their
+        renditions from the bytes kept from that pass, so the file is only read once. Either way the blob's refs
+        count is raised by one for the image entry the caller adds, and _release_content drops it again
+
+        :param file: image file opened for binary reading
+        :type file: BinaryIO
+
+        :return: ID of the blob, its SHA-256, its size in bytes, and whether it was stored already
+        :rtype: tuple
+        """
+        hasher = hashlib.sha256()
+        blob = self.blobs.new_file()
+        blocks = []
+        try:
+            while True:
+                data = file.read(UPLOAD_READ_SIZE)
+                if not data:
+                    break
+                hasher.update(data)
+                blob.write(data)
+                blocks.append(data)
+            digest = hasher.hexdigest()
+            # Stored in the blob's document on close
+            blob.sha256 = digest
+            blob.refs = 1
+            blob.close()
+        except gridfs.errors.FileExists:
+            # The unique sha256 index turned the upload down
+            blob.abort()
+            existing = self.database["blobs.files"].find_one_and_update(
+                {"sha256": digest},
+                {"$inc": {"refs": 1}},
+                projection={"_id": 1, "length": 1},
+            )
+            if not existing:
+                raise gridfs.errors.NoFile(f"Blob {digest} was removed during upload")
+            return existing["_id"], digest, existing["length"], True
+        except BaseException:
+            blob.abort()
+            raise
+
+        # The blob is committed and may already be shared by another upload, so nothing from here on removes it
+        self._store_renditions(digest, b"".join(blocks))
+        return blob._id, digest, blob.length, False
+
+    def _release_content(self, digest):
+        """
+        Drops one reference to a stored content and removes the content once no image entry references it.
+        The count is changed in one atomic update, so two deletions of images sharing a content cannot both
+        keep it or both remove it
+        """
+        blob = self.database["blobs.files"].find_one_and_update(
+            {"sha256": digest},
+            {"$inc": {"refs": -1}},
+            projection={"_id": 1, "refs": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not blob or blob["refs"] > 0:
+            return
+        # An upload of the same content may have taken a new reference since, then the blob stays
+        removed = self.database["blobs.files"].delete_one(
+            {"_id": blob["_id"], "refs": 0}
+        )
+        if removed.deleted_count:
+            self.database["blobs.chunks"].delete_many({"files_id": blob["_id"]})
+            self.database["renditions"].delete_many({"sha256": digest})
 
-        # Add file into the database
+    def _store_renditions(self, digest, data):
+        """
+        Stores the RENDITIONS of a content, upright and as JPEG. The original is decoded once at the largest size
+        and each smaller one is shrunk from the one before. Renditions are optional: when they cannot be made or
+        stored, such as for a file that is not an image, the content is kept without them
+
+        :param digest: SHA-256 of the content
+        :type digest: str
+        :param data: the content
+        :type data: bytes
+        """
+        # Imported here so the database layer only loads the image decoders when it stores an image
+        from modules.previewfuncs import decode_display
+
+        documents = []
+        try:
+            image = None
+            for name, side in sorted(RENDITIONS.items(), key=lambda item: -item[1]):
+                if image is None:
+                    image = decode_display(BytesIO(data), (side, side), upscale=False)
+                else:
+                    image = decode_display(image, (side, side), 1, upscale=False)
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                encoded = BytesIO()
+                image.save(encoded, "JPEG", quality=RENDITION_QUALITY)
+                documents.append(
+                    {
+                        "sha256": digest,
+                        "name": name,
+                        "width": image.width,
+                        "height": image.height,
+                        "data": Binary(encoded.getvalue()),
+                    }
+                )
+        except Exception as e:
+            print(f"Could not make renditions of {digest}: {e}")
+            return
+
+        try:
+            self.database["renditions"].insert_many(documents, ordered=False)
+        except pymongo.errors.BulkWriteError:
+            pass  # stored by another upload of the same content
+        except pymongo.errors.PyMongoError as e:
+            print(f"Could not store renditions of {digest}: {e}")
+
+    def getRendition(self, file_id, name):
+        """
+        Gets one of the smaller copies of an image stored when it was added, far less to transfer than the original
+
+        :param file_id: ID that specifies one specific image
+        :type file_id: ObjectId
+        :param name: name of the rendition in RENDITIONS, such as "small"
+        :type name: str
+
+        :return: the encoded rendition, or None for images stored before renditions were made
+        :rtype: BytesIO | None
+        """
+        file = self.database["fs.files"].find_one({"_id": file_id}, {"sha256": 1})
+        if not file or not file.get("sha256"):
+            return None
+        rendition = self.database["renditions"].find_one(
+            {"sha256": file["sha256"], "name": name}, {"data": 1}
+        )
+        if not rendition:
+            return None
+        return BytesIO(rendition["data"])
+
+    def _store_image(self, image_path):
+        """
+        Stores an image file without checking whether its path is stored already. If another upload of the same
+        path won the race, its ID is returned instead
+
+        :return: ID of the image entry, the bytes read (None when the other upload won), and whether its
+            content was stored already
+        :rtype: tuple
+        """
         with open(image_path, "rb") as file:
-            file_id = self.fs.put(
-                file,
-                filename=os.path.basename(image_path),
-                file_path=image_path,
-                metadata={
-                    "critique": {
-                        "positive": None,
-                        "improvement": None,
-                        "overview": None,
+            blob_id, digest, size, deduplicated = self._store_content(file)
+
+        # The image entry keeps the fs.files layout, so listings, critiques and deletion work as before.
+        # It has no chunks of its own: its length is 0 and the content is in the blobs bucket under blob_id.
+        # Plain GridFS readers (fs.get, mongofiles) see an empty file, so read images with getImageByFileID
+        file_id = ObjectId()
+        try:
+            self.database["fs.files"].insert_one(
+                {
+                    "_id": file_id,
+                    "filename": os.path.basename(image_path),
+                    "file_path": image_path,
+                    "length": 0,
+                    "chunkSize": gridfs.DEFAULT_CHUNK_SIZE,
+                    "uploadDate": datetime.datetime.now(tz=datetime.timezone.utc),
+                    "blob_id": blob_id,
+                    "sha256": digest,
+                    "size": size,
+                    "metadata": {
+                        "critique": {
+                            "positive": None,
+                            "improvement": None,
+                            "overview": None,
+                        },
+                        "theme_id": None,
                     },
-                    "theme_id": None,
-                },
+                }
             )
+        except pymongo.errors.DuplicateKeyError:
+            self._release_content(digest)
+            file = self.database["fs.files"].find_one(
+                {"file_path": image_path}, {"_id": 1}
+            )
+            if not file:
+                raise
+            return file["_id"], None, False
+        return file_id, size, deduplicated
 
-        print(file_id)
-        return file_id
+    def stored_ids(self, image_paths):
+        """
+        Finds which of several image files are stored already, in one query
+
+        :param image_paths: paths to the image files
+        :type image_paths: list
+
+        :return: image path -> file ID, for the stored ones
+        :rtype: dict
+        """
+        files = self.database["fs.files"].find(
+            {"file_path": {"$in": list(image_paths)}}, {"_id": 1, "file_path": 1}
+        )
+        return {file["file_path"]: file["_id"] for file in files}
+
+    def ingest_images(
+        self,
+        image_paths,
+        workers=INGEST_WORKERS,
+        batch_size=INGEST_BATCH,
+        checkpoint_path=None,
+    ):
+        """
+        Adds many image files at once. Each batch of paths is checked against the database in one query, and the
+        new files are uploaded by a pool of workers. A failed file does not stop the others
+
+        :param image_paths: paths to the image files, read lazily so a generator can be passed
+        :type image_paths: Iterable[str]
+        :param workers: uploads running at once
+        :type workers: int
+        :param batch_size: paths checked in one query
+        :type batch_size: int
+        :param checkpoint_path: file recording the stored files, so running the same ingest again after a crash
+            skips them without asking the database
+        :type checkpoint_path: str | None
+
+        :return: "results", a list of {"path", "status", "file_id", "error"} with status "added", "exists" or
+            "failed", and the totals "added", "exists", "failed", "bytes", "seconds" and "bytes_per_second".
+            "deduplicated" counts the added files whose content was stored already, and "bytes_saved" their size
+        :rtype: dict
+        """
+        checkpoint = IngestCheckpoint(checkpoint_path) if checkpoint_path else None
+        report = {
+            "results": [],
+            "added": 0,
+            "exists": 0,
+            "failed": 0,
+            "bytes": 0,
+            "deduplicated": 0,
+            "bytes_saved": 0,
+        }
+        start = time.perf_counter()
+
+        def finish(image_path, status, file_id=None, error=None):
+            report["results"].append(
+                {
+                    "path": image_path,
+                    "status": status,
+                    "file_id": file_id,
+                    "error": error,
+                }
+            )
+            report[status] += 1
+            if checkpoint and file_id is not None and image_path not in checkpoint.done:
+                checkpoint.record(image_path, file_id)
+
+        def ingest_batch(batch):
+            stored = self.stored_ids(batch)
+            new_paths = []
+            for image_path in batch:
+                if image_path in stored:
+                    finish(image_path, "exists", stored[image_path])
+                else:
+                    new_paths.append(image_path)
+            futures = [pool.submit(self._store_image, path) for path in new_paths]
+            for image_path, future in zip(new_paths, futures):
+                try:
+                    file_id, size, deduplicated = future.result()
+                except (
+                    OSError,
+                    pymongo.errors.PyMongoError,
+                    gridfs.errors.NoFile,
+                ) as e:
+                    finish(image_path, "failed", error=str(e))
+                    continue
+                if size is None:
+                    finish(image_path, "exists", file_id)
+                    continue
+                report["bytes"] += size
+                if deduplicated:
+                    report["deduplicated"] += 1
+                    report["bytes_saved"] += size
+                finish(image_path, "added", file_id)
+            if checkpoint:
+                checkpoint.sync()
+
+        seen = set()
+        batch = []
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for image_path in image_paths:
+                    if image_path in seen:
+                        continue
+                    seen.add(image_path)
+                    if checkpoint and image_path in checkpoint.done:
+                        finish(image_path, "exists", checkpoint.done[image_path])
+                        continue
+                    batch.append(image_path)
+                    if len(batch) >= batch_size:
+                        ingest_batch(batch)
+                        batch = []
+                if batch:
+                    ingest_batch(batch)
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+        report["seconds"] = time.perf_counter() - start
+        report["bytes_per_second"] = (
+            report["bytes"] / report["seconds"] if report["seconds"] else 0.0
+        )
+        print(
+            f"Ingested {report['added']} images, {report['exists']} already stored, "
+            f"{report['failed']} failed, {report['bytes'] / 1024 / 1024:.1f} MB at "
+            f"{report['bytes_per_second'] / 1024 / 1024:.1f} MB/s, "
+            f"{report['deduplicated']} duplicates saved {report['bytes_saved'] / 1024 / 1024:.1f} MB"
+        )
+        return report
+
+    def storage_report(self):
+        """
+        Compares the size of every stored image with the space their deduplicated contents take
+
+        :return: "images" and "contents" counted, "logical_bytes", "stored_bytes", "reclaimed_bytes", and
+            "dedupe_rate", the fraction of images whose content is shared with an earlier one
+        :rtype: dict
+        """
+        images = list(
+            self.database["fs.files"].aggregate(
+                [
+                    {"$match": {"sha256": {"$exists": True}}},
+                    {
+                        "$group": {
+                            "_id": None,
+                            "images": {"$sum": 1},
+                            "logical_bytes": {"$sum": "$size"},
+                        }
+                    },
+                ]
+            )
+        )
+        contents = list(
+            self.database["blobs.files"].aggregate(
+                [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "contents": {"$sum": 1},
+                            "stored_bytes": {"$sum": "$length"},
+                        }
+                    }
+                ]
+            )
+        )
+        report = {"images": 0, "logical_bytes": 0, "contents": 0, "stored_bytes": 0}
+        for totals in images + contents:
+            totals.pop("_id")
+            report.update(totals)
+        report["reclaimed_bytes"] = report["logical_bytes"] - report["stored_bytes"]
+        report["dedupe_rate"] = (
+            1 - report["contents"] / report["images"] if report["images"] else 0.0
+        )
+        print(
+            f"Storage: {report['images']} images in {report['contents']} contents, "
+            f"{report['reclaimed_bytes'] / 1024 / 1024:.1f} MB reclaimed "
+            f"({report['dedupe_rate']:.0%} duplicates)"
+        )
+        return report
+
+    def _page(self, collection, field, projection, after, limit):
+        """
+        Shared by the paged and streamed listings. Fetches the documents after a cursor, ordered by (field, _id)
+
+        :return: the documents, and the cursor of the last one (after itself when there were none)
+        :rtype: tuple
+        """
+        order = [("_id", ASCENDING)]
+        if field != "_id":
+            order.insert(0, (field, ASCENDING))
+        documents = list(
+            collection.find(after_filter(field, after), projection)
+            .sort(order)
+            .limit(limit)
+        )
+        if documents:
+            after = (documents[-1].get(field), documents[-1]["_id"])
+        return documents, after
+
+    def _stream(self, collection, field, projection, after, batch_size):
+        """
+        Yields every document after a cursor, fetching batch_size at a time
+        """
+        while True:
+            documents, after = self._page(
+                collection, field, projection, after, batch_size
+            )
+            yield from documents
+            if len(documents) < batch_size:
+                return
+
+    def getImagesPage(self, after=None, limit=PAGE_SIZE):
+        """
+        Fetches one page of images, oldest upload first
+
+        :param after: cursor returned with the previous page, None for the first page
+        :type after: tuple | None
+        :param limit: largest number of images in the page
+        :type limit: int
+
+        :return: list of image objects, and the cursor to pass for the next page
+        :rtype: tuple
+        """
+        return self._page(
+            self.database["fs.files"],
+            "uploadDate",
+            {"_id": 1, "filename": 1, "uploadDate": 1},
+            after,
+            limit,
+        )
+
+    def iterImages(self, after=None, batch_size=PAGE_SIZE):
+        """
+        Streams the images, oldest upload first, holding one batch in memory at a time. Passing the
+        (uploadDate, _id) of the last image seen continues from it. To refresh a listing, use iterImagesSince
+
+        :param after: (uploadDate, _id) of the last image already seen, None for all images
+        :type after: tuple | None
+        :param batch_size: images fetched per round trip
+        :type batch_size: int
+
+        :return: image objects with their _id, filename and uploadDate
+        :rtype: Iterator[dict]
+        """
+        return self._stream(
+            self.database["fs.files"],
+            "uploadDate",
+            {"_id": 1, "filename": 1, "uploadDate": 1},
+            after,
+            batch_size,
+        )
+
+    def iterImagesSince(self, last_upload, batch_size=PAGE_SIZE):
+        """
+        Streams the images uploaded since an earlier listing, oldest first. Starts REFRESH_OVERLAP before the
+        last upload listed, so an entry inserted late by a concurrent upload is not missed. Images already
+        listed come again and are to be skipped by their _id
+
+        :param last_upload: uploadDate of the latest image already listed, None for all images
+        :type last_upload: datetime.datetime | None
+        :param batch_size: images fetched per round trip
+        :type batch_size: int
+
+        :return: image objects with their _id, filename and uploadDate
+        :rtype: Iterator[dict]
+        """
+        if last_upload is None:
+            return self.iterImages(batch_size=batch_size)
+        # The lowest possible _id makes the cursor include every image stamped at that time
+        after = (last_upload - REFRESH_OVERLAP, ObjectId("0" * 24))
+        return self.iterImages(after=after, batch_size=batch_size)
+
+    def image_ids(self):
+        """
+        IDs of every stored image, read from the _id index alone. Used to take deleted images off a listing
+        that is otherwise only refreshed with new uploads
+
+        :return: Set of image IDs
+        :rtype: set
+        """
+        return {file["_id"] for file in self.database["fs.files"].find({}, {"_id": 1})}
 
     def getAllImages(self):
         """
@@ -93,10 +765,7 @@ class MongoDBHandler:
         :return: List of image objects
         :rtype: list
         """
-        filesCollection = self.database["fs.files"]  # Fetch database
-        return list(
-            filesCollection.find({}, {"_id": 1, "filename": 1, "uploadDate": 1})
-        )
+        return list(self.iterImages())
 
     def getImageByFileID(self, file_id):
         """
@@ -105,17 +774,32 @@ class MongoDBHandler:
         :param file_id: ID that specifies one specific image
         :type file_id: str
         """
-        # Initilalize variable for collection
-        fileCollection = self.database["fs.files"]
-        # Find in the collection
-        file = fileCollection.find_one({"_id": file_id})
-        if not file:
+        try:
+            stored_file = self.fs.get(file_id)  # Get the file by its ID
+            # Images stored since contents are deduplicated hold their content in the blobs bucket
+            blob_id = getattr(stored_file, "blob_id", None)
+            if blob_id is not None:
+                stored_file = self.blobs.get(blob_id)
+        except gridfs.errors.NoFile:
             raise FileNotFoundError("File does not exist in the database")
-
-        stored_file = self.fs.get(file_id)  # Get the file by its ID
         image_data = BytesIO(stored_file.read())  # Create in-memory file
         return image_data
 
+    def getImageById(self, file_id):
+        """
+        Retrieves the metadata of an image by its ID
+
+        :param file_id: ID that specifies one specific image
+        :type file_id: ObjectId
+
+        :return: image metadata
+        :rtype: dict | None
+        """
+        file = self.database["fs.files"].find_one({"_id": file_id})
+        if not file:
+            print(f"No file found with file id {file_id}")
+        return file
+
     def getImageByFilename(self, filename):
         """
         Retrieves the image file with its associated filename or gemini-generated filename
@@ -159,7 +843,11 @@ class MongoDBHandler:
         :rtype: boolean
         """
         try:
+            file = self.database["fs.files"].find_one({"_id": file_id}, {"sha256": 1})
             self.fs.delete(file_id)
+            # The content goes with its last image
+            if file and file.get("sha256"):
+                self._release_content(file["sha256"])
             print(f"File with file_id {file_id} deleted successfully")
             return True
         except gridfs.errors.NoFile:
@@ -209,9 +897,27 @@ class MongoDBHandler:
         :return: List of objects containing theme data
         :rtype: list | None
         """
-        themeCollection = self.themesCollection
-        return list(
-            themeCollection.find({}, {"_id": 1, "theme_name": 1, "description": 1})
+        return list(self.iterThemes())
+
+    def iterThemes(self, after=None, batch_size=PAGE_SIZE):
+        """
+        Streams the themes, oldest first, holding one batch in memory at a time. Themes are paged by _id,
+        which grows with the time they were added, since older themes may have no time_added to page on
+
+        :param after: _id of the last theme already seen, None for all themes
+        :type after: ObjectId | None
+        :param batch_size: themes fetched per round trip
+        :type batch_size: int
+
+        :return: theme objects with their _id, theme_name and description
+        :rtype: Iterator[dict]
+        """
+        return self._stream(
+            self.themesCollection,
+            "_id",
+            {"_id": 1, "theme_name": 1, "description": 1, "time_added": 1},
+            None if after is None else (after, after),
+            batch_size,
         )
 
     def getThemeById(self, theme_id):
@@ -262,17 +968,8 @@ class MongoDBHandler:
         if not file_id or not critique:
             raise ValueError("file_id, critique, and rating cannot be empty.")
 
-        # validate if the file_id exists (find it in database)
-        try:
-            # Fetch the database
-            fileCollection = self.database["fs.files"]
-            # Find the stored image in database
-            filename = fileCollection.find_one({"_id": file_id})
-            # Handle if document is not found
-            if not filename:
-                raise LookupError("File_id not found in database")
-        except FileNotFoundError as e:
-            return f"Error finding file in database: {e}"
+        # Fetch the database
+        fileCollection = self.database["fs.files"]
 
         try:
             # Insert critique data into the correct file
@@ -288,6 +985,9 @@ class MongoDBHandler:
                 },
             )
 
+            # The update matches on _id, so it also tells whether the image exists
+            if not result.matched_count:
+                raise LookupError("File_id not found in database")
             return result
         except pymongo.errors.OperationFailure as e:
             print(f"Error adding critique data to file: {e}")
@@ -0,0 +1,374 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module reads capture metadata (time, camera, lens, ISO, shutter, orientation) from the EXIF block at the
+# start of an image file. Only the first few kilobytes are read and no pixels are decoded, so a large folder can be indexed,
+# ordered by capture time and grouped by camera in seconds.
+
+import os
+import struct
+import datetime
+import itertools
+
+from modules.poolfuncs import CachedPool
+from modules.scorecache import METADATA_FIELDS
+
+# Bytes searched for the EXIF segment, and read from TIFF files. APP1 segments are at most 64 KB
+EXIF_PREFIX = 128 * 1024
+
+# Metadata reading is I/O bound, so it runs on threads
+EXIF_THREADS = 8
+
+# TIFF tags read from IFD0 and the Exif sub-IFD
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_EXPOSURE_TIME = 0x829A
+TAG_ISO = 0x8827
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_SUBSEC_ORIGINAL = 0x9291
+TAG_LENS_MODEL = 0xA434
+
+# IFD1 tags locating the embedded JPEG thumbnail
+TAG_THUMBNAIL_OFFSET = 0x0201
+TAG_THUMBNAIL_LENGTH = 0x0202
+
+# Tags decoded from each directory, everything else is skipped without decoding
+IFD0_TAGS = {TAG_MAKE, TAG_MODEL, TAG_ORIENTATION, TAG_DATETIME, TAG_EXIF_IFD}
+EXIF_TAGS = {
+    TAG_EXPOSURE_TIME,
+    TAG_ISO,
+    TAG_DATETIME_ORIGINAL,
+    TAG_SUBSEC_ORIGINAL,
+    TAG_LENS_MODEL,
+}
+IFD1_TAGS = {TAG_THUMBNAIL_OFFSET, TAG_THUMBNAIL_LENGTH}
+
+# Bytes per value of each TIFF field type
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8, 11: 4, 12: 8}
+
+
+def read_exif_block(image_path):
+    """
+    Reads the TIFF structured EXIF data of a JPEG (APP1 segment) or TIFF file with a bounded prefix read
+
+    :param image_path: path to the image file
+    :type image_path: str
+
+    :return: the TIFF data and its offset in the file, or (None, None) if the file has no EXIF block
+    :rtype: tuple
+    """
+    with open(image_path, "rb") as file:
+        head = file.read(4)
+        if head in (b"II*\x00", b"MM\x00*"):
+            # TIFF based files are EXIF structured from the first byte
+            return head + file.read(EXIF_PREFIX - len(head)), 0
+        if head[:2] != b"\xff\xd8":
+            return None, None
+
+        # Walk the JPEG markers up to the first APP1 "Exif" segment, seeking over the others
+        position = 2
+        while position < EXIF_PREFIX:
+            file.seek(position)
+            header = file.read(4)
+            if len(header) < 4:
+                return None, None
+            marker, length = struct.unpack(">2sH", header)
+            if marker[0] != 0xFF or marker[1] in (0xDA, 0xD9):
+                # Start of the compressed image, there is no EXIF block before it
+                return None, None
+            if marker[1] == 0xE1:
+                segment = file.read(length - 2)
+                if segment.startswith(b"Exif\x00\x00"):
+                    return segment[6:], position + 10
+            position += 2 + length
+    return None, None
+
+
+def _read_ifd(tiff, offset, endian, wanted):
+    """
+    Reads the entries of one image file directory
+
+    :param tiff: TIFF data
+    :type tiff: bytes
+    :param offset: offset of the directory in tiff
+    :type offset: int
+    :param endian: "<" or ">"
+    :type endian: str
+    :param wanted: tags to decode
+    :type wanted: set
+
+    :return: Dictionary of tag to value, and the offset of the next directory (0 if none)
+    :rtype: tuple
+    """
+    entries = {}
+    if offset <= 0 or offset + 2 > len(tiff):
+        return entries, 0
+    (count,) = struct.unpack_from(endian + "H", tiff, offset)
+    entry_format = endian + "HHI"
+    for i in range(count):
+        start = offset + 2 + i * 12
+        if start + 12 > len(tiff):
+            break
+        tag, field_type, num = struct.unpack_from(entry_format, tiff, start)
+        if tag not in wanted:
+            continue
+        size = TYPE_SIZES.get(field_type)
+        if size is None:
+            continue
+        if size * num <= 4:
+            raw = tiff[start + 8 : start + 8 + size * num]
+        else:
+            (value_offset,) = struct.unpack_from(endian + "I", tiff, start + 8)
+            raw = tiff[value_offset : value_offset + size * num]
+            if len(raw) < size * num:
+                continue  # points past what was read
+        entries[tag] = _decode_value(raw, field_type, num, endian)
+
+    next_start = offset + 2 + count * 12
+    next_offset = 0
+    if next_start + 4 <= len(tiff):
+        (next_offset,) = struct.unpack_from(endian + "I", tiff, next_start)
+    return entries, next_offset
+
+
+def _decode_value(raw, field_type, num, endian):
+    """
+    Decodes a TIFF field. Strings come back as str, single numbers as numbers and arrays as tuples
+    """
+    if field_type == 2:
+        return raw.split(b"\x00", 1)[0].decode("utf-8", "replace").strip()
+    if field_type in (1, 7):
+        return raw
+    if field_type in (5, 10):
+        code = "I" if field_type == 5 else "i"
+        parts = struct.unpack(endian + code * (2 * num), raw)
+        values = tuple(
+            numerator / denominator if denominator else 0.0
+            for numerator, denominator in zip(parts[::2], parts[1::2])
+        )
+    else:
+        code = {3: "H", 4: "I", 9: "i", 11: "f", 12: "d"}[field_type]
+        values = struct.unpack(endian + code * num, raw)
+    return values[0] if num == 1 else values
+
+
+def parse_exif(tiff):
+    """
+    Reads the directories of an EXIF block
+
+    :param tiff: TIFF data from read_exif_block
+    :type tiff: bytes
+
+    :return: the IFD0 and Exif sub-IFD tags this module uses in one dictionary, and the thumbnail tags of IFD1
+    :rtype: tuple
+    """
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return {}, {}
+    endian = "<" if tiff[:2] == b"II" else ">"
+    (ifd0_offset,) = struct.unpack(endian + "I", tiff[4:8])
+
+    tags, ifd1_offset = _read_ifd(tiff, ifd0_offset, endian, IFD0_TAGS)
+    exif_offset = tags.get(TAG_EXIF_IFD)
+    if isinstance(exif_offset, int):
+        tags.update(_read_ifd(tiff, exif_offset, endian, EXIF_TAGS)[0])
+    ifd1 = {}
+    if ifd1_offset:
+        ifd1 = _read_ifd(tiff, ifd1_offset, endian, IFD1_TAGS)[0]
+    return tags, ifd1
+
+
+def _capture_time(tags):
+    """
+    Capture time as seconds, reading the camera's local clock as if it were UTC so times only serve for ordering
+    """
+    text = tags.get(TAG_DATETIME_ORIGINAL) or tags.get(TAG_DATETIME)
+    if not isinstance(text, str):
+        return None
+    # "YYYY:MM:DD HH:MM:SS", sliced by hand because strptime dominates the cost of a small folder
+    try:
+        moment = datetime.datetime(
+            int(text[0:4]),
+            int(text[5:7]),
+            int(text[8:10]),
+            int(text[11:13]),
+            int(text[14:16]),
+            int(text[17:19]),
+        )
+    except ValueError:
+        return None
+    seconds = moment.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+    subsec = tags.get(TAG_SUBSEC_ORIGINAL)
+    if isinstance(subsec, str) and subsec.isdigit():
+        seconds += int(subsec) / 10 ** len(subsec)
+    return seconds
+
+
+def read_metadata(image_path):
+    """
+    Reads the capture metadata of an image without decoding it
+
+    :param image_path: path to the image file
+    :type image_path: str
+
+    :return: Dictionary with the METADATA_FIELDS, each None when the file does not record it
+    :rtype: dict
+    """
+    tiff, _ = read_exif_block(image_path)
+    tags = parse_exif(tiff)[0] if tiff else {}
+
+    make = tags.get(TAG_MAKE) if isinstance(tags.get(TAG_MAKE), str) else ""
+    model = tags.get(TAG_MODEL) if isinstance(tags.get(TAG_MODEL), str) else ""
+    # Many models already start with the make ("Canon EOS R5")
+    camera = model if model.lower().startswith(make.lower()) else f"{make} {model}"
+
+    iso = tags.get(TAG_ISO)
+    if isinstance(iso, tuple):
+        iso = iso[0]
+    shutter = tags.get(TAG_EXPOSURE_TIME)
+    orientation = tags.get(TAG_ORIENTATION)
+    lens = tags.get(TAG_LENS_MODEL)
+    return {
+        "capture_time": _capture_time(tags),
+        "camera": camera.strip() or None,
+        "lens": lens if isinstance(lens, str) and lens else None,
+        "iso": iso if isinstance(iso, int) else None,
+        "shutter": float(shutter) if isinstance(shutter, (int, float)) else None,
+        "orientation": orientation if isinstance(orientation, int) else None,
+    }
+
+
+def _read_one(index, image_path):
+    """
+    Worker task for MetadataIndexer
+
+    :param index: position of the image in the caller's list
+    :type index: int
+    :param image_path: path to the image file
+    :type image_path: str
+    """
+    try:
+        metadata = read_metadata(image_path)
+    except Exception as e:
+        print(f"Error reading metadata of {image_path}: {e}")
+        metadata = None
+    return index, metadata, 0.0
+
+
+class MetadataIndexer:
+    def __init__(self, workers=EXIF_THREADS):
+        """
+        Initialize the MetadataIndexer class. Reads metadata on a thread pool, reading and writing
+        the metadata table of the score cache
+
+        :param workers: Number of threads reading files at once
+        :type workers: int
+        """
+        self.pool = CachedPool(_read_one, workers, use_processes=False)
+        # index -> seconds, for the last call to index_all
+        self.timings = self.pool.timings
+
+    def index_all(self, image_paths, cache=None):
+        """
+        Reads the metadata of images and returns it in the same order as the paths
+
+        :param image_paths: Paths of the images
+        :type image_paths: Iterable
+        :param cache: Score cache, only new or modified images are read when provided
+        :type cache: ScoreCache | None
+
+        :return: List of metadata dictionaries, None for files that could not be read
+        :rtype: list
+        """
+        if cache is None:
+            return self.pool.run_all(image_paths)
+        return self.pool.run_all(
+            image_paths, lookup=cache.lookup_metadata, store=cache.store_metadata
+        )
+
+
+def capture_key(image_path, metadata):
+    """
+    Sort key by capture time. Images without one fall back to their modification time on the same local clock
+
+    :param image_path: path to the image file
+    :type image_path: str
+    :param metadata: metadata of the image, or None
+    :type metadata: dict | None
+
+    :return: seconds
+    :rtype: float
+    """
+    if metadata and metadata["capture_time"] is not None:
+        return metadata["capture_time"]
+    try:
+        local = datetime.datetime.fromtimestamp(os.path.getmtime(image_path))
+    except OSError:
+        return 0.0
+    return local.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def order_by_capture(image_paths, metadata):
+    """
+    Orders images by capture time, then by path
+
+    :param image_paths: Paths of the images
+    :type image_paths: list
+    :param metadata: metadata per image, from MetadataIndexer.index_all
+    :type metadata: list
+
+    :return: image paths in capture order
+    :rtype: list
+    """
+    keys = [capture_key(path, meta) for path, meta in zip(image_paths, metadata)]
+    order = sorted(range(len(image_paths)), key=lambda i: (keys[i], image_paths[i]))
+    return [image_paths[i] for i in order]
+
+
+def group_by_camera(image_paths, metadata):
+    """
+    Groups images by camera body, each group in capture order
+
+    :param image_paths: Paths of the images
+    :type image_paths: list
+    :param metadata: metadata per image, from MetadataIndexer.index_all
+    :type metadata: list
+
+    :return: Dictionary of camera name ("Unknown" if not recorded) to image paths, cameras in name order
+    :rtype: dict
+    """
+    keyed = sorted(
+        (
+            (meta or {}).get("camera") or "Unknown",
+            capture_key(path, meta),
+            path,
+        )
+        for path, meta in zip(image_paths, metadata)
+    )
+    return {
+        camera: [path for _, _, path in entries]
+        for camera, entries in itertools.groupby(keyed, key=lambda entry: entry[0])
+    }
+
+
+def describe(metadata):
+    """
+    Formats metadata as one line of text, such as "Canon EOS R5, RF24-70mm, ISO 400, 1/250s"
+
+    :param metadata: metadata of an image
+    :type metadata: dict | None
+
+    :return: description, empty if nothing is recorded
+    :rtype: str
+    """
+    if not metadata:
+        return ""
+    parts = [metadata["camera"], metadata["lens"]]
+    if metadata["iso"]:
+        parts.append(f"ISO {metadata['iso']}")
+    shutter = metadata["shutter"]
+    if shutter:
+        parts.append(f"1/{round(1 / shutter)}s" if shutter < 1 else f"{shutter:g}s")
+    return ", ".join(part for part in parts if part)
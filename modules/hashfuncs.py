@@ -0,0 +1,283 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module finds near-duplicate photos, such as the frames of a burst. Each image gets a difference hash and a
+# perceptual (DCT) hash from a tiny decode, and a multi-index hash table finds the images within a few bits of each other
+# without comparing every pair, so large folders group quickly.
+
+import time
+import cv2
+import numpy as np
+
+from modules.poolfuncs import CachedPool
+
+# Hashes are computed from a 1/8 decode, detail finer than that does not change them. Every image is hashed
+# from the same decode: embedded thumbnails are often cropped or letterboxed, so their hashes would not match
+HASH_DECODE_FLAG = cv2.IMREAD_REDUCED_GRAYSCALE_8
+
+# Images whose difference hashes differ in at most DHASH_RADIUS of 64 bits are candidates, and are grouped
+# when their perceptual hashes are also within PHASH_RADIUS
+DHASH_RADIUS = 7
+PHASH_RADIUS = 10
+
+# Blocks the difference hash is split into for the multi-index search. With 4 blocks of 16 bits a radius of up to 7
+# only needs the exact block and its 16 one-bit variants looked up
+HASH_BLOCKS = 4
+
+
+def _pack_bits(bits):
+    """
+    Packs a boolean array into an integer, first element in the highest bit
+    """
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(image):
+    """
+    Computes the 64-bit difference hash of an image, one bit per horizontal brightness step on a 9x8 thumbnail
+
+    :param image: grayscale image
+    :type image: numpy.ndarray
+
+    :return: hash
+    :rtype: int
+    """
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    return _pack_bits(small[:, 1:] > small[:, :-1])
+
+
+def phash(image):
+    """
+    Computes the 64-bit perceptual hash of an image from the lowest frequencies of the DCT of a 32x32 thumbnail
+
+    :param image: grayscale image
+    :type image: numpy.ndarray
+
+    :return: hash
+    :rtype: int
+    """
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:8, :8]
+    # The DC term is the average brightness, leave it out of the median
+    median = np.median(low.ravel()[1:])
+    return _pack_bits(low > median)
+
+
+def compute_hashes(image_path):
+    """
+    Hashes an image from a 1/8 decode
+
+    :param image_path: path to the image file
+    :type image_path: str
+
+    :return: difference hash and perceptual hash
+    :rtype: tuple
+    """
+    image = cv2.imread(image_path, HASH_DECODE_FLAG)
+    if image is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    return dhash(image), phash(image)
+
+
+def hamming(a, b):
+    """
+    Number of bits that differ between two hashes
+    """
+    return (a ^ b).bit_count()
+
+
+def _hash_one(index, image_path):
+    """
+    Worker task for HashIndexer
+
+    :param index: position of the image in the caller's list
+    :type index: int
+    :param image_path: path to the image file
+    :type image_path: str
+    """
+    start = time.perf_counter()
+    try:
+        result = compute_hashes(image_path)
+    except Exception as e:
+        print(f"Error hashing {image_path}: {e}")
+        result = None
+    return index, result, time.perf_counter() - start
+
+
+class HashIndexer:
+    def __init__(self, workers=None, use_processes=True):
+        """
+        Initialize the HashIndexer class. Hashes images on a worker pool, reading and writing
+        the hashes table of the score cache
+
+        :param workers: Number of workers in the pool (defaults to the number of cores)
+        :type workers: int | None
+        :param use_processes: Use a process pool, falling back to threads if processes are unavailable
+        :type use_processes: bool
+        """
+        self.pool = CachedPool(_hash_one, workers, use_processes)
+        # index -> seconds, for the last call to hash_all
+        self.timings = self.pool.timings
+
+    def hash_all(self, image_paths, cache=None):
+        """
+        Hashes images and returns the hashes in the same order as the paths
+
+        :param image_paths: Paths of the images to hash
+        :type image_paths: Iterable
+        :param cache: Score cache, only new or modified images are hashed when provided
+        :type cache: ScoreCache | None
+
+        :return: List of (dhash, phash) tuples, None for images that could not be read
+        :rtype: list
+        """
+        if cache is None:
+            return self.pool.run_all(image_paths)
+        return self.pool.run_all(
+            image_paths, lookup=cache.lookup_hashes, store=cache.store_hashes
+        )
+
+
+class MultiIndexHash:
+    def __init__(self, radius, blocks=HASH_BLOCKS):
+        """
+        Initialize the MultiIndexHash class. Each 64-bit hash is split into blocks, and each block is indexed
+        in its own dictionary. If two hashes are within radius bits, at least one block differs in no more than
+        radius // blocks bits (pigeonhole), so a search only looks up those few block variants instead of
+        comparing against every stored hash
+
+        :param radius: largest Hamming distance searched for
+        :type radius: int
+        :param blocks: number of blocks the hash is split into
+        :type blocks: int
+        """
+        self.radius = radius
+        self.width = 64 // blocks
+        self.tables = [{} for _ in range(blocks)]
+        self.hashes = []  # (hash, item) in insertion order
+
+        # XOR masks of every block value within radius // blocks bits
+        self.variants = [0]
+        for _ in range(radius // blocks):
+            self.variants = sorted(
+                {
+                    mask | (1 << bit)
+                    for mask in self.variants
+                    for bit in range(self.width)
+                }
+                | set(self.variants)
+            )
+
+    def _blocks(self, value):
+        mask = (1 << self.width) - 1
+        return [
+            (value >> (block * self.width)) & mask for block in range(len(self.tables))
+        ]
+
+    def add(self, value, item):
+        """
+        Adds a hash to the index
+
+        :param value: hash
+        :type value: int
+        :param item: what the search returns for this hash, such as an image index
+        :type item: object
+        """
+        position = len(self.hashes)
+        self.hashes.append((value, item))
+        for table, key in zip(self.tables, self._blocks(value)):
+            table.setdefault(key, []).append(position)
+
+    def search(self, value):
+        """
+        Finds every item whose hash is within radius bits of value
+
+        :param value: hash to search around
+        :type value: int
+
+        :return: (distance, item) pairs
+        :rtype: list
+        """
+        candidates = set()
+        for table, key in zip(self.tables, self._blocks(value)):
+            for mask in self.variants:
+                candidates.update(table.get(key ^ mask, ()))
+
+        found = []
+        for position in candidates:
+            stored, item = self.hashes[position]
+            distance = hamming(value, stored)
+            if distance <= self.radius:
+                found.append((distance, item))
+        return found
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+def find_groups(hashes, dhash_radius=DHASH_RADIUS, phash_radius=PHASH_RADIUS):
+    """
+    Groups near-duplicate images. Candidates come from a multi-index search on the difference hash and are
+    confirmed with the perceptual hash, then linked transitively so a whole burst ends up in one group
+
+    :param hashes: (dhash, phash) per image, None for images that could not be hashed
+    :type hashes: list
+    :param dhash_radius: maximum difference hash distance of a candidate pair
+    :type dhash_radius: int
+    :param phash_radius: maximum perceptual hash distance of a confirmed pair
+    :type phash_radius: int
+
+    :return: groups of two or more image indexes, each sorted, ordered by their first index
+    :rtype: list
+    """
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    index_table = MultiIndexHash(dhash_radius)
+    for index, image_hashes in enumerate(hashes):
+        if image_hashes is None:
+            continue
+        # Searching before adding visits every pair once
+        for _, other in index_table.search(image_hashes[0]):
+            if hamming(image_hashes[1], hashes[other][1]) <= phash_radius:
+                parent[find(index)] = find(other)
+        index_table.add(image_hashes[0], index)
+
+    groups = {}
+    for index, image_hashes in enumerate(hashes):
+        if image_hashes is not None:
+            groups.setdefault(find(index), []).append(index)
+    return sorted(
+        (members for members in groups.values() if len(members) > 1),
+        key=lambda members: members[0],
+    )
+
+
+def sharpest_in_groups(groups, blurValues):
+    """
+    Decides which frame of each group to keep
+
+    :param groups: groups from find_groups
+    :type groups: list
+    :param blurValues: blur value per image (a list, or a dictionary keyed by index), None for images that could not be scored
+    :type blurValues: list | dict
+
+    :return: Dictionary of image index to "Keep" for the sharpest frame of each group, "Discard" for the rest
+    :rtype: dict
+    """
+    decisions = {}
+    for members in groups:
+        scored = [index for index in members if blurValues[index] is not None]
+        if not scored:
+            continue
+        best = max(scored, key=lambda index: blurValues[index])
+        for index in scored:
+            decisions[index] = "Keep" if index == best else "Discard"
+    return decisions
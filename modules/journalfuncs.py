@@ -0,0 +1,198 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module records the decisions of a manual sort as they are made, in a journal file inside the sorted
+# folder, so a crash or a closed window does not lose them. Reopening the folder replays the journal to restore the
+# decisions and the image the user was on, and the journal is rewritten with only the latest entries once it grows.
+
+import os
+import json
+import time
+
+# Journal written inside the folder being sorted
+JOURNAL_FILENAME = ".photogenie_journal.jsonl"
+
+# Entry recording the image being viewed rather than a decision
+POSITION = "@"
+
+# Entries are flushed to the operating system as they are written, and forced to disk every FSYNC_BATCH entries
+# or FSYNC_SECONDS, whichever comes first. An entry only checks the time when it is written, so the Manual Sort tab
+# also calls sync every FSYNC_SECONDS
+FSYNC_BATCH = 32
+FSYNC_SECONDS = 2.0
+
+# The journal is compacted once it has this many entries and at least twice as many as it would after compacting
+COMPACT_MIN = 1000
+
+
+class SortJournal:
+    def __init__(self, folder_path):
+        """
+        Initialize the SortJournal class. Each entry is one JSON line of [decision, path relative to the folder],
+        so a line cut short by a crash only loses that entry
+
+        :param folder_path: folder being sorted
+        :type folder_path: str
+        """
+        self.folder_path = folder_path
+        self.path = os.path.join(folder_path, JOURNAL_FILENAME)
+        self.decisions = {}  # relative path -> latest decision
+        self.position = None  # relative path of the image last viewed
+        self.entries = 0  # lines in the journal file
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.file = None
+
+    def replay(self):
+        """
+        Reads the journal left by an earlier session, compacting it if it grew large, and opens it for appending
+
+        :return: image path -> decision, and the path of the image last viewed (None if there is no journal)
+        :rtype: tuple
+        """
+        self.decisions = {}
+        self.position = None
+        self.entries = 0
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            data = b""
+
+        lines = data.split(b"\n")
+        if lines[-1]:
+            # The last entry was cut short by a crash. Drop it so the next entry starts on its own line
+            with open(self.path, "r+b") as file:
+                file.truncate(len(data) - len(lines[-1]))
+        for line in lines[:-1]:
+            try:
+                decision, relative_path = json.loads(line)
+            except (ValueError, TypeError):
+                continue
+            self.entries += 1
+            if decision == POSITION:
+                self.position = relative_path
+            else:
+                self.decisions[relative_path] = decision
+
+        if self._needs_compaction():
+            self.compact()
+        else:
+            self.file = open(self.path, "a", encoding="utf-8")
+
+        decisions = {
+            self._absolute(relative_path): decision
+            for relative_path, decision in self.decisions.items()
+        }
+        position = self._absolute(self.position) if self.position else None
+        return decisions, position
+
+    def _absolute(self, relative_path):
+        return os.path.join(self.folder_path, relative_path)
+
+    def _relative(self, image_path):
+        return os.path.relpath(image_path, self.folder_path)
+
+    def _needs_compaction(self):
+        live = len(self.decisions) + (self.position is not None)
+        return self.entries >= COMPACT_MIN and self.entries >= 2 * live
+
+    def _append(self, decision, image_path):
+        """
+        Writes one entry, syncing to disk once enough entries or time have gone by
+        """
+        if self.file is None:
+            return
+        self.file.write(
+            json.dumps([decision, self._relative(image_path)], separators=(",", ":"))
+            + "\n"
+        )
+        self.file.flush()
+        self.entries += 1
+        self.unsynced += 1
+        if (
+            self.unsynced >= FSYNC_BATCH
+            or time.monotonic() - self.last_sync >= FSYNC_SECONDS
+        ):
+            self.sync()
+        if self._needs_compaction():
+            self.compact()
+
+    def record(self, image_path, decision):
+        """
+        Records a decision
+
+        :param image_path: path to the image
+        :type image_path: str
+        :param decision: "Keep", "Discard" or "Maybe"
+        :type decision: str
+        """
+        self.decisions[self._relative(image_path)] = decision
+        self._append(decision, image_path)
+
+    def record_position(self, image_path):
+        """
+        Records the image being viewed, so a resumed session opens on it
+
+        :param image_path: path to the image
+        :type image_path: str
+        """
+        relative_path = self._relative(image_path)
+        if relative_path == self.position:
+            return
+        self.position = relative_path
+        self._append(POSITION, image_path)
+
+    def sync(self):
+        """
+        Forces the entries written so far to disk
+        """
+        if self.file is None or not self.unsynced:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def compact(self):
+        """
+        Rewrites the journal with only the latest decision of each image and the last position. The new journal
+        is written next to the old one and renamed over it, so a crash leaves one or the other
+        """
+        if self.file is not None:
+            self.file.close()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            for relative_path, decision in self.decisions.items():
+                file.write(
+                    json.dumps([decision, relative_path], separators=(",", ":")) + "\n"
+                )
+            if self.position is not None:
+                file.write(
+                    json.dumps([POSITION, self.position], separators=(",", ":")) + "\n"
+                )
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        self.entries = len(self.decisions) + (self.position is not None)
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def clear(self):
+        """
+        Empties the journal, such as once the sorted images were transferred
+        """
+        self.close()
+        self.decisions = {}
+        self.position = None
+        self.entries = 0
+        self.file = open(self.path, "w", encoding="utf-8")
+
+    def close(self):
+        """
+        Syncs and closes the journal file
+        """
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
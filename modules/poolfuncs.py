@@ -0,0 +1,184 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module runs a per-image task on a pool of workers, skipping images whose result is already in the
+# score cache. Blur scoring, burst hashing, quality analysis and metadata indexing are all run through it.
+
+import os
+import cv2
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+# Paths looked up in the cache and queued on the pool at a time
+POOL_CHUNK = 64
+
+
+def _init_worker():
+    """
+    Keeps each worker on one OpenCV thread so the pool does not oversubscribe the cores
+    """
+    cv2.setNumThreads(1)
+
+
+def _chunks(items, size):
+    """
+    Splits any iterable into lists of at most size items
+
+    :param items: items to split
+    :type items: Iterable
+    :param size: items per chunk
+    :type size: int
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class CachedPool:
+    def __init__(self, task, workers=None, use_processes=True):
+        """
+        Initialize the CachedPool class.
+
+        :param task: worker task, called as task(index, image_path, *args) and returning (index, value, seconds).
+        It must be a module level function to run on a process pool
+        :type task: Callable
+        :param workers: Number of workers in the pool (defaults to the number of cores)
+        :type workers: int | None
+        :param use_processes: Use a process pool, falling back to threads if processes are unavailable
+        :type use_processes: bool
+        """
+        self.task = task
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self.timings = {}  # index -> seconds, for the last call to run
+
+    def _make_executor(self):
+        """
+        Creates the worker pool. Falls back to a thread pool when processes cannot be started
+        """
+        if self.use_processes:
+            try:
+                return ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_worker
+                )
+            except (OSError, NotImplementedError, ValueError) as e:
+                print(f"Process pool unavailable, using threads: {e}")
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    def run(self, image_paths, args=(), lookup=None, store=None, unpack=None):
+        """
+        Runs the task on images, yielding results in completion order. image_paths can be a list or a generator
+        such as scan_images, in which case work starts on the first file while the folder is still being read
+
+        :param image_paths: Paths of the images
+        :type image_paths: Iterable
+        :param args: arguments passed to the task after the index and path
+        :type args: tuple
+        :param lookup: takes a list of paths and returns a dictionary of position to cached value and the positions
+        that must be computed, None to compute every image
+        :type lookup: Callable | None
+        :param store: takes the (image path, value) pairs that were computed, also when the run stops early
+        :type store: Callable | None
+        :param unpack: turns a task result and its path into (index, value, seconds), in the calling process
+        :type unpack: Callable | None
+
+        :return: Generator of (index, value) tuples, index being the position of the path in image_paths.
+        Seconds spent on each computed (not cached) image are kept in self.timings
+        :rtype: Generator
+        """
+        task = self.task
+
+        # No pool needed for one worker, skip the process start up cost
+        executor = self._make_executor() if self.workers > 1 else None
+        pending = {}  # future -> (index, path)
+        computed = []
+        # Cleared rather than replaced, callers may hold on to the dictionary
+        self.timings.clear()
+
+        def record(result, image_path):
+            index, value, seconds = unpack(result, image_path) if unpack else result
+            self.timings[index] = seconds
+            computed.append((image_path, value))
+            return index, value
+
+        def submit(index, image_path):
+            nonlocal executor
+            try:
+                future = executor.submit(task, index, image_path, *args)
+            except BrokenProcessPool as e:
+                # A worker died, finish on threads and resubmit every image the broken pool has not returned
+                print(f"Worker pool failed, using threads: {e}")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ThreadPoolExecutor(max_workers=self.workers)
+                for future, item in list(pending.items()):
+                    if (
+                        future.done()
+                        and not future.cancelled()
+                        and future.exception() is None
+                    ):
+                        continue
+                    del pending[future]
+                    pending[executor.submit(task, *item, *args)] = item
+                future = executor.submit(task, index, image_path, *args)
+            pending[future] = (index, image_path)
+
+        def collect(future):
+            index, image_path = pending.pop(future)
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                # A worker died, run this image in the current process instead
+                print(f"Worker pool failed: {e}")
+                result = task(index, image_path, *args)
+            return record(result, image_path)
+
+        try:
+            chunk_start = 0
+            for chunk in _chunks(image_paths, POOL_CHUNK):
+                if lookup:
+                    hits, missing = lookup(chunk)
+                else:
+                    hits, missing = {}, range(len(chunk))
+                for position, value in hits.items():
+                    yield chunk_start + position, value
+
+                for position in missing:
+                    index = chunk_start + position
+                    if executor is None:
+                        result = task(index, chunk[position], *args)
+                        yield record(result, chunk[position])
+                    else:
+                        submit(index, chunk[position])
+                chunk_start += len(chunk)
+
+                # Hand back whatever finished while this chunk was read
+                for future in [future for future in pending if future.done()]:
+                    yield collect(future)
+
+            for future in as_completed(list(pending)):
+                yield collect(future)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            # Stored even when the run is cancelled or fails, so finished images are not computed again
+            if store:
+                store(computed)
+
+    def run_all(self, image_paths, args=(), lookup=None, store=None, unpack=None):
+        """
+        Runs the task on images and returns the values in the same order as the paths
+
+        :param image_paths: Paths of the images
+        :type image_paths: Iterable
+
+        :return: List of values
+        :rtype: list
+        """
+        values = {}
+        for index, value in self.run(image_paths, args, lookup, store, unpack):
+            values[index] = value
+        return [values[index] for index in range(len(values))]
@@ -0,0 +1,284 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module keeps the images around the one being viewed decoded and resized ahead of time, so stepping
+# through a folder does not wait on a full decode. Display-ready images are held in an LRU cache with a memory budget,
+# and the images next to the current one are decoded on background threads.
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+# Memory the display cache may hold, in bytes. A 600x400 RGB image is about 0.7 MB
+CACHE_BUDGET = 256 * 1024 * 1024
+
+# Images decoded ahead on each side of the current one
+PREFETCH_RADIUS = 3
+
+# Background decoders. Pillow releases the GIL while decoding and resizing, so threads run in parallel
+PREFETCH_WORKERS = 2
+
+
+def image_bytes(image):
+    """
+    Memory held by a decoded image
+
+    :param image: decoded image
+    :type image: PIL.Image.Image
+
+    :return: size in bytes
+    :rtype: int
+    """
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+
+class BitmapCache:
+    def __init__(self, budget=CACHE_BUDGET):
+        """
+        Initialize the BitmapCache class. A least recently used cache of decoded images that evicts the oldest
+        images once the total size goes over the budget
+
+        :param budget: most memory the cached images may hold, in bytes
+        :type budget: int
+        """
+        self.budget = budget
+        self.images = OrderedDict()  # key -> image, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, count=True):
+        """
+        Returns a cached image and marks it as recently used
+
+        :param key: cache key, such as the image path
+        :type key: Hashable
+        :param count: count the lookup towards the hit rate
+        :type count: bool
+
+        :return: the image, or None if it is not cached
+        :rtype: PIL.Image.Image | None
+        """
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+            if count:
+                if image is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return image
+
+    def put(self, key, image):
+        """
+        Adds an image, evicting the least recently used ones to stay within the budget. An image larger
+        than the whole budget is not cached
+
+        :param key: cache key, such as the image path
+        :type key: Hashable
+        :param image: decoded image
+        :type image: PIL.Image.Image
+        """
+        size = image_bytes(image)
+        with self.lock:
+            old = self.images.pop(key, None)
+            if old is not None:
+                self.size -= image_bytes(old)
+            if size > self.budget:
+                return
+            self.images[key] = image
+            self.size += size
+            while self.size > self.budget:
+                _, evicted = self.images.popitem(last=False)
+                self.size -= image_bytes(evicted)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.images
+
+    def __len__(self):
+        return len(self.images)
+
+    def clear(self):
+        """
+        Empties the cache and resets the hit rate
+        """
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def hit_rate(self):
+        """
+        Fraction of lookups that found their image
+
+        :rtype: float
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        """
+        Formats the hit rate and memory use as one line of text
+
+        :return: Report text
+        :rtype: str
+        """
+        return (
+            f"Display cache: {self.hits}/{self.hits + self.misses} hits ({self.hit_rate():.0%}), "
+            f"{len(self.images)} images, {self.size / (1024 * 1024):.0f} MB"
+        )
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        loader,
+        budget=CACHE_BUDGET,
+        radius=PREFETCH_RADIUS,
+        workers=PREFETCH_WORKERS,
+    ):
+        """
+        Initialize the Prefetcher class. Decodes the images around the current one on background threads
+        into a BitmapCache, so get() usually returns straight from memory
+
+        :param loader: function that takes an image path and returns the display-ready image
+        :type loader: Callable
+        :param budget: memory the cache may hold, in bytes
+        :type budget: int
+        :param radius: images decoded ahead on each side of the current one
+        :type radius: int
+        :param workers: background decoding threads
+        :type workers: int
+        """
+        self.loader = loader
+        self.radius = radius
+        self.cache = BitmapCache(budget)
+        self.pending = {}  # image path -> Future of a decode that has not finished
+        self.failed = set()  # image paths the background decode could not read
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prefetch"
+        )
+
+    def _load(self, image_path):
+        """
+        Worker task, decodes one image into the cache
+        """
+        try:
+            image = self.loader(image_path)
+            self.cache.put(image_path, image)
+            return image
+        except Exception:
+            self.failed.add(image_path)
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(image_path, None)
+
+    def get(self, image_path):
+        """
+        Returns the display-ready image, from the cache, from a decode already running, or by decoding it now
+
+        :param image_path: path to the image file
+        :type image_path: str
+
+        :return: display-ready image
+        :rtype: PIL.Image.Image
+        """
+        image = self.cache.get(image_path)
+        if image is not None:
+            return image
+
+        # A running decode finishes sooner than a new one, a queued one is cancelled and done here
+        with self.lock:
+            future = self.pending.get(image_path)
+            if future is not None and future.cancel():
+                del self.pending[image_path]
+                future = None
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:
+                pass
+            except Exception as e:
+                print(f"Error prefetching {image_path}: {e}")
+        image = self.loader(image_path)
+        self.cache.put(image_path, image)
+        return image
+
+    def window(self, image_paths, index):
+        """
+        Paths of the images around index, nearest first and the next image before the previous one.
+        Wraps around the ends like the navigation buttons
+
+        :param image_paths: images in display order
+        :type image_paths: list
+        :param index: index of the current image
+        :type index: int
+
+        :return: image paths to have decoded
+        :rtype: list
+        """
+        count = len(image_paths)
+        paths = []
+        for distance in range(1, self.radius + 1):
+            for step in (distance, -distance):
+                path = image_paths[(index + step) % count]
+                # Small folders wrap back onto the same images
+                if path != image_paths[index] and path not in paths:
+                    paths.append(path)
+        return paths
+
+    def prefetch(self, image_paths, index):
+        """
+        Starts decoding the images around index that are not cached yet, and cancels queued decodes of
+        images that are no longer near it
+
+        :param image_paths: images in display order
+        :type image_paths: list
+        :param index: index of the current image
+        :type index: int
+        """
+        if not image_paths:
+            return
+        self.request(self.window(image_paths, index))
+
+    def request(self, wanted):
+        """
+        Starts decoding the wanted images that are not cached yet, in order, and cancels queued decodes of
+        any other images
+
+        :param wanted: paths of the images to have decoded
+        :type wanted: list
+        """
+        wanted_set = set(wanted)
+        with self.lock:
+            for path, future in list(self.pending.items()):
+                if path not in wanted_set and future.cancel():
+                    del self.pending[path]
+            for path in wanted:
+                if path in self.pending or path in self.failed or path in self.cache:
+                    continue
+                self.pending[path] = self.executor.submit(self._load, path)
+
+    def clear(self):
+        """
+        Cancels queued decodes and empties the cache, such as when another folder is selected
+        """
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.failed.clear()
+        self.cache.clear()
+
+    def close(self):
+        """
+        Stops the background threads
+        """
+        self.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
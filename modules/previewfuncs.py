@@ -0,0 +1,398 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module loads small versions of photos for thumbnails and previews. Camera JPEGs
+# usually carry an EXIF thumbnail (about 160x120) and often a larger preview in an MPF segment, so when one of them is
+# big enough it is read straight out of the file header instead of decoding the full image.
+
+import io
+import os
+import time
+import struct
+import threading
+from PIL import Image
+
+from modules.exiffuncs import (
+    EXIF_PREFIX,
+    TAG_ORIENTATION,
+    TAG_THUMBNAIL_LENGTH,
+    TAG_THUMBNAIL_OFFSET,
+    parse_exif,
+)
+
+# JPEG start-of-frame markers, which hold the image size
+SOF_MARKERS = {
+    0xC0,
+    0xC1,
+    0xC2,
+    0xC3,
+    0xC5,
+    0xC6,
+    0xC7,
+    0xC9,
+    0xCA,
+    0xCB,
+    0xCD,
+    0xCE,
+    0xCF,
+}
+
+# MPF index tag listing the images stored in the file
+TAG_MP_ENTRY = 0xB002
+
+# Bytes read from the start of an embedded preview to find its size
+PREVIEW_HEADER = 64 * 1024
+
+# Display decodes stop scaling down at this many times the final size, and a high-quality filter does the rest
+DISPLAY_REDUCING_GAP = 2
+
+# Transposes that undo each EXIF orientation
+ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class PreviewStats:
+    def __init__(self):
+        """
+        Initialize the PreviewStats class. Counts, per folder, how many loads were served by an embedded preview
+        and how long embedded and full decodes took, to estimate the time saved
+        """
+        self.lock = threading.Lock()
+        # folder -> [hits, misses, embedded seconds, full decode seconds]
+        self.folders = {}
+
+    def record(self, image_path, embedded, seconds):
+        """
+        Records one load
+
+        :param image_path: path of the loaded image
+        :type image_path: str
+        :param embedded: True if an embedded preview was used
+        :type embedded: bool
+        :param seconds: time the load took
+        :type seconds: float
+        """
+        folder = os.path.normpath(os.path.dirname(image_path))
+        with self.lock:
+            counts = self.folders.setdefault(folder, [0, 0, 0.0, 0.0])
+            if embedded:
+                counts[0] += 1
+                counts[2] += seconds
+            else:
+                counts[1] += 1
+                counts[3] += seconds
+
+    def summary(self, folder):
+        """
+        Hit rate and time saved for one folder and its subfolders. Time saved is estimated from the average full decode
+
+        :param folder: folder of the loaded images
+        :type folder: str
+
+        :return: hits, misses, hit rate and seconds saved (None until a full decode was timed)
+        :rtype: dict
+        """
+        folder = os.path.normpath(folder)
+        hits, misses, embedded_time, full_time = 0, 0, 0.0, 0.0
+        with self.lock:
+            for name, counts in self.folders.items():
+                if name == folder or name.startswith(folder + os.sep):
+                    hits += counts[0]
+                    misses += counts[1]
+                    embedded_time += counts[2]
+                    full_time += counts[3]
+        loads = hits + misses
+        saved = None
+        if misses:
+            saved = hits * (full_time / misses) - embedded_time
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / loads if loads else 0.0,
+            "seconds_saved": saved,
+        }
+
+    def report(self, folder):
+        """
+        Formats the summary of one folder as one line of text
+
+        :param folder: folder of the loaded images
+        :type folder: str
+
+        :return: Report text
+        :rtype: str
+        """
+        summary = self.summary(folder)
+        text = (
+            f"Embedded previews: {summary['hits']}/{summary['hits'] + summary['misses']} "
+            f"loads ({summary['hit_rate']:.0%})"
+        )
+        if summary["seconds_saved"] is not None:
+            text += f", about {summary['seconds_saved']:.1f}s saved"
+        return text
+
+
+# Shared by every tab, so the report covers all loads from a folder
+preview_stats = PreviewStats()
+
+
+def _jpeg_size(data):
+    """
+    Reads the size of a JPEG from its start-of-frame marker
+
+    :param data: the start of the JPEG
+    :type data: bytes
+
+    :return: width and height, or None if no frame header is found in data
+    :rtype: tuple | None
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    position = 2
+    while position + 9 <= len(data):
+        marker, length = struct.unpack_from(">2sH", data, position)
+        if marker[0] != 0xFF or marker[1] == 0xDA:
+            return None
+        if marker[1] in SOF_MARKERS:
+            height, width = struct.unpack_from(">HH", data, position + 5)
+            return width, height
+        position += 2 + length
+    return None
+
+
+def _mpf_previews(segment, segment_offset):
+    """
+    Lists the extra images of a Multi-Picture Format segment
+
+    :param segment: APP2 segment data after the "MPF\\0" signature
+    :type segment: bytes
+    :param segment_offset: file offset of that data, which MPF offsets are relative to
+    :type segment_offset: int
+
+    :return: (file offset, length) of each image other than the primary one
+    :rtype: list
+    """
+    if len(segment) < 8 or segment[:2] not in (b"II", b"MM"):
+        return []
+    endian = "<" if segment[:2] == b"II" else ">"
+    (ifd_offset,) = struct.unpack_from(endian + "I", segment, 4)
+    if ifd_offset + 2 > len(segment):
+        return []
+    (count,) = struct.unpack_from(endian + "H", segment, ifd_offset)
+
+    previews = []
+    for i in range(count):
+        start = ifd_offset + 2 + i * 12
+        if start + 12 > len(segment):
+            break
+        tag, _, num, value_offset = struct.unpack_from(endian + "HHII", segment, start)
+        if tag != TAG_MP_ENTRY:
+            continue
+        # 16 bytes per entry: attributes, size, offset, two dependent image entries
+        for entry in range(num // 16):
+            entry_start = value_offset + entry * 16
+            if entry_start + 16 > len(segment):
+                break
+            _, size, offset = struct.unpack_from(endian + "III", segment, entry_start)
+            if offset:  # the primary image has offset 0
+                previews.append((segment_offset + offset, size))
+    return previews
+
+
+def read_header(image_path):
+    """
+    Reads the header segments of a JPEG and lists its embedded previews, without decoding anything
+
+    :param image_path: path to the image file
+    :type image_path: str
+
+    :return: size of the image (or None), EXIF orientation (or None), and (width, height, file offset, length)
+    of each embedded preview, smallest first
+    :rtype: tuple
+    """
+    size = None
+    orientation = None
+    candidates = []  # (file offset, length)
+    previews = []
+    with open(image_path, "rb") as file:
+        if file.read(2) != b"\xff\xd8":
+            return None, None, []
+
+        position = 2
+        while position < EXIF_PREFIX:
+            file.seek(position)
+            header = file.read(4)
+            if len(header) < 4:
+                break
+            marker, length = struct.unpack(">2sH", header)
+            if marker[0] != 0xFF or marker[1] in (0xDA, 0xD9):
+                break
+            if marker[1] in SOF_MARKERS:
+                height, width = struct.unpack(">xHH", file.read(5))
+                size = (width, height)
+            elif marker[1] == 0xE1:
+                segment = file.read(length - 2)
+                if segment.startswith(b"Exif\x00\x00"):
+                    tags, ifd1 = parse_exif(segment[6:])
+                    orientation = tags.get(TAG_ORIENTATION)
+                    offset = ifd1.get(TAG_THUMBNAIL_OFFSET)
+                    thumb_length = ifd1.get(TAG_THUMBNAIL_LENGTH)
+                    if isinstance(offset, int) and isinstance(thumb_length, int):
+                        candidates.append((position + 10 + offset, thumb_length))
+            elif marker[1] == 0xE2:
+                segment = file.read(length - 2)
+                if segment.startswith(b"MPF\x00"):
+                    candidates.extend(_mpf_previews(segment[4:], position + 8))
+            position += 2 + length
+
+        for offset, length in candidates:
+            file.seek(offset)
+            preview_size = _jpeg_size(file.read(min(length, PREVIEW_HEADER)))
+            if preview_size:
+                previews.append((*preview_size, offset, length))
+
+    previews.sort(key=lambda preview: preview[0] * preview[1])
+    return size, orientation, previews
+
+
+def _orient(image, orientation):
+    """
+    Applies an EXIF orientation to an image decoded without it
+    """
+    transpose = ORIENTATION_TRANSPOSES.get(orientation)
+    return image.transpose(transpose) if transpose is not None else image
+
+
+def _open_preview(image_path, offset, length):
+    """
+    Opens an embedded preview from its place in the file
+
+    :param image_path: path to the image file
+    :type image_path: str
+    :param offset: file offset of the preview
+    :type offset: int
+    :param length: length of the preview in bytes
+    :type length: int
+
+    :return: the preview, not decoded yet, or None if it cannot be opened
+    :rtype: PIL.Image.Image | None
+    """
+    with open(image_path, "rb") as file:
+        file.seek(offset)
+        data = file.read(length)
+    try:
+        return Image.open(io.BytesIO(data))
+    except Exception:
+        return None
+
+
+def fit_size(image_size, box, upscale=True):
+    """
+    Size of an image scaled to fit in a box, keeping its aspect ratio
+
+    :param image_size: (width, height) of the image
+    :type image_size: tuple
+    :param box: (width, height) of the box
+    :type box: tuple
+    :param upscale: scale small images up to the box, otherwise they keep their size
+    :type upscale: bool
+
+    :return: (width, height) of the fitted image
+    :rtype: tuple
+    """
+    image_width, image_height = image_size
+    box_width, box_height = box
+    if not upscale and image_width <= box_width and image_height <= box_height:
+        return image_size
+    if (image_width / image_height) > (box_width / box_height):
+        return box_width, max(1, int(box_width / (image_width / image_height)))
+    return max(1, int(box_height * (image_width / image_height))), box_height
+
+
+def decode_display(image, size, orientation=None, upscale=True):
+    """
+    Decodes an image for display at a given size. JPEGs are decoded at a reduced DCT scale (1/2, 1/4 or 1/8)
+    and other formats are shrunk by a fast integer reduce, both stopping at DISPLAY_REDUCING_GAP times the
+    final size, so only the last step is resampled with LANCZOS. The image is oriented for display
+
+    :param image: path or file object of the image, or an image opened but not loaded yet
+    :type image: str | BinaryIO | PIL.Image.Image
+    :param size: (width, height) box the image has to fit
+    :type size: tuple
+    :param orientation: EXIF orientation, read from the image when None
+    :type orientation: int | None
+    :param upscale: scale small images up to the box
+    :type upscale: bool
+
+    :return: the image, fitted to size
+    :rtype: PIL.Image.Image
+    """
+    if not isinstance(image, Image.Image):
+        # Close the file once decoded, the result is a loaded copy
+        with Image.open(image) as opened:
+            return decode_display(opened, size, orientation, upscale)
+    if orientation is None:
+        orientation = image.getexif().get(TAG_ORIENTATION)
+
+    # Fit the stored (unrotated) image in the box as it will be rotated
+    box = (size[1], size[0]) if orientation in (5, 6, 7, 8) else size
+    target = fit_size(image.size, box, upscale)
+
+    reduced = (target[0] * DISPLAY_REDUCING_GAP, target[1] * DISPLAY_REDUCING_GAP)
+    image.draft("RGB", reduced)
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+    factor = min(image.width // reduced[0], image.height // reduced[1])
+    if factor > 1:
+        image = image.reduce(factor)
+
+    if image.size != target:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+    else:
+        image.load()
+    return _orient(image, orientation)
+
+
+def load_preview(image_path, size):
+    """
+    Loads an image to fit in size, oriented for display. Uses an embedded preview when one is large enough,
+    otherwise decodes the file (at a reduced JPEG scale where possible)
+
+    :param image_path: path to the image file
+    :type image_path: str
+    :param size: (width, height) box the image has to fit
+    :type size: tuple
+
+    :return: the image, at most size
+    :rtype: PIL.Image.Image
+    """
+    start = time.perf_counter()
+    box_width, box_height = size
+    image = None
+    try:
+        _, orientation, previews = read_header(image_path)
+    except (OSError, struct.error):
+        orientation, previews = None, []
+
+    # A preview is large enough when fitting it in the box needs no upscaling
+    swapped = orientation in (5, 6, 7, 8)
+    for width, height, offset, length in previews:
+        if swapped:
+            width, height = height, width
+        if width >= box_width or height >= box_height:
+            preview = _open_preview(image_path, offset, length)
+            if preview is not None:
+                image = decode_display(preview, size, orientation or 1, upscale=False)
+                break
+
+    embedded = image is not None
+    if not embedded:
+        image = decode_display(image_path, size, upscale=False)
+    preview_stats.record(image_path, embedded, time.perf_counter() - start)
+    return image
@@ -0,0 +1,247 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module cuts a photo into a pyramid of tiles for zooming, each level half the size of the one below it
+# down to a single tile. Levels are built in the background the first time they are needed and stored in the thumbnail
+# cache, so a zoomed view only loads the few tiles it shows, and memory stays bounded however large the photo is.
+
+import io
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from modules.exiffuncs import TAG_ORIENTATION
+from modules.prefetchfuncs import BitmapCache
+from modules.previewfuncs import _orient
+
+# Width and height of a tile
+TILE_SIZE = 256
+
+# Memory the decoded tiles of one pyramid may hold, about 680 tiles
+TILE_BUDGET = 128 * 1024 * 1024
+
+# Levels built at once, shared by every pyramid
+_builder = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pyramid")
+
+
+class ImagePyramid:
+    def __init__(
+        self, source, key, cache=None, tile_size=TILE_SIZE, budget=TILE_BUDGET
+    ):
+        """
+        Initialize the ImagePyramid class. Only the image header is read here, levels are decoded when first asked for
+
+        :param source: path to the image file, or the encoded image
+        :type source: str | bytes
+        :param key: cache key of the image, from path_key or content_key
+        :type key: str
+        :param cache: thumbnail cache the tiles are stored in, tiles are only kept in memory when None
+        :type cache: ThumbnailCache | None
+        :param tile_size: width and height of a tile
+        :type tile_size: int
+        :param budget: memory the decoded tiles may hold, in bytes
+        :type budget: int
+        """
+        self.source = source
+        self.key = key
+        self.cache = cache
+        self.tile_size = tile_size
+        self.tiles = BitmapCache(budget)  # (level, column, row) -> tile
+        self.built = set()  # levels whose tiles were all cut
+        self.building = {}  # level -> Future of its build
+        self.lock = threading.Lock()
+
+        with self._open() as image:
+            self.orientation = image.getexif().get(TAG_ORIENTATION) or 1
+            width, height = image.size
+        if self.orientation in (5, 6, 7, 8):
+            width, height = height, width
+        self.size = (width, height)
+
+        # Halve until the whole image fits in one tile
+        self.levels = 1
+        while max(self.level_size(self.levels - 1)) > tile_size:
+            self.levels += 1
+
+    def _open(self):
+        if isinstance(self.source, bytes):
+            return Image.open(io.BytesIO(self.source))
+        return Image.open(self.source)
+
+    def level_size(self, level):
+        """
+        Size of a level, 0 being full resolution and each level half the size of the one before
+
+        :rtype: tuple
+        """
+        scale = 2**level
+        return math.ceil(self.size[0] / scale), math.ceil(self.size[1] / scale)
+
+    def level_for(self, zoom):
+        """
+        Coarsest level that still has at least one pixel per displayed pixel at a zoom
+
+        :param zoom: displayed pixels per full resolution pixel
+        :type zoom: float
+
+        :rtype: int
+        """
+        if zoom >= 1:
+            return 0
+        return min(int(math.floor(math.log2(1 / zoom))), self.levels - 1)
+
+    def tile_box(self, level, column, row):
+        """
+        Pixels of a level covered by a tile
+
+        :return: left, top, right and bottom
+        :rtype: tuple
+        """
+        width, height = self.level_size(level)
+        left, top = column * self.tile_size, row * self.tile_size
+        return (
+            left,
+            top,
+            min(left + self.tile_size, width),
+            min(top + self.tile_size, height),
+        )
+
+    def visible_tiles(self, level, box):
+        """
+        Tiles of a level overlapping a box
+
+        :param level: pyramid level
+        :type level: int
+        :param box: left, top, right and bottom, in pixels of the level
+        :type box: tuple
+
+        :return: (column, row) of each tile, row by row
+        :rtype: list
+        """
+        width, height = self.level_size(level)
+        first_column = max(0, int(box[0] // self.tile_size))
+        first_row = max(0, int(box[1] // self.tile_size))
+        last_column = min(
+            math.ceil(width / self.tile_size), math.ceil(box[2] / self.tile_size)
+        )
+        last_row = min(
+            math.ceil(height / self.tile_size), math.ceil(box[3] / self.tile_size)
+        )
+        return [
+            (column, row)
+            for row in range(first_row, last_row)
+            for column in range(first_column, last_column)
+        ]
+
+    def decode_level(self, level):
+        """
+        Decodes the whole image at a level's size. JPEGs decode levels 1 to 3 straight from a reduced DCT scale
+
+        :rtype: PIL.Image.Image
+        """
+        width, height = self.level_size(level)
+        if self.orientation in (5, 6, 7, 8):
+            width, height = height, width
+        with self._open() as image:
+            image.draft("RGB", (width, height))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            if image.size != (width, height):
+                image = image.resize(
+                    (width, height), Image.Resampling.LANCZOS, reducing_gap=2.0
+                )
+            else:
+                image.load()
+        return _orient(image, self.orientation)
+
+    def build_level(self, level):
+        """
+        Decodes a level and cuts it into tiles, storing them in memory and in the cache
+
+        :param level: pyramid level
+        :type level: int
+        """
+        image = self.decode_level(level)
+        width, height = self.level_size(level)
+        for row in range(math.ceil(height / self.tile_size)):
+            for column in range(math.ceil(width / self.tile_size)):
+                tile = image.crop(self.tile_box(level, column, row))
+                self.tiles.put((level, column, row), tile)
+                if self.cache:
+                    self.cache.write_tile(self.key, level, column, row, tile)
+        with self.lock:
+            self.built.add(level)
+
+    def _build(self, level):
+        try:
+            self.build_level(level)
+        except Exception as e:
+            print(f"Could not build zoom level {level}: {e}")
+        finally:
+            with self.lock:
+                self.building.pop(level, None)
+
+    def request(self, level):
+        """
+        Starts building a level in the background unless it is built or being built
+
+        :param level: pyramid level
+        :type level: int
+        """
+        with self.lock:
+            if level in self.built or level in self.building:
+                return
+            self.building[level] = _builder.submit(self._build, level)
+
+    def tile(self, level, column, row):
+        """
+        Returns a tile from memory or the cache. A missing tile starts a build of its level
+
+        :return: the tile, or None until its level is built
+        :rtype: PIL.Image.Image | None
+        """
+        key = (level, column, row)
+        tile = self.tiles.get(key, count=False)
+        if tile is None and self.cache:
+            tile = self.cache.read_tile(self.key, level, column, row)
+            if tile is not None:
+                self.tiles.put(key, tile)
+        if tile is None:
+            # Not built yet, or evicted from memory and the cache since
+            with self.lock:
+                self.built.discard(level)
+            self.request(level)
+        return tile
+
+    def fallback(self, level, column, row):
+        """
+        Stand-in for a tile that is not loaded yet, enlarged from the nearest coarser level that is
+
+        :return: an image the size of the tile, or None if no coarser level is loaded either
+        :rtype: PIL.Image.Image | None
+        """
+        left, top, right, bottom = self.tile_box(level, column, row)
+        for coarser in range(level + 1, self.levels):
+            scale = 2 ** (coarser - level)
+            parent_column = left // scale // self.tile_size
+            parent_row = top // scale // self.tile_size
+            key = (coarser, parent_column, parent_row)
+            parent = self.tiles.get(key, count=False)
+            if parent is None and self.cache:
+                parent = self.cache.read_tile(self.key, *key)
+                if parent is not None:
+                    self.tiles.put(key, parent)
+            if parent is None:
+                continue
+            origin_x = parent_column * self.tile_size
+            origin_y = parent_row * self.tile_size
+            region = (
+                left / scale - origin_x,
+                top / scale - origin_y,
+                right / scale - origin_x,
+                bottom / scale - origin_y,
+            )
+            return parent.resize(
+                (right - left, bottom - top), Image.Resampling.BILINEAR, box=region
+            )
+        return None
@@ -0,0 +1,380 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module computes several image quality metrics from a single decode of each image (sharpness, exposure
+# clipping, contrast and noise), and combines them with rules such as "tenengrad >= 400; highlights <= 0.02" for sorting.
+
+import re
+import math
+import time
+import cv2
+import numpy as np
+
+from modules.blurfuncs import (
+    METRICS,
+    SCALE_FLAGS,
+    STRIP_ROWS,
+    blur_value,
+    scale_gain,
+    sort_decision,
+)
+from modules.poolfuncs import CachedPool
+
+# Metric groups that can be enabled, in the order they are computed. Each group costs one pass over the image
+QUALITY_METRICS = ("laplacian", "tenengrad", "exposure", "noise")
+
+# Values each group produces. Rules are written against these names
+METRIC_VALUES = {
+    "laplacian": ("laplacian",),
+    "tenengrad": ("tenengrad",),
+    "exposure": ("highlights", "shadows", "contrast"),
+    "noise": ("noise",),
+}
+VALUE_METRICS = {
+    value: metric for metric, values in METRIC_VALUES.items() for value in values
+}
+
+# Pixels at or past these levels count as clipped
+HIGHLIGHT_LEVEL = 250
+SHADOW_LEVEL = 5
+
+# Kernel of Immerkaer's noise estimator. It is the difference of two laplacians, so image structure cancels out
+# and mostly noise is left
+NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+# Comparisons allowed in rules
+RULE_OPERATORS = {
+    ">=": lambda value, limit: value >= limit,
+    "<=": lambda value, limit: value <= limit,
+    ">": lambda value, limit: value > limit,
+    "<": lambda value, limit: value < limit,
+}
+RULE_PATTERN = re.compile(r"^\s*([a-z_]+)\s*(>=|<=|>|<)\s*([-+0-9.eE]+)\s*$")
+
+
+def _filter_strips(image, ddepth, kernel=None, dx=0, dy=0, strip_rows=STRIP_ROWS):
+    """
+    Filters an image strip by strip with a 3x3 kernel, or a Sobel derivative when kernel is None
+
+    :param image: 8-bit grayscale image
+    :type image: numpy.ndarray
+    :param ddepth: OpenCV output depth
+    :type ddepth: int
+    :param kernel: 3x3 kernel for cv2.filter2D
+    :type kernel: numpy.ndarray | None
+    :param dx: Sobel x derivative order
+    :type dx: int
+    :param dy: Sobel y derivative order
+    :type dy: int
+    :param strip_rows: rows filtered per strip
+    :type strip_rows: int
+    """
+    rows = image.shape[0]
+    for top in range(0, rows, strip_rows):
+        bottom = min(top + strip_rows, rows)
+        # One halo row on each side, as in blurfuncs._laplacian_strips
+        start = max(top - 1, 0)
+        stop = min(bottom + 1, rows)
+        if kernel is None:
+            filtered = cv2.Sobel(image[start:stop], ddepth, dx, dy, ksize=3)
+        else:
+            filtered = cv2.filter2D(image[start:stop], ddepth, kernel)
+        yield filtered[top - start : bottom - start]
+
+
+def tenengrad(image, strip_rows=STRIP_ROWS):
+    """
+    Computes the Tenengrad sharpness, the mean squared Sobel gradient magnitude
+
+    :param image: 8-bit grayscale image
+    :type image: numpy.ndarray
+    :param strip_rows: rows filtered per strip
+    :type strip_rows: int
+
+    :return: mean of gx**2 + gy**2
+    :rtype: float
+    """
+    total = 0.0
+    for gx, gy in zip(
+        _filter_strips(image, cv2.CV_16S, dx=1, strip_rows=strip_rows),
+        _filter_strips(image, cv2.CV_16S, dy=1, strip_rows=strip_rows),
+    ):
+        # The L2 norm squared is the sum of squares, without a float copy of the strip
+        total += cv2.norm(gx, cv2.NORM_L2SQR) + cv2.norm(gy, cv2.NORM_L2SQR)
+    return total / image.size
+
+
+def exposure_stats(image):
+    """
+    Computes the clipped highlight and shadow fractions and the RMS contrast from one histogram
+
+    :param image: 8-bit grayscale image
+    :type image: numpy.ndarray
+
+    :return: dictionary with "highlights", "shadows" (fractions of pixels) and "contrast" (standard deviation / 255)
+    :rtype: dict
+    """
+    hist = cv2.calcHist([image], [0], None, [256], [0, 256]).ravel()
+    pixels = hist.sum()
+    levels = np.arange(256, dtype=np.float64)
+    mean = float(hist @ levels) / pixels
+    variance = float(hist @ (levels - mean) ** 2) / pixels
+    return {
+        "highlights": float(hist[HIGHLIGHT_LEVEL:].sum() / pixels),
+        "shadows": float(hist[: SHADOW_LEVEL + 1].sum() / pixels),
+        "contrast": math.sqrt(variance) / 255,
+    }
+
+
+def noise_sigma(image, strip_rows=STRIP_ROWS):
+    """
+    Estimates the standard deviation of the image noise with Immerkaer's method
+
+    :param image: 8-bit grayscale image
+    :type image: numpy.ndarray
+    :param strip_rows: rows filtered per strip
+    :type strip_rows: int
+
+    :return: noise standard deviation in gray levels
+    :rtype: float
+    """
+    rows, cols = image.shape
+    if rows < 3 or cols < 3:
+        return 0.0
+    total = 0.0
+    for top, strip in zip(
+        range(0, rows, strip_rows),
+        _filter_strips(image, cv2.CV_32F, NOISE_KERNEL, strip_rows=strip_rows),
+    ):
+        # Leave out the border, where the kernel reads reflected pixels
+        first = 1 if top == 0 else 0
+        last = strip.shape[0] - 1 if top + strip.shape[0] == rows else strip.shape[0]
+        total += cv2.norm(strip[first:last, 1:-1], cv2.NORM_L1)
+    return math.sqrt(math.pi / 2) * total / (6 * (rows - 2) * (cols - 2))
+
+
+def analyze_image(image_path, metrics=QUALITY_METRICS, scale=1, blur_metric="global"):
+    """
+    Decodes an image once and computes the enabled quality metrics from the same buffer
+
+    :param image_path: path to the image file
+    :type image_path: str
+    :param metrics: metric groups to compute, from QUALITY_METRICS
+    :type metrics: Iterable
+    :param scale: decode the image at 1/scale resolution (1, 2, 4 or 8)
+    :type scale: int
+    :param blur_metric: score used for the "laplacian" value, one of METRICS
+    :type blur_metric: str
+
+    :return: dictionary of values, and seconds spent on the decode and on each metric group
+    :rtype: tuple
+    """
+    if scale not in SCALE_FLAGS:
+        raise ValueError(f"Unsupported scale factor: {scale}")
+    if blur_metric not in METRICS:
+        raise ValueError(f"Unsupported metric: {blur_metric}")
+    unknown = set(metrics) - set(QUALITY_METRICS)
+    if unknown:
+        raise ValueError(f"Unsupported quality metrics: {', '.join(sorted(unknown))}")
+
+    start = time.perf_counter()
+    image = cv2.imread(image_path, SCALE_FLAGS[scale])
+    if image is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    costs = {"decode": time.perf_counter() - start}
+
+    values = {}
+    for metric in QUALITY_METRICS:
+        if metric not in metrics:
+            continue
+        start = time.perf_counter()
+        if metric == "laplacian":
+            values["laplacian"] = blur_value(image, scale, None, blur_metric)
+        elif metric == "tenengrad":
+            # Same rough resolution correction as the laplacian
+            values["tenengrad"] = tenengrad(image) * scale_gain(scale)
+        elif metric == "exposure":
+            values.update(exposure_stats(image))
+        elif metric == "noise":
+            # Reduced decodes average noise away, so thresholds only carry over at the same scale
+            values["noise"] = noise_sigma(image)
+        costs[metric] = time.perf_counter() - start
+    return values, costs
+
+
+def _analyze_one(index, image_path, metrics, scale=1, blur_metric="global"):
+    """
+    Worker task for QualityAnalyzer
+
+    :param index: position of the image in the caller's list
+    :type index: int
+    :param image_path: path to the image file
+    :type image_path: str
+    :param metrics: metric groups to compute
+    :type metrics: tuple
+    :param scale: decode scale factor
+    :type scale: int
+    :param blur_metric: score used for the "laplacian" value
+    :type blur_metric: str
+    """
+    start = time.perf_counter()
+    try:
+        result = analyze_image(image_path, metrics, scale, blur_metric)
+    except Exception as e:
+        print(f"Error analyzing {image_path}: {e}")
+        result = None
+    return index, result, time.perf_counter() - start
+
+
+class QualityAnalyzer:
+    def __init__(
+        self,
+        metrics=QUALITY_METRICS,
+        workers=None,
+        use_processes=True,
+        scale=1,
+        blur_metric="global",
+    ):
+        """
+        Initialize the QualityAnalyzer class. Runs analyze_image on a worker pool
+
+        :param metrics: metric groups to compute, from QUALITY_METRICS
+        :type metrics: Iterable
+        :param workers: Number of workers in the pool (defaults to the number of cores)
+        :type workers: int | None
+        :param use_processes: Use a process pool, falling back to threads if processes are unavailable
+        :type use_processes: bool
+        :param scale: decode scale factor, 1 is full resolution
+        :type scale: int
+        :param blur_metric: score used for the "laplacian" value, one of METRICS
+        :type blur_metric: str
+        """
+        self.pool = CachedPool(_analyze_one, workers, use_processes)
+        self.scale = scale
+        self.blur_metric = blur_metric
+        self.metrics = tuple(metric for metric in QUALITY_METRICS if metric in metrics)
+        # decode or metric group -> total seconds, for the last call to analyze
+        self.costs = {}
+        self.analyzed = 0
+
+    def analyze(self, image_paths):
+        """
+        Analyzes images, yielding results in completion order. Quality values are not cached
+
+        :param image_paths: Paths of the images to analyze
+        :type image_paths: Iterable
+
+        :return: Generator of (index, values) tuples, values being None if the image could not be read
+        :rtype: Generator
+        """
+        self.costs = {}
+        self.analyzed = 0
+        settings = (self.metrics, self.scale, self.blur_metric)
+        for index, result in self.pool.run(image_paths, settings):
+            if result is None:
+                yield index, None
+                continue
+            values, costs = result
+            self.analyzed += 1
+            for name, seconds in costs.items():
+                self.costs[name] = self.costs.get(name, 0.0) + seconds
+            yield index, values
+
+    def cost_report(self):
+        """
+        Average time per analyzed image spent on the decode and on each metric group
+
+        :return: Report text
+        :rtype: str
+        """
+        if not self.analyzed:
+            return "No images analyzed"
+        parts = [
+            f"{name} {seconds / self.analyzed * 1000:.1f} ms"
+            for name, seconds in self.costs.items()
+        ]
+        return f"Cost per image ({self.analyzed} images): " + ", ".join(parts)
+
+
+def parse_rules(text):
+    """
+    Parses sorting rules such as "tenengrad >= 400; highlights <= 0.02". Rules are separated by
+    semicolons or commas, and an image is kept only if it passes all of them
+
+    :param text: rules text, empty for no rules
+    :type text: str
+
+    :return: list of (value name, operator, limit) tuples
+    :rtype: list
+    """
+    rules = []
+    for part in re.split(r"[;,]", text or ""):
+        if not part.strip():
+            continue
+        match = RULE_PATTERN.match(part.lower())
+        if not match:
+            raise ValueError(f"Could not parse rule: {part.strip()}")
+        name, operator, limit = match.groups()
+        if name not in VALUE_METRICS:
+            raise ValueError(
+                f"Unknown value in rule: {name} (expected one of {', '.join(VALUE_METRICS)})"
+            )
+        try:
+            rules.append((name, operator, float(limit)))
+        except ValueError:
+            raise ValueError(f"Could not parse rule: {part.strip()}")
+    return rules
+
+
+def rule_metrics(rules):
+    """
+    Metric groups needed to evaluate a set of rules, always including the laplacian used by the slider
+
+    :param rules: rules from parse_rules
+    :type rules: list
+
+    :return: metric groups
+    :rtype: tuple
+    """
+    needed = {"laplacian"} | {VALUE_METRICS[name] for name, _, _ in rules}
+    return tuple(metric for metric in QUALITY_METRICS if metric in needed)
+
+
+def failed_rules(values, rules):
+    """
+    Finds the rules an image does not pass
+
+    :param values: quality values of the image
+    :type values: dict
+    :param rules: rules from parse_rules
+    :type rules: list
+
+    :return: the failing rules
+    :rtype: list
+    """
+    return [
+        (name, operator, limit)
+        for name, operator, limit in rules
+        if not RULE_OPERATORS[operator](values[name], limit)
+    ]
+
+
+def quality_decision(values, threshold, rules):
+    """
+    Decides where an image goes. It must pass the blur threshold and every rule to be kept
+
+    :param values: quality values of the image, None if it could not be read
+    :type values: dict | None
+    :param threshold: blur threshold for the "laplacian" value
+    :type threshold: float
+    :param rules: rules from parse_rules
+    :type rules: list
+
+    :return: "Keep", "Discard", or None to leave the image where it is
+    :rtype: str | None
+    """
+    if values is None:
+        return None
+    decision = sort_decision(values["laplacian"], threshold)
+    if decision == "Keep" and failed_rules(values, rules):
+        return "Discard"
+    return decision
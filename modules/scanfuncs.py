@@ -0,0 +1,81 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module finds the images in a folder for the sorting tabs. Images are yielded one at a time as the folder
+# is read, so scoring and display can start before a large (or network) folder has been fully listed.
+
+import os
+
+# Leading bytes of the formats the sorting tabs can open
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+# Extensions used when sniffing is turned off
+IMAGE_EXTENSIONS = ("png", "jpg", "jpeg", "bmp", "tif", "tiff", "webp")
+
+# Folders created by earlier sorts, never scanned again
+SORT_FOLDERS = {"Keep", "Discard", "Maybe"}
+
+
+def sniff_image(path):
+    """
+    Identifies an image by its first bytes instead of its extension
+
+    :param path: path to the file
+    :type path: str
+
+    :return: image format, or None if the file is not an image we can open
+    :rtype: str | None
+    """
+    try:
+        with open(path, "rb") as file:
+            header = file.read(12)
+    except OSError:
+        return None
+
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def scan_images(folder_path, recursive=False, sniff=True):
+    """
+    Yields the paths of the images in a folder as they are found
+
+    :param folder_path: folder to scan
+    :type folder_path: str
+    :param recursive: also scan subfolders (such as per-card DCIM folders), skipping Keep, Discard and Maybe
+    :type recursive: bool
+    :param sniff: identify images by their first bytes, otherwise by extension
+    :type sniff: bool
+
+    :return: Generator of image paths
+    :rtype: Generator
+    """
+    folders = [folder_path]
+    while folders:
+        current = folders.pop()
+        subfolders = []
+        with os.scandir(current) as entries:
+            for entry in entries:
+                # Hidden files include the score cache and manifests
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and entry.name not in SORT_FOLDERS:
+                        subfolders.append(entry.path)
+                elif entry.is_file():
+                    if sniff:
+                        if sniff_image(entry.path):
+                            yield entry.path
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield entry.path
+        # Visit subfolders in name order, depth first
+        folders.extend(sorted(subfolders, reverse=True))
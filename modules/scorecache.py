@@ -0,0 +1,408 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module keeps computed blur values, perceptual hashes and capture metadata in a small SQLite file inside
+# the sorted folder, so re-opening a folder only processes images that are new or have changed since the last visit.
+
+import os
+import time
+import sqlite3
+import hashlib
+
+# Sidecar file written inside the folder being sorted
+CACHE_FILENAME = ".photogenie_scores.db"
+
+# Paths per lookup query, below SQLite's limit on query parameters
+QUERY_BATCH = 500
+
+# Bumped whenever the table layout or the way a cached value is computed changes. Older caches are dropped
+# and rebuilt
+SCHEMA_VERSION = 3
+
+# Every table holding cached values, all of them are dropped when the schema version changes
+CACHE_TABLES = ("scores", "hashes", "metadata")
+
+# Columns of the metadata table, in the order they are stored. Kept here rather than in exiffuncs so the cache
+# does not depend on the image processing modules
+METADATA_FIELDS = ("capture_time", "camera", "lens", "iso", "shutter", "orientation")
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Computes the SHA-256 of a file in chunks
+
+    :param path: path to the file
+    :type path: str
+    :param chunk_size: bytes read per chunk
+    :type chunk_size: int
+
+    :return: hex digest of the file contents
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _signed(value):
+    """
+    Maps an unsigned 64-bit hash onto SQLite's signed INTEGER range
+    """
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value):
+    """
+    Inverse of _signed
+    """
+    return value + (1 << 64) if value < 0 else value
+
+
+class ScoreCache:
+    def __init__(self, db_path, max_entries=100000, use_hash=False):
+        """
+        Initialize the ScoreCache class.
+
+        :param db_path: Path of the SQLite cache file
+        :type db_path: str
+        :param max_entries: Least recently used entries beyond this count are evicted
+        :type max_entries: int
+        :param use_hash: Also store a content hash, so a file whose size or mtime changed but whose contents did not is still a hit
+        :type use_hash: bool
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.use_hash = use_hash
+        self.connection = sqlite3.connect(db_path)
+
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            for table in CACHE_TABLES:
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scores (
+                path TEXT NOT NULL,
+                scale INTEGER NOT NULL,
+                metric TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT,
+                blur_val REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (path, scale, metric)
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)"
+        )
+        # Perceptual hashes, stored as signed 64-bit integers
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                dhash INTEGER NOT NULL,
+                phash INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        # Capture metadata read from the EXIF block
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metadata (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                capture_time REAL,
+                camera TEXT,
+                lens TEXT,
+                iso INTEGER,
+                shutter REAL,
+                orientation INTEGER,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self.connection.commit()
+
+    @classmethod
+    def for_folder(cls, folder_path, **kwargs):
+        """
+        Opens the sidecar cache of a folder
+
+        :param folder_path: folder being sorted
+        :type folder_path: str
+        """
+        return cls(os.path.join(folder_path, CACHE_FILENAME), **kwargs)
+
+    def lookup(self, image_paths, scale=1, metric="global"):
+        """
+        Finds cached blur values that are still valid for the given images
+
+        :param image_paths: Paths of the images to look up
+        :type image_paths: list
+        :param scale: decode scale factor the values were computed at
+        :type scale: int
+        :param metric: blur score the values hold
+        :type metric: str
+
+        :return: Dictionary of index to cached blur value, and the list of indexes that must be scored
+        :rtype: tuple
+        """
+        # A few batched queries instead of one round trip per image
+        rows = {}
+        for start in range(0, len(image_paths), QUERY_BATCH):
+            batch = image_paths[start : start + QUERY_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            for row in self.connection.execute(
+                "SELECT path, size, mtime_ns, content_hash, blur_val FROM scores "
+                f"WHERE scale = ? AND metric = ? AND path IN ({placeholders})",
+                (scale, metric, *batch),
+            ):
+                rows[row[0]] = row[1:]
+
+        hits = {}
+        missing = []
+        for index, image_path in enumerate(image_paths):
+            row = rows.get(image_path)
+            if row is None:
+                missing.append(index)
+                continue
+
+            size, mtime_ns, content_hash, blur_val = row
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                missing.append(index)
+                continue
+
+            if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+                hits[index] = blur_val
+            elif (
+                self.use_hash
+                and content_hash
+                and stat.st_size == size
+                and file_hash(image_path) == content_hash
+            ):
+                # Touched or copied but unchanged, refresh the stored mtime
+                hits[index] = blur_val
+                self.connection.execute(
+                    "UPDATE scores SET mtime_ns = ? "
+                    "WHERE path = ? AND scale = ? AND metric = ?",
+                    (stat.st_mtime_ns, image_path, scale, metric),
+                )
+            else:
+                missing.append(index)
+
+        # Mark hits as recently used so eviction keeps them
+        now = time.time()
+        self.connection.executemany(
+            "UPDATE scores SET last_used = ? WHERE path = ? AND scale = ? AND metric = ?",
+            [(now, image_paths[index], scale, metric) for index in hits],
+        )
+        # Committed with the next store or on close, not once per chunk
+        return hits, missing
+
+    def store(self, results, scale=1, metric="global"):
+        """
+        Saves blur values and evicts the least recently used entries past max_entries
+
+        :param results: (image path, blur value) pairs
+        :type results: list
+        :param scale: decode scale factor the values were computed at
+        :type scale: int
+        :param metric: blur score the values hold
+        :type metric: str
+        """
+        now = time.time()
+        rows = []
+        for image_path, blur_val in results:
+            if blur_val is None:
+                continue
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                continue
+            content_hash = file_hash(image_path) if self.use_hash else None
+            rows.append(
+                (
+                    image_path,
+                    scale,
+                    metric,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    content_hash,
+                    float(blur_val),
+                    now,
+                )
+            )
+
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.evict()
+        self.connection.commit()
+
+    def _lookup_rows(self, table, columns, image_paths):
+        """
+        Finds the rows of a per-file table that are still valid for the given images, by size and mtime
+
+        :param table: "hashes" or "metadata"
+        :type table: str
+        :param columns: columns to return
+        :type columns: tuple
+        :param image_paths: Paths of the images to look up
+        :type image_paths: list
+
+        :return: Dictionary of index to column values, and the list of indexes that must be computed
+        :rtype: tuple
+        """
+        rows = {}
+        for start in range(0, len(image_paths), QUERY_BATCH):
+            batch = image_paths[start : start + QUERY_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            for row in self.connection.execute(
+                f"SELECT path, size, mtime_ns, {', '.join(columns)} FROM {table} "
+                f"WHERE path IN ({placeholders})",
+                batch,
+            ):
+                rows[row[0]] = row[1:]
+
+        hits = {}
+        missing = []
+        for index, image_path in enumerate(image_paths):
+            row = rows.get(image_path)
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                stat = None
+            if row and stat and (stat.st_size, stat.st_mtime_ns) == row[:2]:
+                hits[index] = row[2:]
+            else:
+                missing.append(index)
+
+        now = time.time()
+        self.connection.executemany(
+            f"UPDATE {table} SET last_used = ? WHERE path = ?",
+            [(now, image_paths[index]) for index in hits],
+        )
+        # Committed with the next store or on close, not once per chunk
+        return hits, missing
+
+    def _store_rows(self, table, rows):
+        """
+        Saves (image path, column values) pairs in a per-file table, skipping None values and files that are gone
+
+        :param table: "hashes" or "metadata"
+        :type table: str
+        :param rows: (image path, tuple of column values) pairs
+        :type rows: list
+        """
+        now = time.time()
+        records = []
+        for image_path, values in rows:
+            if values is None:
+                continue
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                continue
+            records.append((image_path, stat.st_size, stat.st_mtime_ns, *values, now))
+
+        if records:
+            placeholders = ", ".join("?" * len(records[0]))
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", records
+            )
+        self.evict()
+        self.connection.commit()
+
+    def lookup_hashes(self, image_paths):
+        """
+        Finds cached perceptual hashes that are still valid for the given images
+
+        :param image_paths: Paths of the images to look up
+        :type image_paths: list
+
+        :return: Dictionary of index to (dhash, phash), and the list of indexes that must be hashed
+        :rtype: tuple
+        """
+        hits, missing = self._lookup_rows("hashes", ("dhash", "phash"), image_paths)
+        return {
+            index: (_unsigned(dhash), _unsigned(phash))
+            for index, (dhash, phash) in hits.items()
+        }, missing
+
+    def store_hashes(self, results):
+        """
+        Saves perceptual hashes and evicts the least recently used entries past max_entries
+
+        :param results: (image path, (dhash, phash)) pairs
+        :type results: list
+        """
+        self._store_rows(
+            "hashes",
+            [
+                (image_path, hashes and (_signed(hashes[0]), _signed(hashes[1])))
+                for image_path, hashes in results
+            ],
+        )
+
+    def lookup_metadata(self, image_paths):
+        """
+        Finds cached capture metadata that is still valid for the given images
+
+        :param image_paths: Paths of the images to look up
+        :type image_paths: list
+
+        :return: Dictionary of index to metadata dictionary, and the list of indexes that must be read
+        :rtype: tuple
+        """
+        hits, missing = self._lookup_rows("metadata", METADATA_FIELDS, image_paths)
+        return {
+            index: dict(zip(METADATA_FIELDS, values)) for index, values in hits.items()
+        }, missing
+
+    def store_metadata(self, results):
+        """
+        Saves capture metadata and evicts the least recently used entries past max_entries
+
+        :param results: (image path, metadata dictionary) pairs
+        :type results: list
+        """
+        self._store_rows(
+            "metadata",
+            [
+                (image_path, metadata and tuple(metadata[f] for f in METADATA_FIELDS))
+                for image_path, metadata in results
+            ],
+        )
+
+    def evict(self):
+        """
+        Deletes the least recently used entries beyond max_entries
+        """
+        for table in ("scores", "hashes", "metadata"):
+            (count,) = self.connection.execute(
+                f"SELECT COUNT(*) FROM {table}"
+            ).fetchone()
+            if count > self.max_entries:
+                self.connection.execute(
+                    f"DELETE FROM {table} WHERE rowid IN "
+                    f"(SELECT rowid FROM {table} ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def close(self):
+        """
+        Close the cache file.
+        """
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,62 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the layout and selection of the thumbnail grid.
+
+import pytest
+from modules.ThumbnailGrid import GridLayout, select_range
+
+
+@pytest.fixture
+def layout():
+    """Fixture with 100 pixel cells, 10 pixel padding and a 20 pixel label, so cells are 120 wide and 140 tall."""
+    return GridLayout(cell=100, padding=10, label=20)
+
+
+def test_columns_and_height(layout):
+    """
+    Test that the grid fits as many columns as it can and is tall enough for every row
+    """
+    assert layout.columns(600) == 5
+    assert layout.columns(50) == 1
+    assert layout.height(11, 5) == 3 * 140
+
+
+def test_origin(layout):
+    """
+    Test that cells are placed left to right, then top to bottom
+    """
+    assert layout.origin(0, 5) == (10, 10)
+    assert layout.origin(7, 5) == (2 * 120 + 10, 140 + 10)
+
+
+def test_visible_range(layout):
+    """
+    Test that only the rows in view are visible, however many images there are
+    """
+    assert layout.visible_range(0, 400, 5, 100000) == (0, 15)
+    assert layout.visible_range(1400, 400, 5, 100000) == (50, 65)
+    assert layout.visible_range(0, 400, 5, 7) == (0, 7)
+    # The pool never needs more cells than a view can show
+    first, last = layout.visible_range(1330, 400, 5, 100000)
+    assert last - first <= layout.capacity(400, 5)
+
+
+def test_index_at(layout):
+    """
+    Test that clicks map to the cell under them
+    """
+    assert layout.index_at(130, 150, 5, 100) == 6
+    assert layout.index_at(650, 10, 5, 100) is None  # right of the last column
+    assert layout.index_at(10, 1500, 5, 20) is None  # below the last image
+
+
+def test_select_range():
+    """
+    Test that shift selections work in both directions
+    """
+    assert select_range(3, 6) == {3, 4, 5, 6}
+    assert select_range(6, 3) == {3, 4, 5, 6}
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,212 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the blur scoring functions used by the Blur Sort tab.
+
+import pytest
+import cv2
+import numpy as np
+from modules.blurfuncs import (
+    BlurScorer,
+    ScoreIndex,
+    calibrate_fast_scoring,
+    compute_blurVal,
+    fit_gain,
+    format_calibration_report,
+    aggregate_tiles,
+    laplacian_variance,
+    sharpness_map,
+)
+from modules.scorecache import ScoreCache
+
+
+@pytest.fixture(scope="module")
+def image_paths(tmp_path_factory):
+    """Fixture to write a sharp and a blurry test image."""
+    folder = tmp_path_factory.mktemp("blur_imgs")
+    rng = np.random.default_rng(0)
+    sharp = rng.integers(0, 256, (240, 320), dtype=np.uint8)
+    blurry = cv2.GaussianBlur(sharp, (15, 15), 5)
+
+    sharp_path = str(folder / "sharp.png")
+    blurry_path = str(folder / "blurry.png")
+    cv2.imwrite(sharp_path, sharp)
+    cv2.imwrite(blurry_path, blurry)
+    return [sharp_path, blurry_path]
+
+
+def test_compute_blurVal(image_paths):
+    """
+    Test that a sharp image scores higher than a blurry one
+    """
+    sharp_val = compute_blurVal(image_paths[0])
+    blurry_val = compute_blurVal(image_paths[1])
+
+    assert sharp_val > blurry_val
+
+
+def test_scorer_streams_from_generator(image_paths):
+    """
+    Test that the scorer accepts a generator of paths, such as a folder scan
+    """
+    scorer = BlurScorer(workers=2, use_processes=False)
+    values = scorer.score_all(path for path in image_paths * 3)
+
+    assert values == [compute_blurVal(path) for path in image_paths * 3]
+
+
+def test_compute_blurVal_unreadable(tmp_path):
+    """
+    Test that an unreadable file raises a ValueError
+    """
+    bad_path = tmp_path / "bad.jpg"
+    bad_path.write_bytes(b"not an image")
+
+    with pytest.raises(ValueError):
+        compute_blurVal(str(bad_path))
+
+
+@pytest.mark.parametrize("use_processes", [True, False])
+def test_scorer_matches_serial(image_paths, use_processes):
+    """
+    Test that the pooled scorer returns the same values in the same order as the serial function
+    """
+    scorer = BlurScorer(workers=2, use_processes=use_processes)
+    values = scorer.score_all(image_paths + [image_paths[0] + ".missing"])
+
+    assert values[:2] == [compute_blurVal(path) for path in image_paths]
+    assert values[2] is None
+
+
+@pytest.mark.parametrize("precision", ["16S", "32F", "64F"])
+def test_laplacian_variance_strips(precision):
+    """
+    Test that strip-wise variance matches the original full image CV_64F computation
+    """
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 256, (1000, 300), dtype=np.uint8)
+    expected = cv2.Laplacian(image, cv2.CV_64F).var()
+
+    assert laplacian_variance(image, precision, strip_rows=None) == pytest.approx(expected)
+    assert laplacian_variance(image, precision, strip_rows=64) == pytest.approx(expected)
+    assert laplacian_variance(image, precision, strip_rows=333) == pytest.approx(expected)
+
+    with pytest.raises(ValueError):
+        laplacian_variance(image, "8U")
+
+
+def test_sharpness_map():
+    """
+    Test tile variances against a per-tile loop and the aggregate scores
+    """
+    rng = np.random.default_rng(2)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (300, 200), dtype=np.uint8), (9, 9), 3)
+    # Sharp subject in the top left tile only
+    image[:50, :50] = rng.integers(0, 256, (50, 50), dtype=np.uint8)
+
+    variance, tiles = sharpness_map(image, tile_size=50, strip_rows=100)
+    laplacian = cv2.Laplacian(image, cv2.CV_64F)
+
+    assert variance == pytest.approx(laplacian.var())
+    assert tiles.shape == (6, 4)
+    assert tiles[0, 0] == pytest.approx(laplacian[:50, :50].var())
+    assert tiles[5, 3] == pytest.approx(laplacian[250:300, 150:200].var())
+
+    assert aggregate_tiles(tiles, "max_tile") == tiles[0, 0]
+    assert aggregate_tiles(tiles, "top_k", top_fraction=0.01) == tiles[0, 0]
+    assert aggregate_tiles(tiles, "top_k") > variance
+    assert aggregate_tiles(tiles, "center") < tiles[0, 0]
+
+
+def test_tile_metric_keeps_sharp_subject(image_paths):
+    """
+    Test that every metric still ranks the sharp image above the blurry one
+    """
+    for metric in ("max_tile", "top_k", "center"):
+        assert compute_blurVal(image_paths[0], metric=metric) > compute_blurVal(
+            image_paths[1], metric=metric
+        )
+
+
+def test_scorer_uses_cache(image_paths, tmp_path):
+    """
+    Test that a second pass over the same images is served from the score cache
+    """
+    cache = ScoreCache(str(tmp_path / "scores.db"))
+    scorer = BlurScorer(workers=1)
+    first = scorer.score_all(image_paths, cache)
+
+    hits, missing = cache.lookup(image_paths)
+    assert missing == []
+    assert scorer.score_all(image_paths, cache) == first
+    cache.close()
+
+
+def test_score_index():
+    """
+    Test keep/discard counts, borderline images and the histogram of the score index
+    """
+    blurValues = [50.0, None, 10.0, 30.0, 20.0, 40.0]
+    index = ScoreIndex(blurValues, bins=5, upper_percentile=100)
+
+    assert len(index) == 5
+    assert index.counts(0) == (5, 0)
+    assert index.counts(30) == (3, 2)
+    assert index.counts(31) == (2, 3)
+    assert index.counts(1000) == (0, 5)
+
+    below, above = index.borderline(30, count=2)
+    assert below == [2, 4]
+    assert above == [3, 5]
+
+    assert index.upper == 50
+    assert index.hist.sum() == 5
+
+
+def test_fast_scoring_keeps_order(image_paths):
+    """
+    Test that reduced resolution scoring still ranks the sharp image above the blurry one
+    """
+    sharp_val = compute_blurVal(image_paths[0], scale=4)
+    blurry_val = compute_blurVal(image_paths[1], scale=4)
+
+    assert sharp_val > blurry_val
+
+    with pytest.raises(ValueError):
+        compute_blurVal(image_paths[0], scale=3)
+
+
+def test_calibration_report(image_paths):
+    """
+    Test the fast scoring calibration report against the full resolution baseline
+    """
+    threshold = compute_blurVal(image_paths[1]) + 1
+    report = calibrate_fast_scoring(
+        image_paths, threshold, scale=2, use_processes=False
+    )
+
+    assert report["num_images"] == 2
+    assert report["fitted_gain"] > 0
+    assert 0 <= report["fitted"]["agreement"] <= 1
+    assert "1/2 resolution" in format_calibration_report(report)
+
+
+def test_fit_gain(image_paths, tmp_path):
+    """
+    Test that the fitted gain maps reduced resolution values onto the full resolution ones and that
+    the full resolution sample is cached
+    """
+    full = compute_blurVal(image_paths[0])
+    fast = compute_blurVal(image_paths[0], scale=4)
+    cache = ScoreCache(str(tmp_path / "cache.db"))
+
+    gain = fit_gain(image_paths[:1], [fast], 4, use_processes=False, cache=cache)
+    assert fast * gain == pytest.approx(full)
+    assert cache.lookup(image_paths[:1])[0] == {0: pytest.approx(full)}
+
+    # Nothing to fit
+    assert fit_gain(image_paths, [None, None], 4, use_processes=False) == 1.0
+    assert fit_gain(image_paths, [fast, fast], 1, use_processes=False) == 1.0
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,133 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the headless blur sort command line.
+
+import os
+import json
+import pytest
+import cv2
+import numpy as np
+import blursort
+from modules.scorecache import ScoreCache
+from modules.transferfuncs import MANIFEST_PREFIX, latest_manifest, revert_manifest
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """Fixture with a sharp and a blurry image of the same name in two card folders."""
+    rng = np.random.default_rng(0)
+    sharp = rng.integers(0, 256, (120, 160), dtype=np.uint8)
+    blurry = cv2.GaussianBlur(sharp, (15, 15), 5)
+
+    shoot = tmp_path / "shoot"
+    for card, image in (("100CANON", sharp), ("101CANON", blurry)):
+        (shoot / "DCIM" / card).mkdir(parents=True)
+        cv2.imwrite(str(shoot / "DCIM" / card / "IMG_0001.png"), image)
+    return shoot
+
+
+def run(args, capsys):
+    """Runs the command line and returns its exit code and JSON report."""
+    code = blursort.main([str(arg) for arg in args])
+    return code, json.loads(capsys.readouterr().out)
+
+
+def test_dry_run(folder, capsys):
+    """
+    Test that a dry run scores and reports every image without moving anything
+    """
+    code, report = run([folder, "--recursive", "--dry-run", "--threads"], capsys)
+
+    assert code == 0
+    assert report["summary"]["images"] == 2
+    decisions = {
+        os.path.relpath(result["path"], folder): result["decision"]
+        for result in report["files"]
+    }
+    assert decisions == {
+        os.path.join("DCIM", "100CANON", "IMG_0001.png"): "Keep",
+        os.path.join("DCIM", "101CANON", "IMG_0001.png"): "Discard",
+    }
+    assert "transfer" not in report["summary"]
+    assert not (folder / "Keep").exists()
+
+
+def test_fast_scores_fitted(folder, capsys):
+    """
+    Test that fast scores are fitted to the full resolution scale of the folder, so a threshold
+    between the two images sorts them the same way at either resolution
+    """
+    args = [folder, "--recursive", "--dry-run", "--threads", "--threshold", 5000]
+    full = run(args, capsys)[1]
+    fast = run(args + ["--fast"], capsys)[1]
+
+    # Unfitted, the sharp image scores about 1800 at 1/4 resolution against 112000 at full resolution
+    assert [result["decision"] for result in full["files"]] == ["Keep", "Discard"]
+    assert [result["decision"] for result in fast["files"]] == ["Keep", "Discard"]
+
+
+def test_sort_to_output(folder, tmp_path, capsys):
+    """
+    Test that a sort into another folder keeps the subfolders, writes its manifest there and can be undone
+    """
+    output = tmp_path / "sorted"
+    code, report = run(
+        [folder, "--recursive", "--threads", "--transfer", "move", "--output", output],
+        capsys,
+    )
+
+    assert code == 0
+    assert report["summary"]["transfer"]["files"] == 2
+    keep = output / "Keep" / "DCIM" / "100CANON" / "IMG_0001.png"
+    discard = output / "Discard" / "DCIM" / "101CANON" / "IMG_0001.png"
+    assert sorted(result["dest"] for result in report["files"]) == sorted(
+        [str(discard), str(keep)]
+    )
+    assert keep.exists() and discard.exists()
+
+    # Nothing but the score cache is written to the source
+    assert not any(name.startswith(MANIFEST_PREFIX) for name in os.listdir(folder))
+    assert revert_manifest(latest_manifest(str(output))) == 2
+    assert (folder / "DCIM" / "100CANON" / "IMG_0001.png").exists()
+    assert (folder / "DCIM" / "101CANON" / "IMG_0001.png").exists()
+
+
+def test_sort_without_cache(folder, capsys, monkeypatch):
+    """
+    Test that a folder whose score cache cannot be opened is still sorted
+    """
+
+    def unavailable(*args, **kwargs):
+        raise OSError("read-only file system")
+
+    monkeypatch.setattr(ScoreCache, "for_folder", unavailable)
+    code, report = run([folder, "--recursive", "--threads"], capsys)
+
+    assert code == 0
+    assert report["summary"]["keep"] == 1
+    assert (folder / "Keep" / "DCIM" / "100CANON" / "IMG_0001.png").exists()
+
+
+def test_custom_sort_folders_not_rescanned(folder, capsys):
+    """
+    Test that a second recursive run does not score the images a first run sorted into custom folders
+    """
+    args = [folder, "--recursive", "--threads", "--keep-folder", "Sharp"]
+    assert run(args, capsys)[0] == 0
+    code, report = run(args + ["--dry-run"], capsys)
+
+    # Only the originals, not their copies in Sharp and Discard
+    assert code == 0
+    assert report["summary"]["images"] == 2
+
+
+def test_missing_folder(tmp_path, capsys):
+    """
+    Test that a folder that does not exist is an error
+    """
+    assert blursort.main([str(tmp_path / "missing")]) == 2
+    assert "is not a folder" in capsys.readouterr().err
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -2,18 +2,46 @@
 # Date: 12/2024
 # Description: This python file is a test file that tests database functions such as adding and fetching images and themes.
 
+import os
+import shutil
+import datetime
 import pytest
+from bson import ObjectId
+from PIL import Image
 from pymongo import MongoClient
-from dbfuncs import MongoDBHandler  # Replace with the correct import
+from pymongo.errors import PyMongoError
+from modules import previewfuncs
+from modules.dbfuncs import (
+    IngestCheckpoint,
+    MongoDBHandler,
+    after_filter,
+    plan_stages,
+)  # Replace with the correct import
+
+TEST_URI = "mongodb://localhost:27017/"
+
+
+def mongodb_reachable(uri):
+    """Whether a MongoDB server answers a ping at uri within a second."""
+    client = MongoClient(uri, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
 
 
 @pytest.fixture(scope="module")
 def db_handler():
     """Fixture to initialize MongoDBHandler and connect to test database."""
+    # The tests that need a server are skipped without one, the others still run
+    if not mongodb_reachable(TEST_URI):
+        pytest.skip(f"No MongoDB server at {TEST_URI}")
+
     # Create a MongoDBHandler instance for testing
-    test_db_handler = MongoDBHandler(
-        uri="mongodb://localhost:27017/", database_name="test_images_db"
-    )
+    test_db_handler = MongoDBHandler(uri=TEST_URI, database_name="test_images_db")
 
     # Yield the db_handler instance to the tests
     yield test_db_handler
@@ -104,5 +132,251 @@ def test_get_theme(db_handler):
     assert retrieved_theme["theme_name"] == theme_name
 
 
+def test_plan_stages():
+    """
+    Test that the stages of a nested query plan are listed from the root down
+    """
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {
+            "stage": "OR",
+            "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}],
+        },
+    }
+    assert plan_stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+    assert plan_stages({"queryPlan": {"stage": "IXSCAN"}}) == ["IXSCAN"]
+
+
+def test_ensure_indexes(db_handler):
+    """
+    Test that ensuring the indexes twice is harmless and the hot queries stop scanning whole collections
+    """
+    db_handler.index_thread.join()
+    first = db_handler.ensure_indexes()
+    assert db_handler.ensure_indexes() == first
+    assert "file_path_unique" in db_handler.database["fs.files"].index_information()
+
+    plans = db_handler.check_query_plans()
+    for name, stages in plans.items():
+        assert "COLLSCAN" not in stages, name
+
+
+def test_add_image_twice(db_handler):
+    """
+    Test that adding the same file again returns the ID it was stored under
+    """
+    file_id = db_handler.add_image("imgs/test_image1.jpg")
+    assert db_handler.add_image("imgs/test_image1.jpg") == file_id
+    assert db_handler.getImageById(file_id)["filename"] == "test_image1.jpg"
+
+
+def test_after_filter():
+    """
+    Test that a page cursor matches later values, and later IDs among equal values
+    """
+    assert after_filter("uploadDate", None) == {}
+    assert after_filter("uploadDate", (5, 7)) == {
+        "$or": [{"uploadDate": {"$gt": 5}}, {"uploadDate": 5, "_id": {"$gt": 7}}]
+    }
+    assert after_filter("_id", (7, 7)) == {"_id": {"$gt": 7}}
+
+
+def test_iter_themes_in_batches(db_handler):
+    """
+    Test that streaming themes in small batches returns each theme once, in the order they were added
+    """
+    for i in range(5):
+        db_handler.add_theme(f"Batch theme {i}", "description")
+    streamed = [
+        theme["theme_name"]
+        for theme in db_handler.iterThemes(batch_size=2)
+        if theme["theme_name"].startswith("Batch theme")
+    ]
+    assert streamed == [f"Batch theme {i}" for i in range(5)]
+    assert len(list(db_handler.iterThemes(batch_size=2))) == len(
+        db_handler.getAllThemes()
+    )
+
+
+def test_iter_themes_without_time_added(db_handler):
+    """
+    Test that themes stored without a time_added do not stop the listing
+    """
+    ids = db_handler.themesCollection.insert_many(
+        [{"theme_name": "Undated", "description": "description"} for _ in range(3)]
+    ).inserted_ids
+    db_handler.add_theme("Dated", "description")
+
+    names = [theme["theme_name"] for theme in db_handler.iterThemes(batch_size=1)]
+    assert names.count("Undated") == 3
+    assert "Dated" in names
+    db_handler.themesCollection.delete_many({"_id": {"$in": ids}})
+
+
+def test_image_ids(db_handler):
+    """
+    Test that a deleted image is no longer among the stored image IDs
+    """
+    file_id = db_handler.add_image("imgs/test_image2.jpg")
+    assert file_id in db_handler.image_ids()
+    assert db_handler.delete_image(file_id)
+    assert file_id not in db_handler.image_ids()
+
+
+def test_images_since_cursor(db_handler):
+    """
+    Test that paging from the cursor of the last image only returns images uploaded after it
+    """
+    images, cursor = db_handler.getImagesPage(limit=1000)
+    assert db_handler.getImagesPage(after=cursor) == ([], cursor)
+
+    db_handler.add_image("imgs/test_image2.jpg")
+    new_images = list(db_handler.iterImages(after=cursor))
+    assert [image["filename"] for image in new_images] == ["test_image2.jpg"]
+
+
+def test_ingest_checkpoint(tmp_path):
+    """
+    Test that a checkpoint restores the files it recorded, dropping a line cut short by a crash
+    """
+    checkpoint_path = str(tmp_path / "ingest.jsonl")
+    file_id = ObjectId()
+    checkpoint = IngestCheckpoint(checkpoint_path)
+    checkpoint.record("a.jpg", file_id)
+    checkpoint.close()
+    with open(checkpoint_path, "a", encoding="utf-8") as file:
+        file.write('["b.jpg", "6')
+
+    checkpoint = IngestCheckpoint(checkpoint_path)
+    assert checkpoint.done == {"a.jpg": file_id}
+    checkpoint.close()
+
+
+def test_ingest_images(db_handler, tmp_path):
+    """
+    Test that a bulk ingest adds new files, reports stored and missing ones, and skips checkpointed files
+    when run again
+    """
+    paths = []
+    for i in range(5):
+        path = str(tmp_path / f"ingest{i}.jpg")
+        shutil.copy("imgs/test_image1.jpg", path)
+        paths.append(path)
+    missing = str(tmp_path / "missing.jpg")
+    checkpoint_path = str(tmp_path / "ingest.jsonl")
+
+    report = db_handler.ingest_images(
+        paths[:3] + [paths[0], missing],
+        workers=2,
+        batch_size=2,
+        checkpoint_path=checkpoint_path,
+    )
+    assert (report["added"], report["exists"], report["failed"]) == (3, 0, 1)
+    assert report["bytes"] == 3 * os.path.getsize(paths[0])
+
+    report = db_handler.ingest_images(paths, checkpoint_path=checkpoint_path)
+    assert (report["added"], report["exists"], report["failed"]) == (2, 3, 0)
+    stored = db_handler.stored_ids(paths)
+    assert sorted(stored) == sorted(paths)
+    assert all(
+        result["file_id"] == stored[result["path"]] for result in report["results"]
+    )
+
+
+def test_identical_content_stored_once(db_handler, tmp_path):
+    """
+    Test that copies of one photo under different paths share one stored content, which is removed with the
+    last image referencing it
+    """
+    first = str(tmp_path / "original.jpg")
+    second = str(tmp_path / "exported.jpg")
+    # Trailing bytes make the content differ from the images other tests stored
+    with open("imgs/test_image2.jpg", "rb") as file:
+        data = file.read() + os.urandom(16)
+    for path in (first, second):
+        with open(path, "wb") as file:
+            file.write(data)
+    size = len(data)
+
+    report = db_handler.ingest_images([first, second], workers=1)
+    assert (report["added"], report["deduplicated"]) == (2, 1)
+    assert report["bytes_saved"] == size
+
+    first_id, second_id = (result["file_id"] for result in report["results"])
+    first_file = db_handler.getImageById(first_id)
+    assert first_file["blob_id"] == db_handler.getImageById(second_id)["blob_id"]
+    assert db_handler.getImageByFileID(second_id).read() == data
+    assert db_handler.storage_report()["reclaimed_bytes"] >= size
+
+    blobs = db_handler.database["blobs.files"]
+    assert blobs.find_one({"_id": first_file["blob_id"]})["refs"] == 2
+
+    assert db_handler.delete_image(first_id)
+    assert db_handler.blobs.exists(first_file["blob_id"])
+    assert blobs.find_one({"_id": first_file["blob_id"]})["refs"] == 1
+    assert db_handler.delete_image(second_id)
+    assert not db_handler.blobs.exists(first_file["blob_id"])
+
+
+def test_renditions(db_handler, tmp_path):
+    """
+    Test that small and screen renditions are stored with a new image and removed with it
+    """
+    path = str(tmp_path / "rendition.jpg")
+    Image.new("RGB", (3000, 2000), "green").save(path)
+
+    file_id = db_handler.add_image(path)
+    with Image.open(db_handler.getRendition(file_id, "small")) as small:
+        assert small.size == (400, 266)
+    with Image.open(db_handler.getRendition(file_id, "screen")) as screen:
+        assert screen.size == (2560, 1706)
+    assert db_handler.getRendition(file_id, "missing") is None
+
+    sha256 = db_handler.getImageById(file_id)["sha256"]
+    assert db_handler.delete_image(file_id)
+    assert not db_handler.database["renditions"].find_one({"sha256": sha256})
+
+
+def test_rendition_failure_keeps_image(db_handler, tmp_path, monkeypatch):
+    """
+    Test that an image whose renditions cannot be made is still stored, and readable, without them
+    """
+
+    def fail(*args, **kwargs):
+        raise ValueError("decoder failed")
+
+    monkeypatch.setattr(previewfuncs, "decode_display", fail)
+    path = str(tmp_path / "no_rendition.jpg")
+    Image.new("RGB", (300, 200), "purple").save(path)
+
+    file_id = db_handler.add_image(path)
+    assert db_handler.getRendition(file_id, "small") is None
+    with open(path, "rb") as file:
+        assert db_handler.getImageByFileID(file_id).read() == file.read()
+
+
+def test_images_since_include_late_inserts(db_handler):
+    """
+    Test that a refresh lists an entry stamped before the latest listed upload but inserted after it
+    """
+    last_upload = max(image["uploadDate"] for image in db_handler.iterImages())
+    late_id = (
+        db_handler.database["fs.files"]
+        .insert_one(
+            {
+                "filename": "late.jpg",
+                "length": 0,
+                "uploadDate": last_upload - datetime.timedelta(seconds=5),
+                "metadata": {},
+            }
+        )
+        .inserted_id
+    )
+
+    refreshed = [image["_id"] for image in db_handler.iterImagesSince(last_upload)]
+    assert late_id in refreshed
+    db_handler.database["fs.files"].delete_one({"_id": late_id})
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,84 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the EXIF metadata reader and the capture time ordering.
+
+import pytest
+from PIL import Image
+from modules.exiffuncs import (
+    MetadataIndexer,
+    describe,
+    group_by_camera,
+    order_by_capture,
+    read_exif_block,
+    read_metadata,
+)
+from modules.scorecache import ScoreCache
+
+
+def write_photo(path, camera, taken, iso=200):
+    """Writes a small JPEG with an EXIF block."""
+    exif = Image.Exif()
+    exif[0x010F] = camera.split()[0]  # Make
+    exif[0x0110] = camera  # Model
+    exif[0x0112] = 6  # Orientation
+    exif_ifd = exif.get_ifd(0x8769)
+    exif_ifd[0x9003] = taken  # DateTimeOriginal
+    exif_ifd[0x8827] = iso  # ISOSpeedRatings
+    exif_ifd[0x829A] = 0.004  # ExposureTime
+    Image.new("RGB", (64, 48), "gray").save(path, exif=exif)
+    return str(path)
+
+
+@pytest.fixture
+def photos(tmp_path):
+    """Fixture with three photos from two cameras, named out of capture order."""
+    return [
+        write_photo(tmp_path / "a.jpg", "Canon EOS R5", "2024:06:01 10:00:05"),
+        write_photo(tmp_path / "b.jpg", "NIKON Z 6", "2024:06:01 09:59:00"),
+        write_photo(tmp_path / "c.jpg", "Canon EOS R5", "2024:06:01 10:00:01"),
+    ]
+
+
+def test_read_metadata(photos):
+    """
+    Test that the capture metadata is read from the EXIF block
+    """
+    metadata = read_metadata(photos[0])
+    assert metadata["camera"] == "Canon EOS R5"
+    assert metadata["iso"] == 200
+    assert metadata["orientation"] == 6
+    assert metadata["shutter"] == pytest.approx(0.004)
+    assert metadata["capture_time"] is not None
+    assert describe(metadata) == "Canon EOS R5, ISO 200, 1/250s"
+
+
+def test_no_exif(tmp_path):
+    """
+    Test that files without EXIF give empty metadata instead of failing
+    """
+    path = str(tmp_path / "plain.png")
+    Image.new("L", (8, 8)).save(path)
+    assert read_exif_block(path) == (None, None)
+    assert read_metadata(path)["camera"] is None
+
+
+def test_order_and_group(photos, tmp_path):
+    """
+    Test ordering by capture time and grouping by camera, with the metadata cached between runs
+    """
+    cache = ScoreCache(str(tmp_path / "cache.db"))
+    metadata = MetadataIndexer(workers=2).index_all(photos, cache)
+    assert order_by_capture(photos, metadata) == [photos[1], photos[2], photos[0]]
+    assert group_by_camera(photos, metadata) == {
+        "Canon EOS R5": [photos[2], photos[0]],
+        "NIKON Z 6": [photos[1]],
+    }
+
+    indexer = MetadataIndexer(workers=2)
+    assert indexer.index_all(photos, cache) == metadata
+    assert indexer.timings == {}  # everything came from the cache
+    cache.close()
+
+
+if __name__ == "__main__":
+    pytest.main()
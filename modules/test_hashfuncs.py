@@ -0,0 +1,121 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the perceptual hashing and burst grouping functions.
+
+import struct
+import itertools
+import random
+import pytest
+import cv2
+import numpy as np
+from modules.hashfuncs import (
+    HashIndexer,
+    MultiIndexHash,
+    find_groups,
+    hamming,
+    sharpest_in_groups,
+)
+from modules.scorecache import ScoreCache
+
+
+@pytest.fixture(scope="module")
+def burst_paths(tmp_path_factory):
+    """Fixture to write three frames of a burst and one unrelated image."""
+    folder = tmp_path_factory.mktemp("burst_imgs")
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (480, 640), dtype=np.uint8), (31, 31), 8)
+    paths = []
+    for i in range(3):
+        frame = np.clip(base.astype(int) + rng.integers(-3, 4, base.shape), 0, 255)
+        paths.append(str(folder / f"burst{i}.png"))
+        cv2.imwrite(paths[-1], frame.astype(np.uint8))
+    other = cv2.GaussianBlur(rng.integers(0, 256, (480, 640), dtype=np.uint8), (31, 31), 8)
+    paths.append(str(folder / "other.png"))
+    cv2.imwrite(paths[-1], other)
+    return paths
+
+
+def test_burst_is_grouped(burst_paths, tmp_path):
+    """
+    Test that the burst frames form one group and that cached hashes are reused
+    """
+    cache = ScoreCache(str(tmp_path / "cache.db"))
+    hashes = HashIndexer(workers=1).hash_all(burst_paths, cache)
+    assert find_groups(hashes) == [[0, 1, 2]]
+
+    indexer = HashIndexer(workers=1)
+    assert indexer.hash_all(burst_paths, cache) == hashes
+    assert indexer.timings == {}  # nothing was hashed again
+    cache.close()
+
+
+def with_thumbnail(path, image, thumbnail):
+    """Writes image as a JPEG whose EXIF block carries thumbnail, like camera files."""
+    main = cv2.imencode(".jpg", image)[1].tobytes()
+    thumb = cv2.imencode(".jpg", thumbnail)[1].tobytes()
+    # Empty IFD0, IFD1 at offset 14 with the thumbnail location, thumbnail data at 44
+    tiff = b"II*\x00" + struct.pack("<IHI", 8, 0, 14)
+    tiff += struct.pack("<H", 2)
+    tiff += struct.pack("<HHII", 0x0201, 4, 1, 44)
+    tiff += struct.pack("<HHII", 0x0202, 4, 1, len(thumb))
+    tiff += struct.pack("<I", 0)
+    app1 = b"Exif\x00\x00" + tiff + thumb
+    with open(path, "wb") as file:
+        file.write(
+            main[:2] + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + main[2:]
+        )
+    return str(path)
+
+
+def test_thumbnail_does_not_change_hashes(burst_paths, tmp_path):
+    """
+    Test that a copy of an image carrying a letterboxed EXIF thumbnail hashes like the copy without one
+    """
+    image = cv2.imread(burst_paths[0], cv2.IMREAD_GRAYSCALE)
+    letterboxed = cv2.copyMakeBorder(
+        cv2.resize(image, (160, 90)), 15, 15, 0, 0, cv2.BORDER_CONSTANT, value=0
+    )
+    plain = str(tmp_path / "plain.jpg")
+    cv2.imwrite(plain, image)
+    camera = with_thumbnail(tmp_path / "camera.jpg", image, letterboxed)
+
+    hashes = HashIndexer(workers=1).hash_all([plain, camera])
+    assert hashes[0] == hashes[1]
+
+
+def test_multi_index_matches_brute_force():
+    """
+    Test that the multi-index search finds exactly the pairs an all-pairs comparison finds
+    """
+    rng = random.Random(1)
+    hashes = []
+    for i in range(300):
+        value = hashes[rng.randrange(len(hashes))] if i % 3 else rng.getrandbits(64)
+        for _ in range(rng.randrange(9)):
+            value ^= 1 << rng.randrange(64)
+        hashes.append(value)
+
+    index = MultiIndexHash(7)
+    found = set()
+    for i, value in enumerate(hashes):
+        found.update((j, i) for _, j in index.search(value))
+        index.add(value, i)
+
+    expected = {
+        (i, j)
+        for i, j in itertools.combinations(range(len(hashes)), 2)
+        if hamming(hashes[i], hashes[j]) <= 7
+    }
+    assert found == expected
+
+
+def test_sharpest_in_groups():
+    """
+    Test that only the sharpest frame of each group is kept
+    """
+    decisions = sharpest_in_groups([[0, 1, 2], [3, 4]], [5.0, 9.0, 1.0, None, 2.0])
+    assert decisions == {0: "Discard", 1: "Keep", 2: "Discard", 4: "Keep"}
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,107 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the manual sort journal.
+
+import os
+import time
+import pytest
+from modules import journalfuncs
+from modules.journalfuncs import JOURNAL_FILENAME, SortJournal
+
+
+def journal_lines(folder):
+    """Lines of the journal in a folder."""
+    with open(os.path.join(folder, JOURNAL_FILENAME), encoding="utf-8") as file:
+        return file.read().splitlines()
+
+
+def test_replay_restores_session(tmp_path):
+    """
+    Test that decisions and the last viewed image are restored by a new session, latest decision winning
+    """
+    folder = str(tmp_path)
+    journal = SortJournal(folder)
+    assert journal.replay() == ({}, None)
+    journal.record(os.path.join(folder, "a.jpg"), "Keep")
+    journal.record(os.path.join(folder, "sub", "b.jpg"), "Maybe")
+    journal.record(os.path.join(folder, "a.jpg"), "Discard")
+    journal.record_position(os.path.join(folder, "sub", "b.jpg"))
+    journal.close()
+
+    decisions, position = SortJournal(folder).replay()
+    assert decisions == {
+        os.path.join(folder, "a.jpg"): "Discard",
+        os.path.join(folder, "sub", "b.jpg"): "Maybe",
+    }
+    assert position == os.path.join(folder, "sub", "b.jpg")
+
+
+def test_torn_entry_is_dropped(tmp_path):
+    """
+    Test that an entry cut short by a crash is dropped, and the next entry still starts on its own line
+    """
+    folder = str(tmp_path)
+    with open(os.path.join(folder, JOURNAL_FILENAME), "w", encoding="utf-8") as file:
+        file.write('["Keep","a.jpg"]\n["Discard","b.j')
+
+    journal = SortJournal(folder)
+    decisions, _ = journal.replay()
+    assert decisions == {os.path.join(folder, "a.jpg"): "Keep"}
+    journal.record(os.path.join(folder, "c.jpg"), "Maybe")
+    journal.close()
+    assert journal_lines(folder) == ['["Keep","a.jpg"]', '["Maybe","c.jpg"]']
+
+
+def test_batched_fsync(tmp_path, monkeypatch):
+    """
+    Test that entries are forced to disk in batches rather than one by one
+    """
+    synced = []
+    monkeypatch.setattr(journalfuncs.os, "fsync", lambda fd: synced.append(fd))
+    journal = SortJournal(str(tmp_path))
+    journal.replay()
+    journal.last_sync = time.monotonic()
+    for i in range(journalfuncs.FSYNC_BATCH * 2):
+        journal.record(str(tmp_path / f"{i}.jpg"), "Keep")
+    assert len(synced) == 2
+    journal.close()
+
+
+def test_compaction(tmp_path, monkeypatch):
+    """
+    Test that a journal full of overwritten entries is rewritten with only the latest ones
+    """
+    monkeypatch.setattr(journalfuncs, "COMPACT_MIN", 50)
+    folder = str(tmp_path)
+    journal = SortJournal(folder)
+    journal.replay()
+    for i in range(60):
+        journal.record(
+            os.path.join(folder, f"{i % 5}.jpg"), "Keep" if i % 2 else "Discard"
+        )
+        journal.record_position(os.path.join(folder, f"{i % 5}.jpg"))
+    journal.close()
+
+    assert len(journal_lines(folder)) < 50
+    decisions, position = SortJournal(folder).replay()
+    assert len(decisions) == 5
+    assert decisions[os.path.join(folder, "4.jpg")] == "Keep"  # i = 59
+    assert position == os.path.join(folder, "4.jpg")
+
+
+def test_clear(tmp_path):
+    """
+    Test that a cleared journal starts the next session fresh but keeps recording
+    """
+    folder = str(tmp_path)
+    journal = SortJournal(folder)
+    journal.replay()
+    journal.record(os.path.join(folder, "a.jpg"), "Keep")
+    journal.clear()
+    journal.record(os.path.join(folder, "b.jpg"), "Maybe")
+    journal.close()
+    assert SortJournal(folder).replay()[0] == {os.path.join(folder, "b.jpg"): "Maybe"}
+
+
+if __name__ == "__main__":
+    pytest.main()
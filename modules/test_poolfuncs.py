@@ -0,0 +1,99 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests running per-image tasks on the cached worker pool.
+
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from modules.poolfuncs import POOL_CHUNK, CachedPool
+
+
+def _length_task(index, path, offset=0):
+    """Worker task returning the length of the path plus an offset."""
+    if path == "unreadable":
+        return index, None, 0.0
+    return index, len(path) + offset, 0.5
+
+
+@pytest.mark.parametrize("workers, use_processes", [(1, False), (3, False), (2, True)])
+def test_run_all(workers, use_processes):
+    """
+    Test that results come back in path order whatever the pool, with the task's extra arguments
+    """
+    paths = [f"{'x' * (i % 7)}.jpg" for i in range(POOL_CHUNK * 2 + 5)]
+    pool = CachedPool(_length_task, workers, use_processes)
+
+    assert pool.run_all(paths, (10,)) == [len(path) + 10 for path in paths]
+    assert len(pool.timings) == len(paths)
+
+
+def test_run_with_cache():
+    """
+    Test that cached images are not run, computed ones are stored, and unpack runs on every result
+    """
+    paths = ["a.jpg", "bb.jpg", "unreadable", "dddd.jpg"]
+    stored = []
+
+    def lookup(chunk):
+        hits = {i: 100 for i, path in enumerate(chunk) if path.startswith("b")}
+        return hits, [i for i in range(len(chunk)) if i not in hits]
+
+    def unpack(result, path):
+        index, value, seconds = result
+        return index, value and value * 2, seconds
+
+    pool = CachedPool(_length_task, workers=1)
+    timings = pool.timings
+    values = pool.run_all(paths, (), lookup, stored.extend, unpack)
+
+    assert values == [10, 100, None, 16]
+    assert stored == [("a.jpg", 10), ("unreadable", None), ("dddd.jpg", 16)]
+    # Only computed images are timed, in the dictionary callers were handed before the run
+    assert pool.timings is timings
+    assert sorted(timings) == [0, 2, 3]
+
+
+class _BreakingExecutor(ThreadPoolExecutor):
+    """Thread pool that fails like a broken process pool after a number of submits."""
+
+    def __init__(self, submits):
+        super().__init__(max_workers=2)
+        self.submits = submits
+
+    def submit(self, *args, **kwargs):
+        if self.submits == 0:
+            raise BrokenProcessPool("a worker died")
+        self.submits -= 1
+        return super().submit(*args, **kwargs)
+
+
+def test_run_broken_at_submit(monkeypatch):
+    """
+    Test that a pool that breaks while images are being queued finishes the run on threads
+    """
+    paths = [f"{'x' * (i % 7)}.jpg" for i in range(POOL_CHUNK + 5)]
+    monkeypatch.setattr(CachedPool, "_make_executor", lambda self: _BreakingExecutor(3))
+    pool = CachedPool(_length_task, workers=2)
+
+    assert pool.run_all(paths) == [len(path) for path in paths]
+
+
+def test_run_stopped_early_stores():
+    """
+    Test that images computed before a run is stopped are still stored
+    """
+    stored = []
+
+    def lookup(chunk):
+        return {}, range(len(chunk))
+
+    pool = CachedPool(_length_task, workers=1)
+    results = pool.run(["a.jpg", "bb.jpg", "ccc.jpg"], (), lookup, stored.extend)
+    assert next(results) == (0, 5)
+    results.close()
+
+    assert stored == [("a.jpg", 5)]
+
+
+if __name__ == "__main__":
+    pytest.main()
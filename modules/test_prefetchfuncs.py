@@ -0,0 +1,151 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the display cache and background prefetching.
+
+import threading
+import pytest
+from PIL import Image
+from modules.prefetchfuncs import BitmapCache, Prefetcher, image_bytes
+
+
+def make_image(width=100, height=100):
+    """Makes a blank RGB image."""
+    return Image.new("RGB", (width, height))
+
+
+def test_cache_evicts_least_recently_used():
+    """
+    Test that the cache stays within its budget and evicts the least recently used image first
+    """
+    image = make_image()
+    cache = BitmapCache(budget=image_bytes(image) * 2)
+    cache.put("a", image)
+    cache.put("b", make_image())
+    assert cache.get("a") is image  # "b" is now the least recently used
+    cache.put("c", make_image())
+
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    assert cache.size == image_bytes(image) * 2
+
+
+def test_cache_skips_oversized_image():
+    """
+    Test that an image larger than the whole budget is not cached
+    """
+    cache = BitmapCache(budget=100)
+    cache.put("a", make_image())
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_cache_hit_rate():
+    """
+    Test that lookups are counted towards the hit rate
+    """
+    cache = BitmapCache()
+    cache.put("a", make_image())
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+    cache.get("b", count=False)
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.hit_rate() == pytest.approx(2 / 3)
+    assert "2/3 hits" in cache.report()
+
+
+def test_window_wraps_around():
+    """
+    Test that the prefetch window is nearest first, wraps around, and leaves out the current image
+    """
+    prefetcher = Prefetcher(lambda path: make_image(), radius=2)
+    paths = [f"{i}.jpg" for i in range(10)]
+    assert prefetcher.window(paths, 0) == ["1.jpg", "9.jpg", "2.jpg", "8.jpg"]
+    assert prefetcher.window(paths[:2], 0) == ["1.jpg"]
+    assert prefetcher.window(paths[:1], 0) == []
+    prefetcher.close()
+
+
+def test_prefetch_makes_navigation_hit():
+    """
+    Test that images around the current one are decoded in the background, so viewing them is a cache hit
+    """
+    loaded = []
+    lock = threading.Lock()
+
+    def loader(path):
+        with lock:
+            loaded.append(path)
+        return make_image()
+
+    paths = [f"{i}.jpg" for i in range(10)]
+    prefetcher = Prefetcher(loader, radius=1)
+    prefetcher.get(paths[0])
+    prefetcher.prefetch(paths, 0)
+    prefetcher.executor.shutdown(wait=True)
+
+    assert prefetcher.cache.get(paths[1], count=False) is not None
+    assert prefetcher.cache.get(paths[9], count=False) is not None
+    prefetcher.get(paths[1])
+    assert (prefetcher.cache.hits, prefetcher.cache.misses) == (1, 1)
+    assert sorted(loaded) == sorted([paths[0], paths[1], paths[9]])
+    assert prefetcher.pending == {}
+
+
+def test_get_waits_for_running_decode():
+    """
+    Test that getting an image that is being decoded waits for that decode instead of starting another
+    """
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def loader(path):
+        calls.append(path)
+        started.set()
+        release.wait(5)
+        return make_image()
+
+    prefetcher = Prefetcher(loader, radius=1, workers=1)
+    prefetcher.prefetch(["a.jpg", "b.jpg"], 0)
+    assert started.wait(5)
+    threading.Timer(0.05, release.set).start()
+
+    assert prefetcher.get("b.jpg").size == (100, 100)
+    assert calls == ["b.jpg"]
+    prefetcher.close()
+
+
+def test_clear_empties_cache():
+    """
+    Test that clearing the prefetcher, such as for a new folder, drops the cached images and the hit rate
+    """
+    prefetcher = Prefetcher(lambda path: make_image())
+    prefetcher.get("a.jpg")
+    prefetcher.clear()
+    assert len(prefetcher.cache) == 0
+    assert prefetcher.cache.misses == 0
+    prefetcher.close()
+
+
+def test_request_skips_failed_images():
+    """
+    Test that an image the background decode could not read is not requested again
+    """
+    calls = []
+
+    def loader(path):
+        calls.append(path)
+        raise OSError("unreadable")
+
+    prefetcher = Prefetcher(loader, workers=1)
+    prefetcher.request(["bad.jpg"])
+    prefetcher.executor.shutdown(wait=True)
+    assert prefetcher.failed == {"bad.jpg"}
+    prefetcher.request(["bad.jpg"])
+    assert calls == ["bad.jpg"]
+    assert prefetcher.pending == {}
+
+
+if __name__ == "__main__":
+    pytest.main()
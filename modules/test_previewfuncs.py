@@ -0,0 +1,135 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests loading embedded EXIF previews instead of decoding full images.
+
+import io
+import struct
+import pytest
+import numpy as np
+from PIL import Image
+from modules.previewfuncs import (
+    PreviewStats,
+    decode_display,
+    fit_size,
+    load_preview,
+    preview_stats,
+    read_header,
+)
+
+
+def jpeg_bytes(image):
+    """Encodes a PIL image as JPEG."""
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def write_camera_jpeg(path, size, thumb_size, orientation=6):
+    """Writes a JPEG whose APP1 segment holds an orientation tag and an IFD1 thumbnail, like camera files."""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    main = jpeg_bytes(Image.fromarray(pixels))
+    thumb = jpeg_bytes(Image.fromarray(pixels).resize(thumb_size))
+
+    # IFD0 with the orientation at offset 8, IFD1 with the thumbnail location at 26, thumbnail data at 56
+    tiff = b"II*\x00" + struct.pack("<I", 8)
+    tiff += struct.pack("<H", 1) + struct.pack("<HHIHH", 0x0112, 3, 1, orientation, 0)
+    tiff += struct.pack("<I", 26)
+    tiff += struct.pack("<H", 2)
+    tiff += struct.pack("<HHII", 0x0201, 4, 1, 56)
+    tiff += struct.pack("<HHII", 0x0202, 4, 1, len(thumb))
+    tiff += struct.pack("<I", 0)
+    app1 = b"Exif\x00\x00" + tiff + thumb
+
+    with open(path, "wb") as file:
+        file.write(
+            main[:2] + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + main[2:]
+        )
+    return str(path)
+
+
+@pytest.fixture
+def camera_jpeg(tmp_path):
+    """Fixture with a 1600x1200 photo carrying a 160x120 thumbnail."""
+    return write_camera_jpeg(tmp_path / "camera.jpg", (1600, 1200), (160, 120))
+
+
+def test_read_header(camera_jpeg):
+    """
+    Test that the image size, orientation and thumbnail are found from the header
+    """
+    size, orientation, previews = read_header(camera_jpeg)
+    assert size == (1600, 1200)
+    assert orientation == 6
+    assert [preview[:2] for preview in previews] == [(160, 120)]
+
+
+def test_load_preview(camera_jpeg, tmp_path):
+    """
+    Test that small requests use the thumbnail and large ones fall back to a full decode, both oriented
+    """
+    stats_before = preview_stats.summary(str(tmp_path))
+
+    small = load_preview(camera_jpeg, (80, 80))
+    assert small.size == (60, 80)  # rotated to portrait
+    large = load_preview(camera_jpeg, (400, 400))
+    assert large.size == (300, 400)
+
+    summary = preview_stats.summary(str(tmp_path))
+    assert summary["hits"] == stats_before["hits"] + 1
+    assert summary["misses"] == stats_before["misses"] + 1
+    assert "Embedded previews: 1/2" in preview_stats.report(str(tmp_path))
+
+
+def test_stats_include_subfolders():
+    """
+    Test that a folder's report covers its subfolders
+    """
+    stats = PreviewStats()
+    stats.record("/photos/a.jpg", True, 0.01)
+    stats.record("/photos/card1/b.jpg", False, 0.2)
+    stats.record("/other/c.jpg", True, 0.01)
+    summary = stats.summary("/photos")
+    assert (summary["hits"], summary["misses"]) == (1, 1)
+    assert summary["seconds_saved"] == pytest.approx(0.19)
+
+
+def test_fit_size():
+    """
+    Test that images fit the box keeping their aspect ratio, and only grow when upscaling
+    """
+    assert fit_size((4000, 3000), (600, 600)) == (600, 450)
+    assert fit_size((3000, 4000), (600, 600)) == (450, 600)
+    assert fit_size((300, 200), (600, 600)) == (600, 400)
+    assert fit_size((300, 200), (600, 600), upscale=False) == (300, 200)
+
+
+def test_decode_display(camera_jpeg, tmp_path):
+    """
+    Test that display decodes are fitted, oriented, and match a full decode resized the slow way
+    """
+    image = decode_display(camera_jpeg, (400, 400))
+    assert image.size == (300, 400)  # rotated to portrait
+
+    path = str(tmp_path / "gradient.png")
+    gradient = np.tile(np.arange(0, 256, 256 / 1600, dtype=np.float32), (1200, 1))
+    Image.fromarray(gradient.astype(np.uint8)).convert("RGB").save(path)
+    fast = np.asarray(decode_display(path, (200, 200)), dtype=np.int16)
+    slow = Image.open(path).resize((200, 150), Image.Resampling.LANCZOS)
+    assert fast.shape == (150, 200, 3)
+    assert np.abs(fast - np.asarray(slow, dtype=np.int16)).max() <= 2
+
+
+def test_decode_display_converts_palette(tmp_path):
+    """
+    Test that palette images are converted so they can be resampled
+    """
+    path = str(tmp_path / "palette.gif")
+    Image.new("RGB", (64, 64), (200, 10, 10)).convert("P").save(path)
+    image = decode_display(path, (32, 32))
+    assert image.mode == "RGB"
+    assert image.size == (32, 32)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,101 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the tiled image pyramid used by the zoom view.
+
+import io
+import pytest
+from PIL import Image
+from modules.pyramidfuncs import ImagePyramid
+from modules.thumbcache import ThumbnailCache
+
+
+@pytest.fixture
+def photo(tmp_path):
+    """A 1000x600 photo, red on the left half and blue on the right."""
+    image = Image.new("RGB", (1000, 600), "red")
+    image.paste((0, 0, 255), (500, 0, 1000, 600))
+    path = tmp_path / "photo.jpg"
+    image.save(path, quality=95)
+    return str(path)
+
+
+def test_levels(photo):
+    """
+    Test that each level halves the one below it, down to one tile
+    """
+    pyramid = ImagePyramid(photo, "key", tile_size=256)
+    assert pyramid.size == (1000, 600)
+    assert pyramid.levels == 3
+    assert pyramid.level_size(0) == (1000, 600)
+    assert pyramid.level_size(1) == (500, 300)
+    assert pyramid.level_size(2) == (250, 150)
+    assert pyramid.level_for(4.0) == 0
+    assert pyramid.level_for(1.0) == 0
+    assert pyramid.level_for(0.6) == 0
+    assert pyramid.level_for(0.5) == 1
+    assert pyramid.level_for(0.01) == 2
+
+
+def test_visible_tiles(photo):
+    """
+    Test that only the tiles overlapping the box are listed, clipped to the level
+    """
+    pyramid = ImagePyramid(photo, "key", tile_size=256)
+    assert pyramid.visible_tiles(0, (300, 100, 600, 200)) == [(1, 0), (2, 0)]
+    assert len(pyramid.visible_tiles(0, (-50, -50, 5000, 5000))) == 4 * 3
+    assert pyramid.tile_box(0, 3, 2) == (768, 512, 1000, 600)
+
+
+def test_tiles_are_cached(photo, tmp_path):
+    """
+    Test that a built level is read back from the thumbnail cache by a new pyramid of the same image
+    """
+    cache = ThumbnailCache(root=str(tmp_path / "cache"))
+    pyramid = ImagePyramid(photo, "key", cache, tile_size=256)
+    assert pyramid.tile(0, 0, 0) is None  # starts a build
+    pyramid.building[0].result()
+    assert pyramid.tile(0, 3, 2).size == (232, 88)
+
+    reopened = ImagePyramid(photo, "key", cache, tile_size=256)
+    tile = reopened.tile(0, 3, 2)
+    assert tile.size == (232, 88)
+    assert not reopened.building
+    red, green, blue = tile.getpixel((100, 40))[:3]
+    assert blue > 200 and red < 50
+
+
+def test_fallback(photo):
+    """
+    Test that a missing tile is stood in for by the matching part of a coarser level
+    """
+    pyramid = ImagePyramid(photo, "key", tile_size=256)
+    assert pyramid.fallback(0, 3, 0) is None
+    pyramid.build_level(2)
+    stand_in = pyramid.fallback(0, 3, 0)
+    assert stand_in.size == (232, 256)
+    red, green, blue = stand_in.getpixel((100, 100))[:3]
+    assert blue > 200 and red < 50
+
+
+def test_orientation():
+    """
+    Test that the pyramid of a rotated photo is laid out upright
+    """
+    image = Image.new("RGB", (400, 200), "red")
+    image.paste((0, 0, 255), (0, 0, 200, 200))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotate 90 degrees clockwise
+    data = io.BytesIO()
+    image.save(data, "JPEG", exif=exif, quality=95)
+
+    pyramid = ImagePyramid(data.getvalue(), "key", tile_size=512)
+    assert pyramid.size == (200, 400)
+    pyramid.build_level(0)
+    tile = pyramid.tile(0, 0, 0)
+    assert tile.size == (200, 400)
+    red, green, blue = tile.getpixel((100, 100))[:3]
+    assert blue > 200 and red < 50
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,111 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the quality metrics and sorting rules used by the Blur Sort tab.
+
+import pytest
+import cv2
+import numpy as np
+from modules.qualityfuncs import (
+    QualityAnalyzer,
+    analyze_image,
+    exposure_stats,
+    noise_sigma,
+    parse_rules,
+    quality_decision,
+    rule_metrics,
+    tenengrad,
+)
+
+
+@pytest.fixture(scope="module")
+def image_path(tmp_path_factory):
+    """Fixture to write a test image with a clipped top half."""
+    folder = tmp_path_factory.mktemp("quality_imgs")
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (240, 320), dtype=np.uint8)
+    image[:120] = 255
+    path = str(folder / "clipped.png")
+    cv2.imwrite(path, image)
+    return path
+
+
+def test_noise_sigma():
+    """
+    Test that the noise estimate recovers the noise added to a flat image, with or without strips
+    """
+    rng = np.random.default_rng(1)
+    image = np.clip(128 + rng.normal(0, 10, (600, 800)), 0, 255).astype(np.uint8)
+    assert noise_sigma(image) == pytest.approx(10, rel=0.05)
+    assert noise_sigma(image, strip_rows=100) == pytest.approx(noise_sigma(image, strip_rows=1000))
+
+
+def test_tenengrad_matches_full_image():
+    """
+    Test that strip filtering gives the same Tenengrad as filtering the whole image
+    """
+    rng = np.random.default_rng(2)
+    image = rng.integers(0, 256, (300, 200), dtype=np.uint8)
+    gx = cv2.Sobel(image, cv2.CV_64F, 1, 0)
+    gy = cv2.Sobel(image, cv2.CV_64F, 0, 1)
+    assert tenengrad(image, strip_rows=64) == pytest.approx((gx**2 + gy**2).mean())
+
+
+def test_exposure_stats():
+    """
+    Test the clipping fractions and contrast read from the histogram
+    """
+    image = np.zeros((10, 10), dtype=np.uint8)
+    image[:3] = 255
+    stats = exposure_stats(image)
+    assert stats["highlights"] == pytest.approx(0.3)
+    assert stats["shadows"] == pytest.approx(0.7)
+    assert stats["contrast"] == pytest.approx(image.std() / 255)
+
+
+def test_analyze_image(image_path):
+    """
+    Test that only the requested metrics are computed, and that each one is timed
+    """
+    values, costs = analyze_image(image_path, ("laplacian", "exposure"))
+    assert set(values) == {"laplacian", "highlights", "shadows", "contrast"}
+    assert set(costs) == {"decode", "laplacian", "exposure"}
+    assert values["highlights"] >= 0.5
+
+    with pytest.raises(ValueError):
+        analyze_image(image_path, ("sharpness",))
+
+
+def test_quality_analyzer(image_path):
+    """
+    Test that the analyzer reports unreadable images and a per-metric cost
+    """
+    analyzer = QualityAnalyzer(workers=1)
+    results = dict(analyzer.analyze([image_path, image_path + ".missing"]))
+    assert results[1] is None
+    assert set(results[0]) >= {"laplacian", "tenengrad", "noise"}
+    assert "noise" in analyzer.cost_report()
+
+
+def test_rules():
+    """
+    Test parsing rules and combining them with the blur threshold
+    """
+    rules = parse_rules("tenengrad >= 400; highlights<=0.02")
+    assert rules == [("tenengrad", ">=", 400.0), ("highlights", "<=", 0.02)]
+    assert rule_metrics(rules) == ("laplacian", "tenengrad", "exposure")
+    assert parse_rules("") == []
+
+    values = {"laplacian": 150, "tenengrad": 500, "highlights": 0.01}
+    assert quality_decision(values, 100, rules) == "Keep"
+    assert quality_decision(dict(values, highlights=0.2), 100, rules) == "Discard"
+    assert quality_decision(dict(values, laplacian=50), 100, rules) == "Discard"
+    assert quality_decision(None, 100, rules) is None
+
+    with pytest.raises(ValueError):
+        parse_rules("sharpness > 3")
+    with pytest.raises(ValueError):
+        parse_rules("noise = 3")
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,88 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests scanning folders for images.
+
+import os
+import pytest
+from collections.abc import Iterator
+from modules.scanfuncs import scan_images, sniff_image
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """Fixture with images, non-images, a card subfolder and a Keep folder from an earlier sort."""
+    (tmp_path / "a.jpg").write_bytes(b"\xff\xd8\xff\xe0" + b"0" * 20)
+    (tmp_path / "b.png").write_bytes(b"\x89PNG\r\n\x1a\n" + b"0" * 20)
+    (tmp_path / "no_extension").write_bytes(b"\xff\xd8\xff\xe1" + b"0" * 20)
+    (tmp_path / "notes.jpg").write_bytes(b"not really a jpeg")
+    (tmp_path / ".photogenie_scores.db").write_bytes(b"SQLite format 3")
+
+    (tmp_path / "DCIM").mkdir()
+    (tmp_path / "DCIM" / "c.jpg").write_bytes(b"\xff\xd8\xff\xe0" + b"0" * 20)
+    (tmp_path / "Keep").mkdir()
+    (tmp_path / "Keep" / "a.jpg").write_bytes(b"\xff\xd8\xff\xe0" + b"0" * 20)
+    return tmp_path
+
+
+def names(paths, folder):
+    return sorted(str(path)[len(str(folder)) + 1 :] for path in paths)
+
+
+def test_sniff_image(folder):
+    """
+    Test that images are identified by content, not extension
+    """
+    assert sniff_image(str(folder / "a.jpg")) == "jpeg"
+    assert sniff_image(str(folder / "b.png")) == "png"
+    assert sniff_image(str(folder / "no_extension")) == "jpeg"
+    assert sniff_image(str(folder / "notes.jpg")) is None
+    assert sniff_image(str(folder / "missing.jpg")) is None
+
+
+def test_scan_images(folder):
+    """
+    Test flat, recursive and extension based scans
+    """
+    assert names(scan_images(str(folder)), folder) == ["a.jpg", "b.png", "no_extension"]
+    assert names(scan_images(str(folder), recursive=True), folder) == [
+        "DCIM/c.jpg",
+        "a.jpg",
+        "b.png",
+        "no_extension",
+    ]
+    assert names(scan_images(str(folder), sniff=False), folder) == [
+        "a.jpg",
+        "b.png",
+        "notes.jpg",
+    ]
+
+
+def test_scan_images_is_lazy(folder, monkeypatch):
+    """
+    Test that the scan is an iterator that reads each folder only once the images before it have been taken
+    """
+    read = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        read.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    scan = scan_images(str(folder), recursive=True)
+
+    assert isinstance(scan, Iterator)
+    assert read == []
+
+    # The three images at the top level come from the first folder read alone
+    for _ in range(3):
+        next(scan)
+    assert read == [str(folder)]
+
+    assert next(scan) == str(folder / "DCIM" / "c.jpg")
+    assert read == [str(folder), str(folder / "DCIM")]
+    scan.close()
+
+
+if __name__ == "__main__":
+    pytest.main()
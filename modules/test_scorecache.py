@@ -0,0 +1,111 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the on-disk blur score cache.
+
+import os
+import pytest
+from modules.scorecache import METADATA_FIELDS, ScoreCache
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """Fixture with three small files standing in for images."""
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        (tmp_path / name).write_bytes(name.encode() * 10)
+    return tmp_path
+
+
+def test_lookup_and_store(folder):
+    """
+    Test that stored values come back as hits and unknown files as misses
+    """
+    paths = [str(folder / name) for name in ("a.jpg", "b.jpg", "c.jpg")]
+    cache = ScoreCache.for_folder(str(folder))
+
+    hits, missing = cache.lookup(paths)
+    assert hits == {}
+    assert missing == [0, 1, 2]
+
+    cache.store([(paths[0], 10.0), (paths[1], 20.0), (paths[2], None)])
+    hits, missing = cache.lookup(paths)
+
+    assert hits == {0: 10.0, 1: 20.0}
+    assert missing == [2]
+
+    # Values at another scale are separate entries
+    hits, missing = cache.lookup(paths, scale=4)
+    assert hits == {}
+    cache.close()
+
+
+def test_modified_file_is_rescored(folder):
+    """
+    Test that a changed file is a miss, unless only its mtime changed and hashing is enabled
+    """
+    path = str(folder / "a.jpg")
+    cache = ScoreCache.for_folder(str(folder), use_hash=True)
+    cache.store([(path, 10.0)])
+
+    # Same contents, new mtime
+    os.utime(path, ns=(1, 1))
+    hits, missing = cache.lookup([path])
+    assert hits == {0: 10.0}
+
+    # New contents
+    (folder / "a.jpg").write_bytes(b"changed")
+    hits, missing = cache.lookup([path])
+    assert missing == [0]
+    cache.close()
+
+
+def test_eviction(folder):
+    """
+    Test that the least recently used entries are evicted past max_entries
+    """
+    paths = [str(folder / name) for name in ("a.jpg", "b.jpg", "c.jpg")]
+    cache = ScoreCache.for_folder(str(folder), max_entries=2)
+    cache.store([(paths[0], 1.0)])
+    cache.store([(paths[1], 2.0)])
+    cache.store([(paths[2], 3.0)])
+
+    hits, missing = cache.lookup(paths)
+    assert missing == [0]
+    cache.close()
+
+
+def test_hashes(folder):
+    """
+    Test that perceptual hashes above 2**63 survive SQLite's signed integers
+    """
+    paths = [str(folder / name) for name in ("a.jpg", "b.jpg")]
+    cache = ScoreCache.for_folder(str(folder))
+    cache.store_hashes([(paths[0], (2**64 - 1, 5)), (paths[1], None)])
+
+    hits, missing = cache.lookup_hashes(paths)
+    assert hits == {0: (2**64 - 1, 5)}
+    assert missing == [1]
+    cache.close()
+
+
+def test_schema_change_drops_every_table(folder):
+    """
+    Test that a cache written under another schema version has no hits left in any table
+    """
+    paths = [str(folder / "a.jpg")]
+    cache = ScoreCache.for_folder(str(folder))
+    cache.store([(paths[0], 10.0)])
+    cache.store_hashes([(paths[0], (1, 2))])
+    cache.store_metadata([(paths[0], {field: None for field in METADATA_FIELDS})])
+    cache.connection.execute("PRAGMA user_version = 1")
+    cache.connection.commit()
+    cache.close()
+
+    cache = ScoreCache.for_folder(str(folder))
+    assert cache.lookup(paths) == ({}, [0])
+    assert cache.lookup_hashes(paths) == ({}, [0])
+    assert cache.lookup_metadata(paths) == ({}, [0])
+    cache.close()
+
+
+if __name__ == "__main__":
+    pytest.main()
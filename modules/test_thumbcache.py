@@ -0,0 +1,139 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests the on-disk thumbnail cache.
+
+import io
+import os
+import threading
+import pytest
+import numpy as np
+from PIL import Image
+from modules.thumbcache import EVICT_TARGET, ThumbnailCache, content_key, path_key
+
+
+@pytest.fixture
+def photo(tmp_path):
+    """Fixture to write a 1200x800 photo."""
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / "photo.png")
+    Image.fromarray(rng.integers(0, 256, (800, 1200, 3), dtype=np.uint8)).save(path)
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Fixture with an empty cache."""
+    return ThumbnailCache(root=str(tmp_path / "thumbs"))
+
+
+def stored_files(cache):
+    """Thumbnail files in the cache folder."""
+    return [
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(cache.root)
+        for filename in filenames
+    ]
+
+
+def test_tier_for(cache):
+    """
+    Test that requests are served from the smallest tier covering them
+    """
+    assert cache.tier_for((80, 80)) == 160
+    assert cache.tier_for((400, 300)) == 400
+    assert cache.tier_for((600, 600)) == 640
+    assert cache.tier_for((5000, 3000)) is None
+
+
+def test_load_reads_through(cache, photo):
+    """
+    Test that the first load decodes and stores a tier, and the second is served from it
+    """
+    first = cache.load(photo, (400, 300))
+    assert first.size == (400, 266)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert len(stored_files(cache)) == 1
+
+    # A new cache object on the same folder, like a second launch, finds the thumbnail
+    reopened = ThumbnailCache(root=cache.root)
+    second = reopened.load(photo, (300, 300))
+    assert second.size[0] == 300
+    assert second.size[1] in (199, 200)  # rounded from the stored 400x266
+    assert (reopened.hits, reopened.misses) == (1, 0)
+
+
+def test_key_changes_with_file(photo):
+    """
+    Test that editing a file gives it a new key
+    """
+    key = path_key(photo)
+    os.utime(photo, ns=(0, 10**9))
+    assert path_key(photo) != key
+
+
+def test_load_data(cache):
+    """
+    Test that images held in memory are cached by their contents
+    """
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 600), (10, 20, 30)).save(buffer, "JPEG")
+    data = buffer.getvalue()
+
+    assert cache.load_data(data, (400, 300)).size == (400, 300)
+    assert cache.load_data(data, (400, 300)).size == (400, 300)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert os.path.basename(stored_files(cache)[0]).startswith(content_key(data))
+
+
+def test_upscale(cache, tmp_path):
+    """
+    Test that small images are only enlarged when asked to
+    """
+    path = str(tmp_path / "small.png")
+    Image.new("RGB", (100, 50)).save(path)
+    assert cache.load(path, (400, 400)).size == (100, 50)
+    assert cache.load(path, (400, 400), upscale=True).size == (400, 200)
+
+
+def test_evict_least_recently_used(cache, photo):
+    """
+    Test that eviction removes the least recently used thumbnails until the cache is below its quota, and stale
+    temporary files
+    """
+    for box in [(160, 160), (400, 400), (640, 640)]:
+        cache.load(photo, box)
+    # The 160 tier was used longest ago, the 640 tier most recently
+    for path in stored_files(cache):
+        tier = int(os.path.relpath(path, cache.root).split(os.sep)[0])
+        os.utime(path, (tier, tier))
+    stale = os.path.join(cache.root, "160", "stale.tmp")
+    open(stale, "wb").close()
+    os.utime(stale, (0, 0))
+
+    newest = max(stored_files(cache), key=os.path.getmtime)
+    cache.quota = int(os.path.getsize(newest) / EVICT_TARGET) + 1
+    assert cache.evict() == 3
+    assert stored_files(cache) == [newest]
+
+
+def test_concurrent_writers(cache, photo):
+    """
+    Test that threads storing the same thumbnail at once leave one complete file and no temporary files
+    """
+    image = Image.open(photo).resize((640, 426))
+    key = path_key(photo)
+    threads = [
+        threading.Thread(target=cache.write, args=(key, 640, image)) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    files = stored_files(cache)
+    assert len(files) == 1
+    assert cache.read(key, 640).size == (640, 426)
+
+
+if __name__ == "__main__":
+    pytest.main()
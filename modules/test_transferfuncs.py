@@ -0,0 +1,224 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This python file is a test file that tests transferring sorted photos and undoing a cull.
+
+import os
+import json
+import pytest
+from modules.transferfuncs import (
+    TransferEngine,
+    TransferManifest,
+    latest_manifest,
+    revert_manifest,
+    transfer_file,
+)
+
+
+@pytest.fixture
+def folder(tmp_path):
+    """Fixture with two photos and a Keep folder."""
+    (tmp_path / "a.jpg").write_bytes(b"photo a")
+    (tmp_path / "b.jpg").write_bytes(b"photo b")
+    (tmp_path / "Keep").mkdir()
+    return tmp_path
+
+
+@pytest.mark.parametrize("strategy", ["copy", "hardlink", "reflink", "move"])
+def test_transfer_file(folder, strategy):
+    """
+    Test that every strategy puts the file in the folder, falling back to a copy when unsupported
+    """
+    src = str(folder / "a.jpg")
+    dest, method = transfer_file(src, str(folder / "Keep"), strategy)
+
+    assert dest == str(folder / "Keep" / "a.jpg")
+    assert open(dest, "rb").read() == b"photo a"
+    assert method in (strategy, "copy")
+    assert os.path.exists(src) == (method != "move")
+
+    if method == "hardlink":
+        assert os.path.samefile(src, dest)
+
+
+def test_transfer_file_unknown_strategy(folder):
+    """
+    Test that an unknown strategy raises a ValueError
+    """
+    with pytest.raises(ValueError):
+        transfer_file(str(folder / "a.jpg"), str(folder / "Keep"), "teleport")
+
+
+def test_revert_manifest(folder):
+    """
+    Test that a move-based cull is put back by its manifest
+    """
+    manifest = TransferManifest(str(folder), "move")
+    manifest.transfer(str(folder / "a.jpg"), str(folder / "Keep"))
+    manifest.transfer(str(folder / "b.jpg"), str(folder / "Keep"))
+    manifest.close()
+
+    assert not (folder / "a.jpg").exists()
+
+    manifest_path = latest_manifest(str(folder))
+    assert manifest_path == manifest.path
+    assert revert_manifest(manifest_path) == 2
+
+    assert (folder / "a.jpg").read_bytes() == b"photo a"
+    assert (folder / "b.jpg").read_bytes() == b"photo b"
+    assert os.listdir(folder / "Keep") == []
+    assert latest_manifest(str(folder)) is None
+
+
+def test_revert_manifest_keeps_failures(folder):
+    """
+    Test that a transfer that cannot be reverted is reported and kept in the manifest, and the rest are reverted
+    """
+    manifest = TransferManifest(str(folder), "copy")
+    manifest.transfer(str(folder / "a.jpg"), str(folder / "Keep"))
+    manifest.transfer(str(folder / "b.jpg"), str(folder / "Keep"))
+    manifest.close()
+
+    # A folder in place of the copy cannot be removed as a file
+    os.remove(folder / "Keep" / "a.jpg")
+    (folder / "Keep" / "a.jpg").mkdir()
+
+    assert revert_manifest(manifest.path) == 1
+    assert not (folder / "Keep" / "b.jpg").exists()
+    with open(manifest.path, encoding="utf-8") as file:
+        assert [json.loads(line)["src"] for line in file] == [str(folder / "a.jpg")]
+
+
+def test_latest_manifest_kind(folder):
+    """
+    Test that a sort and a cull of the same folder each find only their own manifest
+    """
+    sort = TransferManifest(str(folder), "copy")
+    sort.close()
+    cull = TransferManifest(str(folder), "copy", kind="cull")
+    cull.close()
+
+    assert latest_manifest(str(folder)) == sort.path
+    assert latest_manifest(str(folder), kind="cull") == cull.path
+
+
+def test_latest_manifest_without_folder(folder, monkeypatch):
+    """
+    Test that no folder finds no manifest, rather than one in the working directory
+    """
+    TransferManifest(str(folder), "copy").close()
+    monkeypatch.chdir(folder)
+
+    assert latest_manifest(None) is None
+    assert latest_manifest("") is None
+
+
+@pytest.mark.parametrize("strategy", ["copy", "hardlink", "reflink", "move"])
+def test_transfer_same_name_in_subfolders(tmp_path, strategy):
+    """
+    Test that images with the same name in different subfolders keep their subfolders,
+    that an existing file is never replaced and that undo restores all of them
+    """
+    for card in ("100CANON", "101CANON"):
+        (tmp_path / "DCIM" / card).mkdir(parents=True)
+        (tmp_path / "DCIM" / card / "IMG_0001.jpg").write_bytes(card.encode())
+    (tmp_path / "Keep" / "DCIM" / "100CANON").mkdir(parents=True)
+    (tmp_path / "Keep" / "DCIM" / "100CANON" / "IMG_0001.jpg").write_bytes(b"earlier")
+
+    manifest = TransferManifest(str(tmp_path), strategy)
+    dests = [
+        manifest.transfer(
+            str(tmp_path / "DCIM" / card / "IMG_0001.jpg"), str(tmp_path / "Keep")
+        )[0]
+        for card in ("100CANON", "101CANON")
+    ]
+    manifest.close()
+
+    keep = tmp_path / "Keep" / "DCIM"
+    assert dests == [
+        str(keep / "100CANON" / "IMG_0001 (1).jpg"),
+        str(keep / "101CANON" / "IMG_0001.jpg"),
+    ]
+    assert (keep / "100CANON" / "IMG_0001.jpg").read_bytes() == b"earlier"
+    assert (keep / "100CANON" / "IMG_0001 (1).jpg").read_bytes() == b"100CANON"
+    assert (keep / "101CANON" / "IMG_0001.jpg").read_bytes() == b"101CANON"
+
+    assert revert_manifest(manifest.path) == 2
+    for card in ("100CANON", "101CANON"):
+        assert (tmp_path / "DCIM" / card / "IMG_0001.jpg").read_bytes() == card.encode()
+    assert os.listdir(keep / "100CANON") == ["IMG_0001.jpg"]
+
+
+def test_transfer_engine_same_name(tmp_path):
+    """
+    Test that concurrent transfers of files with the same name into one folder all survive
+    """
+    for i in range(10):
+        (tmp_path / str(i)).mkdir()
+        (tmp_path / str(i) / "a.jpg").write_bytes(str(i).encode())
+    (tmp_path / "Keep").mkdir()
+    jobs = [
+        (str(tmp_path / str(i) / "a.jpg"), str(tmp_path / "Keep")) for i in range(10)
+    ]
+
+    # The sources are outside the root, so every file lands directly in Keep
+    manifest = TransferManifest(str(tmp_path), "copy", root=str(tmp_path / "Keep"))
+    engine = TransferEngine(manifest, concurrency=4)
+    engine.start(jobs)
+    messages = wait_for_done(engine)
+
+    dests = [message[3] for message in messages if message[0] == "file"]
+    assert len(set(dests)) == 10
+    assert sorted(os.listdir(tmp_path / "Keep")) == sorted(
+        os.path.basename(d) for d in dests
+    )
+    assert {open(d, "rb").read() for d in dests} == {str(i).encode() for i in range(10)}
+
+
+def wait_for_done(engine):
+    """Collects the engine's progress messages until it reports it is done."""
+    messages = []
+    while True:
+        message = engine.progress.get(timeout=10)
+        messages.append(message)
+        if message[0] == "done":
+            return messages
+
+
+def test_transfer_engine(folder):
+    """
+    Test that the engine transfers every file, reports errors and counts throughput
+    """
+    for i in range(20):
+        (folder / f"{i}.jpg").write_bytes(b"x" * 100)
+    jobs = [(str(folder / f"{i}.jpg"), str(folder / "Keep")) for i in range(20)]
+    jobs.append((str(folder / "missing.jpg"), str(folder / "Keep")))
+
+    engine = TransferEngine(TransferManifest(str(folder), "copy"), concurrency=3)
+    engine.start(jobs)
+    messages = wait_for_done(engine)
+
+    stats = messages[-1][1]
+    assert stats["files"] == 20
+    assert stats["bytes"] == 2000
+    assert stats["errors"] == 1
+    assert not stats["cancelled"]
+    assert sum(message[0] == "file" for message in messages) == 20
+    assert len(os.listdir(folder / "Keep")) == 20
+
+
+def test_transfer_engine_cancel(folder):
+    """
+    Test that a cancelled engine stops without transferring the remaining files
+    """
+    jobs = [(str(folder / "a.jpg"), str(folder / "Keep"))] * 50
+    engine = TransferEngine(TransferManifest(str(folder), "copy"), concurrency=1)
+    engine.cancel()
+    engine.start(jobs)
+    stats = wait_for_done(engine)[-1][1]
+
+    assert stats["cancelled"]
+    assert stats["files"] == 0
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,391 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module keeps display-sized copies of photos on disk, shared by every tab and kept between launches,
+# so a folder that was viewed before shows its images without decoding the originals again. Thumbnails come in a few
+# size tiers, are named after their image's path, size and modification time (or the hash of its contents for images
+# from the database), and the least recently used ones are removed once the cache goes over its disk quota.
+
+import io
+import os
+import sys
+import time
+import hashlib
+import tempfile
+import threading
+from PIL import Image, features
+
+from modules.previewfuncs import decode_display, load_preview
+
+# Longest side of each stored size. A request is served from the smallest tier that covers it
+THUMBNAIL_TIERS = (160, 400, 640, 1280, 2560)
+
+# Disk space the cache may use, in bytes
+THUMBNAIL_QUOTA = 2 * 1024 * 1024 * 1024
+
+# Eviction trims the cache to this fraction of the quota, so it does not run again after every write
+EVICT_TARGET = 0.9
+
+# Fraction of the quota written between eviction passes
+EVICT_INTERVAL = 0.05
+
+# Last-used times are only refreshed once this many seconds have passed, saving a write per read
+TOUCH_INTERVAL = 60 * 60
+
+# Temporary files older than this were left by a writer that crashed
+STALE_TEMP_SECONDS = 60 * 60
+
+# WebP is smaller at the same quality, JPEG is used when Pillow was built without it
+THUMBNAIL_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+THUMBNAIL_EXTENSION = ".webp" if THUMBNAIL_FORMAT == "WEBP" else ".jpg"
+THUMBNAIL_QUALITY = 85
+
+
+def cache_root():
+    """
+    Folder the thumbnail cache is kept in. PHOTOGENIE_CACHE overrides the platform's cache folder
+
+    :rtype: str
+    """
+    if os.environ.get("PHOTOGENIE_CACHE"):
+        return os.environ["PHOTOGENIE_CACHE"]
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "photogenie", "thumbnails")
+
+
+def path_key(image_path):
+    """
+    Cache key of an image file, from its full path, size and modification time. Editing the file gives it a new key
+
+    :param image_path: path to the image file
+    :type image_path: str
+
+    :return: hex key
+    :rtype: str
+    """
+    stat = os.stat(image_path)
+    name = f"{os.path.realpath(image_path)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+    return hashlib.sha1(name.encode("utf-8", "surrogateescape")).hexdigest()
+
+
+def content_key(data):
+    """
+    Cache key of an image held in memory, such as one read from the database
+
+    :param data: encoded image
+    :type data: bytes
+
+    :return: hex key
+    :rtype: str
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class ThumbnailCache:
+    def __init__(self, root=None, quota=THUMBNAIL_QUOTA, tiers=THUMBNAIL_TIERS):
+        """
+        Initialize the ThumbnailCache class. Several windows and processes can share one cache folder: thumbnails
+        are written to a temporary file and renamed into place, so a reader never sees a partial file
+
+        :param root: cache folder, defaults to cache_root()
+        :type root: str | None
+        :param quota: disk space the cache may use, in bytes
+        :type quota: int
+        :param tiers: longest side of each stored size, smallest first
+        :type tiers: tuple
+        """
+        self.root = root or cache_root()
+        self.quota = quota
+        self.tiers = tiers
+        self.hits = 0
+        self.misses = 0
+        self.written = 0  # bytes written since the last eviction pass
+        self.lock = threading.Lock()
+        self.evicting = False
+        os.makedirs(self.root, exist_ok=True)
+
+    def tier_for(self, size):
+        """
+        Smallest tier covering a box
+
+        :param size: (width, height) box
+        :type size: tuple
+
+        :return: longest side of the tier, or None if the box is larger than every tier
+        :rtype: int | None
+        """
+        for tier in self.tiers:
+            if tier >= max(size):
+                return tier
+        return None
+
+    def _path(self, key, tier):
+        return os.path.join(self.root, str(tier), key[:2], key + THUMBNAIL_EXTENSION)
+
+    def _tile_path(self, key, level, column, row):
+        return os.path.join(
+            self.root,
+            "tiles",
+            key[:2],
+            key,
+            str(level),
+            f"{column}_{row}{THUMBNAIL_EXTENSION}",
+        )
+
+    def read(self, key, tier):
+        """
+        Reads a stored thumbnail and marks it as recently used
+
+        :param key: key from path_key or content_key
+        :type key: str
+        :param tier: longest side of the tier
+        :type tier: int
+
+        :return: the thumbnail, or None if it is not stored
+        :rtype: PIL.Image.Image | None
+        """
+        return self._read_file(self._path(key, tier))
+
+    def read_tile(self, key, level, column, row):
+        """
+        Reads a stored tile of an image pyramid and marks it as recently used
+
+        :param key: key from path_key or content_key
+        :type key: str
+        :param level: pyramid level, 0 for full resolution
+        :type level: int
+        :param column: column of the tile
+        :type column: int
+        :param row: row of the tile
+        :type row: int
+
+        :return: the tile, or None if it is not stored
+        :rtype: PIL.Image.Image | None
+        """
+        return self._read_file(self._tile_path(key, level, column, row))
+
+    def _read_file(self, path):
+        try:
+            image = Image.open(path)
+            image.load()
+            if time.time() - os.stat(path).st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except (OSError, SyntaxError):
+            # Missing, removed by an eviction in the meantime, or unreadable
+            return None
+        return image
+
+    def write(self, key, tier, image):
+        """
+        Stores a thumbnail. Concurrent writers of the same thumbnail each rename a complete file into place
+
+        :param key: key from path_key or content_key
+        :type key: str
+        :param tier: longest side of the tier
+        :type tier: int
+        :param image: the thumbnail, at most tier pixels on its longest side
+        :type image: PIL.Image.Image
+        """
+        self._write_file(self._path(key, tier), image)
+
+    def write_tile(self, key, level, column, row, image):
+        """
+        Stores a tile of an image pyramid, evicted along with the thumbnails when the cache is over its quota
+
+        :param key: key from path_key or content_key
+        :type key: str
+        :param level: pyramid level, 0 for full resolution
+        :type level: int
+        :param column: column of the tile
+        :type column: int
+        :param row: row of the tile
+        :type row: int
+        :param image: the tile
+        :type image: PIL.Image.Image
+        """
+        self._write_file(self._tile_path(key, level, column, row), image)
+
+    def _write_file(self, path, image):
+        folder = os.path.dirname(path)
+        if THUMBNAIL_FORMAT == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        try:
+            os.makedirs(folder, exist_ok=True)
+            descriptor, temp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, "wb") as file:
+                    image.save(file, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+                size = os.path.getsize(temp_path)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except OSError as e:
+            print(f"Could not store thumbnail: {e}")
+            return
+
+        with self.lock:
+            self.written += size
+            start_evict = (
+                self.written >= self.quota * EVICT_INTERVAL and not self.evicting
+            )
+            if start_evict:
+                self.evicting = True
+        if start_evict:
+            threading.Thread(target=self.evict, daemon=True).start()
+
+    def _load(self, key, size, upscale, decode):
+        """
+        Shared by load and load_data. Reads the tier covering size, or decodes and stores it on a miss,
+        then fits it to size
+        """
+        tier = self.tier_for(size)
+        if tier is None:
+            # Larger than any stored size, such as fullscreen on a very large screen
+            return decode(size)
+
+        image = self.read(key, tier)
+        with self.lock:
+            if image is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if image is None:
+            image = decode((tier, tier))
+            self.write(key, tier, image)
+        # Thumbnails are stored upright
+        return decode_display(image, size, orientation=1, upscale=upscale)
+
+    def load(self, image_path, size, upscale=False):
+        """
+        Loads an image file fitted to a box, from the cache when it was shown before at a similar size.
+        Misses are read from an embedded preview when one is large enough
+
+        :param image_path: path to the image file
+        :type image_path: str
+        :param size: (width, height) box the image has to fit
+        :type size: tuple
+        :param upscale: scale small images up to the box
+        :type upscale: bool
+
+        :return: the image, oriented for display
+        :rtype: PIL.Image.Image
+        """
+        return self._load(
+            path_key(image_path),
+            size,
+            upscale,
+            lambda box: load_preview(image_path, box),
+        )
+
+    def load_data(self, data, size, upscale=False, key=None):
+        """
+        Loads an image held in memory fitted to a box, from the cache when it was shown before at a similar size
+
+        :param data: encoded image
+        :type data: bytes
+        :param size: (width, height) box the image has to fit
+        :type size: tuple
+        :param upscale: scale small images up to the box
+        :type upscale: bool
+        :param key: key of the image, computed from data when None
+        :type key: str | None
+
+        :return: the image, oriented for display
+        :rtype: PIL.Image.Image
+        """
+        return self._load(
+            key or content_key(data),
+            size,
+            upscale,
+            lambda box: decode_display(io.BytesIO(data), box, upscale=False),
+        )
+
+    def evict(self):
+        """
+        Removes the least recently used thumbnails until the cache is below its quota, and temporary files
+        left by crashed writers
+
+        :return: number of files removed
+        :rtype: int
+        """
+        files = []
+        removed = 0
+        now = time.time()
+        try:
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                        if filename.endswith(".tmp"):
+                            if now - stat.st_mtime > STALE_TEMP_SECONDS:
+                                os.remove(path)
+                                removed += 1
+                            continue
+                    except OSError:
+                        continue  # removed by another process in the meantime
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in files)
+            if total > self.quota:
+                files.sort()
+                for _, size, path in files:
+                    if total <= self.quota * EVICT_TARGET:
+                        break
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+                    total -= size
+        finally:
+            with self.lock:
+                self.written = 0
+                self.evicting = False
+        return removed
+
+    def hit_rate(self):
+        """
+        Fraction of loads served from the cache
+
+        :rtype: float
+        """
+        loads = self.hits + self.misses
+        return self.hits / loads if loads else 0.0
+
+    def report(self):
+        """
+        Formats the hit rate as one line of text
+
+        :return: Report text
+        :rtype: str
+        """
+        return (
+            f"Thumbnail cache: {self.hits}/{self.hits + self.misses} hits "
+            f"({self.hit_rate():.0%})"
+        )
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache():
+    """
+    The thumbnail cache used by every tab. Created on first use, when it also trims the cache left by
+    earlier launches in the background
+
+    :rtype: ThumbnailCache
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = ThumbnailCache()
+            _shared_cache.evicting = True
+            threading.Thread(target=_shared_cache.evict, daemon=True).start()
+        return _shared_cache
@@ -0,0 +1,401 @@
+# Authors: Branden Bulatao, Matthew Kribs
+# Date: 12/2024
+# Description: This module moves sorted photos into their Keep, Discard, and Maybe folders. Besides copying, it can hardlink,
+# reflink (copy-on-write) or move files without rewriting their data, and records every transfer in a manifest so a cull can be undone.
+
+import os
+import sys
+import json
+import time
+import queue
+import errno
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copy2, copystat  # copy2 preserves more metadata
+
+# Transfer strategies, in the order they are offered to the user
+STRATEGIES = ("copy", "hardlink", "reflink", "move")
+
+# Names shown in the sorting tabs' dropdowns
+STRATEGY_LABELS = {
+    "Copy": "copy",
+    "Hardlink": "hardlink",
+    "Reflink (copy-on-write)": "reflink",
+    "Move": "move",
+}
+
+# Manifests are written inside the folder being sorted, named by the kind of run that wrote them
+# ("sort" for Blur Sort and the command line, "cull" for Manual Sort) so each tab undoes only its own runs
+MANIFEST_PREFIX = ".photogenie_manifest_"
+
+# Linux ioctl that clones a file's extents (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+
+# Files transferred at once. SSDs and network shares like more, spinning disks fewer
+DEFAULT_CONCURRENCY = 4
+
+
+def _reflink(src, dest):
+    """
+    Creates dest as a copy-on-write clone of src. Raises OSError if the filesystem cannot clone
+
+    :param src: path to the source file
+    :type src: str
+    :param dest: path of the new file
+    :type dest: str
+    """
+    if sys.platform.startswith("linux"):
+        import fcntl
+
+        with open(src, "rb") as src_file, open(dest, "xb") as dest_file:
+            try:
+                fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+            except OSError:
+                dest_file.close()
+                os.remove(dest)
+                raise
+    elif sys.platform == "darwin":
+        import ctypes
+
+        libc = ctypes.CDLL("libc.dylib", use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dest), 0) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+    else:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    copystat(src, dest)
+
+
+def _claim(dest):
+    """
+    Reserves a destination by creating it as an empty file. If the name is taken,
+    " (1)", " (2)", ... is added before the extension until a free name is found
+
+    :param dest: preferred path of the new file
+    :type dest: str
+
+    :return: path that was reserved
+    :rtype: str
+    """
+    base, ext = os.path.splitext(dest)
+    n = 0
+    while True:
+        candidate = f"{base} ({n}){ext}" if n else dest
+        try:
+            # O_EXCL makes the check and the creation one step, so two workers never get the same name
+            os.close(os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return candidate
+        except FileExistsError:
+            n += 1
+
+
+def transfer_file(src, dest_folder, strategy="copy", root=None):
+    """
+    Transfers one file into a folder. Any strategy that the filesystem refuses
+    (different drive, no copy-on-write support) falls back to a copy. An existing
+    file is never replaced, the new one gets a numbered name instead
+
+    :param src: path to the file
+    :type src: str
+    :param dest_folder: folder the file goes into
+    :type dest_folder: str
+    :param strategy: one of STRATEGIES
+    :type strategy: str
+    :param root: folder that was sorted. The file keeps its subfolders below it, so
+        images with the same name in different subfolders do not collide
+    :type root: str | None
+
+    :return: path of the new file and the method that was actually used
+    :rtype: tuple
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unsupported transfer strategy: {strategy}")
+
+    name = os.path.basename(src)
+    if root:
+        relative = os.path.relpath(src, root)
+        if not relative.startswith(os.pardir + os.sep):
+            name = relative
+    preferred = os.path.join(dest_folder, name)
+    os.makedirs(os.path.dirname(preferred), exist_ok=True)
+
+    if strategy == "move":
+        dest = _claim(preferred)
+        try:
+            # Atomic rename over the empty file reserved above, only possible within one filesystem
+            os.replace(src, dest)
+            return dest, "move"
+        except OSError as e:
+            os.remove(dest)
+            if e.errno != errno.EXDEV:
+                raise
+    elif strategy in ("hardlink", "reflink"):
+        # Links cannot be made over a reserved file, so they are made under a free name
+        # and a name taken by another transfer in the meantime is simply skipped
+        while True:
+            dest = _claim(preferred)
+            os.remove(dest)
+            try:
+                if strategy == "hardlink":
+                    os.link(src, dest)
+                else:
+                    _reflink(src, dest)
+                return dest, strategy
+            except FileExistsError:
+                continue
+            except (OSError, NotImplementedError) as e:
+                if isinstance(e, (FileNotFoundError, PermissionError)):
+                    raise
+                print(f"{strategy} failed for {src}, copying instead: {e}")
+                break
+
+    dest = _claim(preferred)
+    try:
+        copy2(src, dest)
+    except BaseException:
+        # Do not leave a reserved name or a partial copy behind
+        os.remove(dest)
+        raise
+    return dest, "copy"
+
+
+class TransferManifest:
+    def __init__(self, folder_path, strategy, root=None, kind="sort"):
+        """
+        Initialize the TransferManifest class. Each transfer is appended as one JSON line,
+        so the manifest is usable even if the sort is interrupted
+
+        :param folder_path: folder the manifest is written in, usually the folder being sorted
+        :type folder_path: str
+        :param strategy: strategy requested for this run
+        :type strategy: str
+        :param root: folder being sorted, whose subfolders are kept in the destination. Defaults to folder_path
+        :type root: str | None
+        :param kind: kind of run, "sort" or "cull", used to find the manifest again with latest_manifest
+        :type kind: str
+        """
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.path = os.path.join(
+            folder_path, f"{MANIFEST_PREFIX}{kind}_{timestamp}.jsonl"
+        )
+        self.strategy = strategy
+        self.root = root or folder_path
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.lock = threading.Lock()  # transfers can run on several threads
+
+    def transfer(self, src, dest_folder):
+        """
+        Transfers a file with the manifest's strategy and records it
+
+        :param src: path to the file
+        :type src: str
+        :param dest_folder: folder the file goes into
+        :type dest_folder: str
+
+        :return: path of the new file and the method that was actually used
+        :rtype: tuple
+        """
+        dest, method = transfer_file(src, dest_folder, self.strategy, self.root)
+        with self.lock:
+            self.file.write(
+                json.dumps({"src": src, "dest": dest, "method": method}) + "\n"
+            )
+            self.file.flush()
+        return dest, method
+
+    def close(self):
+        """
+        Close the manifest file.
+        """
+        self.file.close()
+
+
+class TransferEngine:
+    def __init__(self, manifest, concurrency=DEFAULT_CONCURRENCY):
+        """
+        Initialize the TransferEngine class. Transfers run on a bounded thread pool in the background,
+        and every result is put on a queue that the GUI polls from its own thread:
+        ("file", src, dest_folder, dest, method, seconds), ("error", src, dest_folder, message) and finally ("done", stats)
+
+        :param manifest: manifest the transfers are recorded in
+        :type manifest: TransferManifest
+        :param concurrency: number of files transferred at once
+        :type concurrency: int
+        """
+        self.manifest = manifest
+        self.concurrency = max(int(concurrency), 1)
+        self.progress = queue.Queue()
+        self._cancel = threading.Event()
+        self._jobs = queue.Queue()
+        self._thread = None
+
+        # Per-run statistics
+        self.total = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.errors = 0
+        self.start_time = None
+        self.end_time = None
+        self._stats_lock = threading.Lock()
+
+    def start(self, jobs):
+        """
+        Starts transferring in the background
+
+        :param jobs: (source path, destination folder) pairs
+        :type jobs: list
+        """
+        for job in jobs:
+            self._jobs.put(job)
+        self.total = len(jobs)
+        self.start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """
+        Stops after the files currently being transferred. Nothing is left half written
+        """
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _run(self):
+        """
+        Runs the workers and reports ("done", stats) once all of them have stopped
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for _ in range(self.concurrency):
+                executor.submit(self._worker)
+        self.end_time = time.perf_counter()
+        self.manifest.close()
+        self.progress.put(("done", self.stats()))
+
+    def _worker(self):
+        """
+        Takes jobs until the queue is empty or the run is cancelled
+        """
+        while not self._cancel.is_set():
+            try:
+                src, dest_folder = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                start = time.perf_counter()
+                size = os.path.getsize(src)
+                dest, method = self.manifest.transfer(src, dest_folder)
+                seconds = time.perf_counter() - start
+                with self._stats_lock:
+                    self.files_done += 1
+                    self.bytes_done += size
+                self.progress.put(("file", src, dest_folder, dest, method, seconds))
+            except Exception as e:
+                with self._stats_lock:
+                    self.errors += 1
+                self.progress.put(("error", src, dest_folder, str(e)))
+
+    def stats(self):
+        """
+        Throughput of the run so far
+
+        :return: files, bytes, errors, elapsed seconds, files per second and MB per second
+        :rtype: dict
+        """
+        end = self.end_time or time.perf_counter()
+        elapsed = end - self.start_time if self.start_time else 0.0
+        return {
+            "files": self.files_done,
+            "total": self.total,
+            "bytes": self.bytes_done,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "elapsed": elapsed,
+            "files_per_sec": self.files_done / elapsed if elapsed else 0.0,
+            "mb_per_sec": self.bytes_done / 2**20 / elapsed if elapsed else 0.0,
+        }
+
+
+def format_stats(stats):
+    """
+    Formats TransferEngine statistics as one line of text
+
+    :param stats: result of TransferEngine.stats
+    :type stats: dict
+
+    :return: Statistics text
+    :rtype: str
+    """
+    return (
+        f"{stats['files']}/{stats['total']} files in {stats['elapsed']:.1f}s "
+        f"({stats['files_per_sec']:.1f} files/s, {stats['mb_per_sec']:.1f} MB/s)"
+    )
+
+
+def latest_manifest(folder_path, kind="sort"):
+    """
+    Finds the most recent manifest of one kind in a folder
+
+    :param folder_path: folder that was sorted
+    :type folder_path: str
+    :param kind: kind of run the manifest was written by, "sort" or "cull"
+    :type kind: str
+
+    :return: path to the manifest, None if there is none or no folder was given
+    :rtype: str | None
+    """
+    # os.listdir would list the working directory instead
+    if not folder_path:
+        return None
+    prefix = f"{MANIFEST_PREFIX}{kind}_"
+    manifests = sorted(
+        name for name in os.listdir(folder_path) if name.startswith(prefix)
+    )
+    if not manifests:
+        return None
+    return os.path.join(folder_path, manifests[-1])
+
+
+def revert_manifest(manifest_path):
+    """
+    Undoes the transfers recorded in a manifest, newest first. Moved files go back to where they were,
+    copies and links are deleted. The manifest is removed once everything is reverted, otherwise it keeps
+    the entries that failed
+
+    :param manifest_path: path to the manifest
+    :type manifest_path: str
+
+    :return: Number of transfers reverted
+    :rtype: int
+    """
+    with open(manifest_path, encoding="utf-8") as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+
+    reverted = 0
+    failed = []
+    try:
+        while entries:
+            entry = entries[-1]
+            try:
+                if entry["method"] == "move":
+                    os.replace(entry["dest"], entry["src"])
+                else:
+                    os.remove(entry["dest"])
+                reverted += 1
+            except OSError as e:
+                print(f"Unable to revert {entry['dest']}: {e}")
+                failed.append(entry)
+            entries.pop()
+    finally:
+        # Keep only what is left to revert, in the original order, even if the undo stops part way
+        remaining = entries + failed[::-1]
+        if remaining:
+            with open(manifest_path, "w", encoding="utf-8") as file:
+                for entry in remaining:
+                    file.write(json.dumps(entry) + "\n")
+        else:
+            os.remove(manifest_path)
+    return reverted